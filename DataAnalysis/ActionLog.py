@@ -0,0 +1,266 @@
+"""This module stores the action states of a scenario in one columnar log instead of one "key ; value" csv file per
+frame. Every recorded frame adds a row with the state, controls, physics and sensor transforms of the ego vehicle and,
+if there is an anomaly, a row with its kinematics. The rows are kept in memory during the scenario and written once as
+numpy structured arrays with a fixed schema, so a whole scenario is read with one np.load instead of parsing thousands
+of csv files. The type ids and the semantic tags have no fixed size, their columns are as wide as the widest value of
+the scenario. The static attributes of the anomaly actor (e.g. its size) are stored once per scenario.
+
+File layout (npz, no pickled objects):
+    ego_vehicle     structured array of VEHICLE_STATE_COLUMNS, one row per frame
+    anomaly         structured array of VEHICLE_STATE_COLUMNS (anomaly vehicle of SUDDEN_BREAKING_OF_VEHICLE_AHEAD) or
+                    ANOMALY_STATE_COLUMNS, one row per frame with an anomaly
+    metadata        json: version, scenario id, anomaly schema and attributes
+
+export_csv writes the per-frame ACTION and ANOMALY csv files of the previous output layout from a log."""
+import json
+import os
+
+import numpy as np
+
+ACTION_LOG_FILE_NAME = "ACTION_LOG.npz"
+"""Name of the action log of a scenario, stored in the scenario folder."""
+
+FORMAT_VERSION = 1
+
+VEHICLE_STATE_COLUMNS = [
+    # (column, dtype, key of the action dict and the csv file), "<U" columns are sized by row_dtype
+    ("frame_id", "<i8", "frame_id"),
+    ("vehicle_id", "<i8", "vehicle_id"),
+    ("vehicle_type_id", "<U", "vehicle_type_id"),
+    ("speed", "<f8", "speed"),
+    ("throttle", "<f8", "throttle"),
+    ("steer", "<f8", "steer"),
+    ("brake", "<f8", "brake"),
+    ("hand_brake", "?", "hand_brake"),
+    ("reverse", "?", "reverse"),
+    ("gear", "<i4", "gear"),
+    ("max_rpm", "<f8", "max_rpm"),
+    ("final_ratio", "<f8", "final_ratio"),
+    ("mass", "<f8", "mass"),
+    ("center_of_mass", ("<f8", (3,)), "center_of_mass"),
+    ("steering_curve", ("<f8", (2, 2)), "steering_curve"),
+    ("fr_wheel_max_steer_angle", "<f8", "FR_wheel max steer angle"),
+    ("fl_wheel_max_steer_angle", "<f8", "FL_wheel max steer angle"),
+    ("br_wheel_max_steer_angle", "<f8", "BR_wheel max steer angle"),
+    ("bl_wheel_max_steer_angle", "<f8", "BL_wheel max steer angle"),
+    ("fr_wheel_tire_friction", "<f8", "FR_wheel tire friction"),
+    ("fl_wheel_tire_friction", "<f8", "FL_wheel tire friction"),
+    ("br_wheel_tire_friction", "<f8", "BR_wheel tire friction"),
+    ("bl_wheel_tire_friction", "<f8", "BL_wheel tire friction"),
+    ("camera_matrix", ("<f8", (4, 4)), "camera transformation matrix"),
+    ("camera_inverse_matrix", ("<f8", (4, 4)), "camera inverse transformation matrix"),
+    ("lidar_matrix", ("<f8", (4, 4)), "lidar transformation matrix"),
+    ("lidar_inverse_matrix", ("<f8", (4, 4)), "lidar inverse transformation matrix"),
+]
+
+ANOMALY_STATE_COLUMNS = [
+    ("frame_id", "<i8", "frame_id"),
+    ("anomaly_id", "<i8", "anomaly_id"),
+    ("anomaly_type_id", "<U", "anomaly_type_id"),
+    ("anomaly_is_alive", "?", "anomaly_is_alive"),
+    ("semantic_tags", "<i4", "semantic_tags"),  # list column, padded with -1
+    ("location", ("<f8", (3,)), "location"),
+    ("velocity", ("<f8", (3,)), "velocity"),
+    ("acceleration", ("<f8", (3,)), "acceleration"),
+]
+
+LIST_COLUMNS = {"semantic_tags"}
+"""Columns with a list of values per row, stored as wide as the longest list of the log and padded with -1."""
+
+SCHEMAS = {
+    "vehicle": VEHICLE_STATE_COLUMNS,
+    "anomaly": ANOMALY_STATE_COLUMNS,
+}
+
+LEGACY_SUBFOLDERS = {"ego_vehicle": "ACTION", "anomaly": "ANOMALY"}
+"""Subfolders of the per-frame csv files of the previous output layout, see export_csv"""
+
+
+# ======================================================================================================================
+# region -- ROWS -------------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def _column_value(name, value):
+    if name in LIST_COLUMNS:
+        return [int(item) for item in value]
+    return value
+
+
+def to_row(columns, values):
+    """
+    Returns the row of the dict values (an action or anomaly dict) for columns, see to_array.
+    """
+    return tuple(_column_value(name, values[key]) for name, _, key in columns)
+
+
+def row_dtype(columns, rows):
+    """
+    Returns the structured dtype of the rows of columns. The "<U" columns and the list columns are as wide as their
+    longest value in rows (at least 1), so no type id or semantic tag is cut off.
+    """
+    fields = []
+    for i, (name, dtype, _) in enumerate(columns):
+        if dtype == "<U" or name in LIST_COLUMNS:
+            width = max(1, max((len(row[i]) for row in rows), default=0))
+            dtype = f"<U{width}" if dtype == "<U" else (dtype, (width,))
+        fields.append((name, dtype))
+    return np.dtype(fields)
+
+
+def to_array(columns, rows):
+    """
+    Returns the rows of columns (see to_row) as a structured array of row_dtype, the lists are padded with -1.
+    """
+    dtype = row_dtype(columns, rows)
+    list_widths = {i: dtype[name].shape[0] for i, (name, _, _) in enumerate(columns) if name in LIST_COLUMNS}
+    if list_widths:
+        rows = [
+            tuple(value + [-1] * (list_widths[i] - len(value)) if i in list_widths else value
+                  for i, value in enumerate(row))
+            for row in rows
+        ]
+    return np.array(rows, dtype=dtype)
+
+
+def _legacy_value(name, value):
+    if name == "steering_curve":
+        # the csv files of the previous output layout stored the two points of the steering curve in this format
+        (x_0, y_0), (x_1, y_1) = value.tolist()
+        return f"{x_0},{y_0})", f"({x_1}/{y_1}"
+    if name in LIST_COLUMNS:
+        return [item for item in value.tolist() if item >= 0]
+    if value.ndim == 2:
+        return value.tolist()
+    if value.ndim == 1:
+        return tuple(value.tolist())
+    return value.item()
+
+
+def to_legacy_dict(columns, row, scenario_id, attributes=None):
+    """
+    Returns the action or anomaly dict of a row, with the keys and values of the previous per-frame csv files.
+    """
+    # the scenario id followed the frame id, the first column of both schemas
+    values = {"frame_id": int(row["frame_id"]), "scenario_id": scenario_id}
+    for name, _, key in columns[1:]:
+        values[key] = _legacy_value(name, row[name])
+    if attributes:
+        values.update(attributes)
+    return values
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- ACTION LOG -------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class ActionLog:
+    """
+    The rows of the action log of one scenario, kept in memory until save() writes them at the end of the scenario.
+    """
+
+    def __init__(self, scenario_id):
+        self.scenario_id = scenario_id
+        self.anomaly_schema = None
+        self.anomaly_attributes = None
+        self._ego_vehicle_rows = list()
+        self._anomaly_rows = list()
+
+    def __len__(self):
+        return len(self._ego_vehicle_rows)
+
+    def append(self, action_dict, anomaly_dict=None):
+        """
+        Adds the action dict of the ego vehicle of a frame and the anomaly dict of the frame, if there is one.
+        """
+        self._ego_vehicle_rows.append(to_row(VEHICLE_STATE_COLUMNS, action_dict))
+        if anomaly_dict is None:
+            return
+        if self.anomaly_schema is None:
+            self.anomaly_schema = "vehicle" if "vehicle_id" in anomaly_dict else "anomaly"
+            columns = SCHEMAS[self.anomaly_schema]
+            # everything else are the blueprint attributes of the anomaly actor, they do not change
+            keys = {"scenario_id"} | {key for _, _, key in columns}
+            self.anomaly_attributes = {key: value for key, value in anomaly_dict.items() if key not in keys}
+        self._anomaly_rows.append(to_row(SCHEMAS[self.anomaly_schema], anomaly_dict))
+
+    def save(self, path):
+        """
+        Writes the log to path, an npz file.
+        """
+        metadata = {
+            "version": FORMAT_VERSION,
+            "scenario_id": self.scenario_id,
+            "anomaly_schema": self.anomaly_schema,
+            "anomaly_attributes": self.anomaly_attributes,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ego_vehicle=to_array(VEHICLE_STATE_COLUMNS, self._ego_vehicle_rows),
+                anomaly=to_array(SCHEMAS[self.anomaly_schema or "anomaly"], self._anomaly_rows),
+                metadata=np.array(json.dumps(metadata)),
+            )
+
+
+class ActionLogReader:
+    """
+    Reads an action log. ego_vehicle and anomaly are the structured arrays of the log, sorted by frame id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path, allow_pickle=False) as log:
+            metadata = json.loads(log["metadata"].item())
+            self.ego_vehicle = np.sort(log["ego_vehicle"], order="frame_id", kind="stable")
+            self.anomaly = np.sort(log["anomaly"], order="frame_id", kind="stable")
+        if metadata["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported action log version {metadata['version']} of {path}")
+        self.scenario_id = metadata["scenario_id"]
+        self.anomaly_schema = metadata["anomaly_schema"]
+        self.anomaly_attributes = metadata["anomaly_attributes"] or dict()
+
+    def legacy_dicts(self, table):
+        """
+        Yields the dicts of the rows of table ("ego_vehicle" or "anomaly") as they were written to the csv files of the
+        previous output layout.
+        """
+        if table == "ego_vehicle":
+            columns, rows, attributes = VEHICLE_STATE_COLUMNS, self.ego_vehicle, None
+        else:
+            columns = SCHEMAS[self.anomaly_schema or "anomaly"]
+            rows, attributes = self.anomaly, self.anomaly_attributes
+        for row in rows:
+            yield to_legacy_dict(columns, row, self.scenario_id, attributes)
+
+
+def read_anomaly_attributes(path):
+    """
+    anomaly_type_id and size of the anomaly of the action log path, as the evaluation reads them from the ANOMALY csv
+    files of the previous output layout.
+    """
+    values = next(ActionLogReader(path).legacy_dicts("anomaly"), dict())
+    return {key: str(values[key]) for key in ("anomaly_type_id", "size") if key in values}
+
+
+def export_csv(path, output_dir=None):
+    """
+    Writes the per-frame ACTION and ANOMALY csv files of the previous output layout from the action log path into
+    output_dir, by default the scenario folder of the log. Returns the number of written files.
+    """
+    reader = ActionLogReader(path)
+    output_dir = output_dir or os.path.dirname(os.path.abspath(path))
+    written = 0
+    for table, subfolder in LEGACY_SUBFOLDERS.items():
+        for values in reader.legacy_dicts(table):
+            os.makedirs(os.path.join(output_dir, subfolder), exist_ok=True)
+            file_path = os.path.join(output_dir, subfolder, f"{subfolder}_{values['frame_id']}.csv")
+            with open(file_path, "w") as f:
+                for key, value in values.items():
+                    f.write(f"{key} ; {value}\n")
+            written += 1
+    return written
+
+# endregion
+# ======================================================================================================================
@@ -8,9 +8,14 @@ import cv2 as cv
 import numpy as np
 
 import Definitions
+from DataAnalysis import Profiler
 from FileStructureManager import create_file_name
 from Models.Models import FrameData
 from Models.World import World
+from Models.World.SpatialIndex import SegmentGridIndex
+
+ROUTE_THICKNESS = 16
+"""Width of the route line in the route map in px"""
 
 
 # ======================================================================================================================
@@ -18,55 +23,77 @@ from Models.World import World
 # ======================================================================================================================
 def generate_data(
         scenario_id,
-        frame_id
+        frame_id,
+        ev_transform=None,
+        output_path=None
 ):
     """
-    Generate data for a given scenario and frame.
+    Generate data for a given scenario and frame. ev_transform is the transform of the ego vehicle in this frame, it
+    is read from the simulator if not given. The route map is written into the scenario folder in output_path (default
+    FileStructureManager.THIS_OUTPUT_PATH).
     """
     logging.debug("Start Generating BEV")
 
-    frame_data = FrameData(frame_id, scenario_id)
+    frame_data = FrameData(frame_id, scenario_id, output_path)
     logging.debug(f"Frame Number: {frame_data.frame_id}")
 
-    frame_data.route_map = route_map()
+    with Profiler.phase("bev_route_map"):
+        frame_data.route_map = route_map(ev_transform)
     dataformat = Definitions.DataFormat.ROUTE_MAP
+    if Definitions.BEV_ROUTE_MAP_PACKED:
+        file_ending = Definitions.DataFormat.ROUTE_MAP_PACKED.value
+    else:
+        file_ending = dataformat.value
     file_path = create_file_name(
         frame_id=frame_data.frame_id,
         scenario_id=frame_data.scenario_id,
         subfolder=dataformat.name,
-        file_ending=dataformat.value
+        file_ending=file_ending,
+        output_path=frame_data.output_path
     )
 
     frame_data.set_route_map(file_path, frame_data.route_map)
-    frame_data.save_route_map()
+    with Profiler.phase("save_files"):
+        frame_data.save_route_map(packed=Definitions.BEV_ROUTE_MAP_PACKED)
 
     logging.debug("BEV Generation Successful")
     return frame_data
 
 
-def route_map():
+def route_map(ev_transform=None):
     """
-    This method creates a black & white mask of the planned path of the ego vehicle.
+    This method creates a black & white mask of the planned path of the ego vehicle. Only the route segments that can
+    reach the BEV window are warped and drawn, see RouteRaster.
     """
-    ev_transform = World.WORLD_STATE.EGO_VEHICLE.get_transform()
+    if ev_transform is None:
+        ev_transform = World.WORLD_STATE.EGO_VEHICLE.get_transform()
     ev_loc = ev_transform.location
     ev_rot = ev_transform.rotation
     M_warp = _get_warp_transform(ev_loc, ev_rot)
 
     # Route Mask
     route_mask = np.zeros([Definitions.BEV_WIDTH, Definitions.BEV_WIDTH], dtype=np.uint8)
-    route_in_pixel = np.array([[_world_to_pixel(wp.transform.location)]
-                               for wp, _ in World.WORLD_STATE.EGO_VEHICLE_ROUTE])
-    route_warped = cv.transform(route_in_pixel, M_warp)
-    cv.polylines(route_mask, [np.round(route_warped).astype(np.int32)], False, 1, thickness=16)
+    route_runs = get_route_raster().runs_in_window(M_warp)
+    if route_runs:
+        route_warped = [np.round(cv.transform(run, M_warp)).astype(np.int32) for run in route_runs]
+        cv.polylines(route_mask, route_warped, False, 1, thickness=ROUTE_THICKNESS)
     route_mask = route_mask.astype(bool)
     return route_mask
 
 
+def unpack_route_map(packed_route_mask):
+    """
+    Returns the boolean route mask of shape (BEV_WIDTH, BEV_WIDTH) of a route map written with BEV_ROUTE_MAP_PACKED,
+    which holds 8 pixels of a row per byte.
+    """
+    return np.unpackbits(packed_route_mask, axis=-1, count=Definitions.BEV_WIDTH).astype(bool)
+
+
 def _world_to_pixel(location, projective=False):
     """Converts the world coordinates to pixel coordinates"""
-    x = Definitions.BEV_PIXELS_PER_METER * (location.x - World.WORLD_STATE.world_offset[0])
-    y = Definitions.BEV_PIXELS_PER_METER * (location.y - World.WORLD_STATE.world_offset[1])
+    # in double precision, the float32 world offset would make numpy 2 compute in single precision
+    x = Definitions.BEV_PIXELS_PER_METER * (location.x - float(World.WORLD_STATE.world_offset[0]))
+    y = Definitions.BEV_PIXELS_PER_METER * (location.y - float(World.WORLD_STATE.world_offset[1]))
 
     if projective:
         p = np.array([x, y, 1], dtype=np.float32)
@@ -98,3 +125,69 @@ def _get_warp_transform(ev_loc, ev_rot):
 
 # endregion
 # ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- ROUTE RASTER -----------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class RouteRaster:
+    """
+    The route of the ego vehicle in pixel coordinates of the BEV map, converted once per route, and a grid index over
+    its segments. Per frame only the segments whose thick line can reach the BEV window are drawn.
+    """
+
+    def __init__(self, route, world_offset):
+        self.route = route
+        self.world_offset = np.array(world_offset, dtype=np.float64)
+        locations = np.array(
+            [(wp.transform.location.x, wp.transform.location.y) for wp, _ in route], dtype=np.float64
+        ).reshape(-1, 2)
+        # same arithmetic as _world_to_pixel (in double precision, cast once), so the pixels match the full polyline
+        self.points = (Definitions.BEV_PIXELS_PER_METER * (locations - self.world_offset)).astype(np.float32)
+        self.index = SegmentGridIndex(self.points, cell_size=Definitions.BEV_WIDTH)
+
+    def matches(self, route, world_offset):
+        return route is self.route and np.array_equal(self.world_offset, world_offset)
+
+    def runs_in_window(self, M_warp):
+        """
+        Returns the route points of all segments that can reach the BEV window of the warp transform M_warp, as runs of
+        consecutive points of shape (<number of points>, 1, 2).
+        """
+        if len(self.points) < 2:
+            return [self.points.reshape(-1, 1, 2)] if len(self.points) else []
+
+        # the BEV window in pixel coordinates of the map, grown by the line thickness and the rounding of the points
+        window = np.array([[0, 0], [Definitions.BEV_WIDTH, 0], [0, Definitions.BEV_WIDTH],
+                           [Definitions.BEV_WIDTH, Definitions.BEV_WIDTH]], dtype=np.float64)
+        M_inverse = cv.invertAffineTransform(M_warp)
+        corners = window @ M_inverse[:, :2].T + M_inverse[:, 2]
+        margin = ROUTE_THICKNESS + 2
+        segments = self.index.segments_in_box(corners.min(axis=0) - margin, corners.max(axis=0) + margin)
+        if not len(segments):
+            return []
+
+        # consecutive segments are drawn as one polyline, like the full route
+        breaks = np.flatnonzero(np.diff(segments) != 1) + 1
+        return [
+            self.points[run[0]:run[-1] + 2].reshape(-1, 1, 2)
+            for run in np.split(segments, breaks)
+        ]
+
+
+_ROUTE_RASTER = None
+
+
+def get_route_raster():
+    """
+    Returns the route raster of the current route of the ego vehicle, it is rebuilt once the route or the world offset
+    change, e.g. for the next scenario.
+    """
+    global _ROUTE_RASTER
+    route = World.WORLD_STATE.EGO_VEHICLE_ROUTE
+    if _ROUTE_RASTER is None or not _ROUTE_RASTER.matches(route, World.WORLD_STATE.world_offset):
+        _ROUTE_RASTER = RouteRaster(route, World.WORLD_STATE.world_offset)
+    return _ROUTE_RASTER
+
+# endregion
+# ======================================================================================================================
@@ -6,6 +6,8 @@ import logging
 import numpy as np
 
 import Definitions
+from DataAnalysis import Profiler, VoxelGenerator
+from DataAnalysis.FrameSlots import acquire_frame_slot
 from EgoVehicleSetup import SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE, INSTANCE_CAM_TYPE
 from FileStructureManager import create_file_name
 from Models.Models import FrameData
@@ -21,29 +23,38 @@ def generate_data(
         sensor_transforms,
         id_labels,
         tick_count,
-        anomaly_type
+        anomaly_type,
+        camera_params=None,
+        output_path=None
 ):
     """
-    Generate data for a given scenario and frame.
+    Generate data for a given scenario and frame. camera_params are the image_width, image_height and camera_fov of
+    the depth camera of every sensor pose, they are needed for the online voxelization. The files are written into the
+    scenario folder in output_path (default FileStructureManager.THIS_OUTPUT_PATH).
     """
     logging.debug("Start Generating Data")
 
-    frame_data = FrameData(frame_id, scenario_id)
+    frame_data = FrameData(frame_id, scenario_id, output_path)
     logging.debug(f"Frame Number: {frame_data.frame_id}")
 
     # unpack sensor callbacks
     for sensor_callback_dict in sensor_callbacks:
         logging.debug(f'Generating Data for Sensor Type: {sensor_callback_dict["sensor"]}')
         try:
-            sensor_callback_dict["callback"](frame_data)
+            with Profiler.phase("sensor_decode"):
+                sensor_callback_dict["callback"](frame_data)
             logging.debug("Data Generation Successful")
         except Exception as e:
             logging.error(
                 "Exception while generating raw sensor data\n%s",
                 e,
             )
+            frame_data.release_slots()
             return
 
+    # one new label per instance, if an instance was added more than once, the latest label counts
+    instance_ids, new_labels = get_relabel_lookup(id_labels)
+
     for location_rotation in sensor_transforms:
         camera_transform = sensor_transforms[location_rotation]['camera']
         lidar_transform = sensor_transforms[location_rotation]['lidar']
@@ -52,35 +63,32 @@ def generate_data(
         camera_transform_inverse = camera_transform.get_inverse_matrix()
         lidar_transform = lidar_transform.get_matrix()
 
-        semantic_img_arr = frame_data.sensor_data[location_rotation][SEMANTIC_CAM_TYPE]['data']
+        sensor_data = frame_data.sensor_data[location_rotation]
+        point_ids = sensor_data[SEMANTIC_LIDAR_TYPE]['point_ids']
 
-        semantic_pcd = None
-        for label in id_labels:
-            pcd_mask = get_lidar_mask(
-                label.instance_id,
-                frame_data.sensor_data[location_rotation][SEMANTIC_LIDAR_TYPE]['point_ids']
-            )
-            semantic_img_arr = relabel_semantic_img(
-                semantic_img_arr,
-                frame_data.sensor_data[location_rotation][INSTANCE_CAM_TYPE]['data'],
-                pcd_mask,
+        # all relabels of this frame are applied at once, the lidar points are projected into the camera only once
+        with Profiler.phase("relabel_semantic_img"):
+            sensor_data[SEMANTIC_CAM_TYPE]['data'] = relabel_semantic_img(
+                sensor_data[SEMANTIC_CAM_TYPE]['data'],
+                sensor_data[INSTANCE_CAM_TYPE]['data'],
+                point_ids,
                 camera_transform_inverse,
                 lidar_transform,
-                label.semantic_id,
-                tick_count,
-                label.label_type,
-                anomaly_type
+                instance_ids,
+                new_labels
             )
-            semantic_pcd = relabel_pcd(
-                frame_data.sensor_data[location_rotation][SEMANTIC_LIDAR_TYPE]['data'],
-                frame_data.sensor_data[location_rotation][SEMANTIC_LIDAR_TYPE]['point_ids'],
-                label.instance_id,
-                label.semantic_id,
-                tick_count
+        with Profiler.phase("relabel_pcd"):
+            sensor_data[SEMANTIC_LIDAR_TYPE]['data'] = relabel_pcd(
+                sensor_data[SEMANTIC_LIDAR_TYPE]['data'],
+                point_ids,
+                instance_ids,
+                new_labels
             )
-        frame_data.sensor_data[location_rotation][SEMANTIC_CAM_TYPE]['data'] = semantic_img_arr
-        frame_data.sensor_data[location_rotation][SEMANTIC_LIDAR_TYPE]['point_ids'] = semantic_pcd
-    frame_data.save_files()
+    with Profiler.phase("save_files"):
+        frame_data.save_files()
+    if camera_params is not None:
+        VoxelGenerator.generate_data(frame_data, camera_params)
+    frame_data.release_slots()
 
     logging.debug("Data Generation Successful")
     return frame_data
@@ -96,7 +104,7 @@ def generate_data(
 
 
 def image_callback(
-        frame_data: FrameData, data_queue, sensor_name, file_ending, dataformat, sensor_type, location, rotation,
+        frame_data: FrameData, sensor_data, sensor_name, file_ending, dataformat, sensor_type, location, rotation,
         save_data
 ):
     """
@@ -107,31 +115,35 @@ def image_callback(
         frame_data.scenario_id,
         sensor_name,
         file_ending,
-        run_makedirs=save_data
+        run_makedirs=save_data,
+        output_path=frame_data.output_path
     )
-    image = data_queue.get()
-    if save_data:
-        image.save_to_disk(file_path)
+    image = sensor_data
+    # the image is written by FrameData.save_files, after relabeling
     # array of bgra pixel
-    pixel_array = np.reshape(image.raw_data, (image.height, image.width, 4), )[:, :, :3][:, :,
-                  ::-1]  # remove alpha channel and reverse order of channels to rgb
+    bgra = np.reshape(image.raw_data, (image.height, image.width, 4), )
 
     if sensor_type == SEMANTIC_CAM_TYPE:
-        pixel_array = pixel_array[:, :, 0]  # only first channel used to store semantic labels
-    frame_data.set_data(file_path, pixel_array, sensor_type, location, rotation, save_data)
+        # only the red channel is used to store semantic labels
+        slot = acquire_frame_slot(sensor_name, "data", image.height, (image.width,), np.uint8)
+        np.copyto(slot.array, bgra[:, :, 2])
+    else:
+        # remove alpha channel and reverse order of channels to rgb
+        slot = acquire_frame_slot(sensor_name, "data", image.height, (image.width, 3), np.uint8)
+        np.copyto(slot.array, bgra[:, :, 2::-1])
+    frame_data.set_data(file_path, slot.array, sensor_type, location, rotation, save_data, slot)
 
 
 def lidar_callback(
-        frame_data: FrameData, data_queue, sensor_name, file_ending, dataformat, sensor_type, location, rotation,
+        frame_data: FrameData, sensor_data, sensor_name, file_ending, dataformat, sensor_type, location, rotation,
         save_data
 ):
     """
     Callback method for lidar data.
     """
     logging.debug("Lidar callback called")
-    logging.debug(data_queue.qsize())
 
-    point_cloud = data_queue.get()
+    point_cloud = sensor_data
     data = np.frombuffer(
         point_cloud.raw_data,
         dtype=np.dtype(
@@ -145,29 +157,32 @@ def lidar_callback(
     )
 
     # negate y for correct open3d coordinate system
-    points = np.array([data["x"], -data["y"], data["z"]]).T
-    intensities = np.array(data["intensity"]).reshape(-1, 1)
-    pcd = np.concatenate([points, intensities], axis=1)
+    slot = acquire_frame_slot(sensor_name, "data", len(data), (4,), np.float32, Definitions.FRAME_SLOT_LIDAR_HEADROOM)
+    pcd = slot.array
+    pcd[:, 0] = data["x"]
+    pcd[:, 1] = data["y"]
+    pcd[:, 1] *= -1
+    pcd[:, 2] = data["z"]
+    pcd[:, 3] = data["intensity"]
     file_path = create_file_name(
         frame_data.frame_id,
         frame_data.scenario_id,
         sensor_name,
         file_ending,
-        run_makedirs=save_data
+        run_makedirs=save_data,
+        output_path=frame_data.output_path
     )
-    frame_data.set_data(file_path, pcd, sensor_type, location, rotation, save_data)
+    frame_data.set_data(file_path, pcd, sensor_type, location, rotation, save_data, slot)
 
 
 def semantic_lidar_callback(
-        frame_data: FrameData, data_queue, sensor_name, file_ending, dataformat, sensor_type, location, rotation,
+        frame_data: FrameData, sensor_data, sensor_name, file_ending, dataformat, sensor_type, location, rotation,
         save_data
 ):
     """
     Callback method that processes the semantic lidar data.
     """
-    logging.debug(data_queue.qsize())
-
-    point_cloud = data_queue.get()
+    point_cloud = sensor_data
     data = np.frombuffer(
         point_cloud.raw_data,
         dtype=np.dtype(
@@ -182,22 +197,31 @@ def semantic_lidar_callback(
         ),
     )
 
+    headroom = Definitions.FRAME_SLOT_LIDAR_HEADROOM
+    semantic_slot = acquire_frame_slot(sensor_name, "data", len(data), (4,), np.float64, headroom)
+    point_ids_slot = acquire_frame_slot(sensor_name, "point_ids", len(data), (4,), np.float64, headroom)
+    semantic_pcd = semantic_slot.array
+    point_ids = point_ids_slot.array  # instance ids for every object found in pcd
+
     # We're negating the y to correctly visualize a world that matches
     # what we see in Unreal since Open3D uses a right-handed coordinate system
-    points = np.array([data["x"], -data["y"], data["z"]]).T
+    semantic_pcd[:, 0] = data["x"]
+    semantic_pcd[:, 1] = data["y"]
+    semantic_pcd[:, 1] *= -1
+    semantic_pcd[:, 2] = data["z"]
+    point_ids[:, :3] = semantic_pcd[:, :3]
 
     # Colorize the point cloud based on the City-Scape color palette
-    ids = np.array(data["ObjIdx"]).reshape(-1, 1)
-    labels = np.array(data["ObjTag"]).reshape(-1, 1)  # semantic ids for every class found in pcd
-    point_ids = np.concatenate([points, ids], axis=1)  # instance ids for every object found in pcd
-    semantic_pcd = np.concatenate([points, labels], axis=1)
+    semantic_pcd[:, 3] = data["ObjTag"]  # semantic ids for every class found in pcd
+    point_ids[:, 3] = data["ObjIdx"]
 
     file_path = create_file_name(
         frame_data.frame_id,
         frame_data.scenario_id,
         sensor_name,
         file_ending,
-        run_makedirs=save_data
+        run_makedirs=save_data,
+        output_path=frame_data.output_path
     )
 
     frame_data.set_data(
@@ -206,9 +230,10 @@ def semantic_lidar_callback(
         sensor_type,
         location,
         rotation,
-        save_data
+        save_data,
+        semantic_slot
     )
-    frame_data.set_point_ids(point_ids, location, rotation)
+    frame_data.set_point_ids(point_ids, location, rotation, point_ids_slot)
 
 
 # endregion
@@ -220,66 +245,72 @@ def semantic_lidar_callback(
 # ======================================================================================================================
 
 
-def get_lidar_mask(object_id, lidar_data):
+def get_relabel_lookup(id_labels):
     """
-    This method takes in an object ID and lidar data as parameters. It creates a lidar mask by filtering the lidar
-    points based on the given object ID and removing any anomaly points. The * method returns the lidar points that
-    pass the mask.
+    Deduplicates the instances to relabel. Returns the instance ids and their new labels, ordered by the last time an
+    instance appears in id_labels, so applying the relabels in this order gives the same result as applying every
+    entry of id_labels one after another.
     """
-    lidar_points = np.array(lidar_data[:, :3])
-    idx = lidar_data[:, 3:]
-    id_mask = np.isin(idx, [object_id])
-    id_mask = id_mask.reshape(
-        id_mask.size,
-    )
-    id_mask = np.logical_not(id_mask)  # only anomaly points have true boolean value in this array
-    masked_lidar_points = np.delete(lidar_points, id_mask, axis=0)
+    lookup = dict()
+    for label in id_labels:
+        lookup.pop(label.instance_id, None)
+        lookup[label.instance_id] = label.semantic_id
+    return np.array(list(lookup.keys()), dtype=np.int64), np.array(list(lookup.values()), dtype=np.int64)
 
-    return masked_lidar_points
+
+def get_lidar_mask(instance_ids, lidar_data):
+    """
+    Returns a boolean mask of all lidar points that belong to one of the given instances. lidar_data contains x, y, z
+    and the instance id of every point.
+    """
+    return np.isin(lidar_data[:, 3], instance_ids)
+
+
+def lookup_labels(keys, lookup_keys, lookup_values):
+    """
+    Maps every key to the value of the last matching entry in lookup_keys. Returns the values and a mask of all keys
+    that were found.
+    """
+    # later entries have to win, so the last occurrence of every key is kept
+    _, last = np.unique(lookup_keys[::-1], return_index=True)
+    last = lookup_keys.size - 1 - last
+    sorted_keys, sorted_values = lookup_keys[last], lookup_values[last]
+
+    position = np.minimum(np.searchsorted(sorted_keys, keys), sorted_keys.size - 1)
+    found = sorted_keys[position] == keys
+    return sorted_values[position], found
 
 
 def relabel_pcd(
         semantic_pcd,
         instance_pcd_data,
-        instance_id,
-        new_label,
-        tick_count
+        instance_ids,
+        new_labels
 ):
     """
-    Relabels the instances in the semantic point cloud data with new labels.
+    Relabels the instances in the semantic point cloud data with new labels. instance_ids and new_labels are the
+    lookup returned by get_relabel_lookup.
     """
-    pcd_points = semantic_pcd[:, :3]
-    pcd_labels = semantic_pcd[:, -1:]
-    idx = instance_pcd_data[:, -1:]
-    id_mask = np.isin(idx, instance_id)
-    id_mask = id_mask.reshape((id_mask.size,))
-    pcd_labels[id_mask] = new_label
-    new_pcd = np.concatenate([pcd_points, pcd_labels], axis=1)
+    if instance_ids.size == 0:
+        return semantic_pcd
+    labels, found = lookup_labels(instance_pcd_data[:, -1].astype(np.int64), instance_ids, new_labels)
+    # data of a frame slot is relabeled in place, read-only buffers are copied
+    new_pcd = semantic_pcd if semantic_pcd.flags.writeable else np.array(semantic_pcd)
+    new_pcd[found, -1] = labels[found]
     return new_pcd
 
 
-def relabel_semantic_img(
-        camera_data,
-        instance_data,
-        pcd_mask,
-        camera_inverse_trans,
-        lidar_trans,
-        new_color,
-        tick_count,
-        label_type,
-        anomaly_type
-):
+def project_lidar_to_camera(lidar_points, camera_inverse_trans, lidar_trans):
     """
-    Relabels the semantic image based on the lidar data and camera parameters.
+    Projects lidar points into the semantic camera. Returns the pixel coordinates u and v of all points within the
+    image and the mask of these points.
     """
-    camera_data = np.copy(camera_data)  # for some reason this doesn't work without copying the image array
-    instance_data = np.copy(instance_data)
     camera_matrix = np.identity(3)  # calibration matrix for camera
     camera_matrix[0, 0] = camera_matrix[1, 1] = Definitions.FOCAL
     camera_matrix[0, 2] = Definitions.IMAGE_WIDTH / 2.0
     camera_matrix[1, 2] = Definitions.IMAGE_HEIGHT / 2.0
 
-    local_points = pcd_mask.T
+    local_points = lidar_points.T
     # Add an extra 1.0 at the end of each 3d point, so it becomes of
     # shape (4, p_cloud_size) and it can be multiplied by a (4, 4) matrix.
     local_points = np.r_[
@@ -325,19 +356,19 @@ def relabel_semantic_img(
     points_2d = np.dot(camera_matrix, point_in_camera_coords)
 
     # Remember to normalize the x, y values by the 3rd value.
-    points_2d = np.array(
-        [
-            points_2d[0, :] / points_2d[2, :],
-            points_2d[1, :] / points_2d[2, :],
-            points_2d[2, :],
-        ]
-    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        points_2d = np.array(
+            [
+                points_2d[0, :] / points_2d[2, :],
+                points_2d[1, :] / points_2d[2, :],
+                points_2d[2, :],
+            ]
+        )
 
     # At this point, points_2d[0, :] contains all the x and points_2d[1, :]
     # contains all the y values of our points. In order to properly
     # visualize everything on a screen, the points that are out of the screen
     # must be discarded, the same with points behind the camera projection plane.
-    # print("points 2d shape before",points_2d.shape)
     points_2d = points_2d.T
     points_in_canvas_mask = (
             (points_2d[:, 0] > 0.0)
@@ -352,27 +383,64 @@ def relabel_semantic_img(
     u_coord = points_2d[:, 0].astype(np.int32)
     v_coord = points_2d[:, 1].astype(np.int32)
 
-    instance_pixels = instance_data[v_coord, u_coord]
+    return u_coord, v_coord, points_in_canvas_mask
+
 
-    if instance_pixels.size == 0:  # if no target pixels were found
+def relabel_semantic_img(
+        camera_data,
+        instance_data,
+        instance_pcd_data,
+        camera_inverse_trans,
+        lidar_trans,
+        instance_ids,
+        new_labels
+):
+    """
+    Relabels the semantic image based on the lidar data and camera parameters. The lidar points of every instance to
+    relabel are projected into the instance image, and the image segment that contains most of the points of an
+    instance gets its new label. All instances are handled with one projection and one pass over the image.
+    """
+    if instance_ids.size == 0:
         return camera_data
-    instance_id, counts = np.unique(
-        instance_pixels,
-        return_counts=True,
-        axis=0,
-    )
-    # get the instance color of the segment in the image that has most of the projected lidar points in it
-    instance_id = instance_id[counts.argmax()]
-    instance_id = np.squeeze(instance_id)
-    logging.debug(f"anomaly instance color: {instance_id}")
 
-    _anomaly_mask = np.all(
-        instance_data == instance_id,
-        axis=-1,
-    )  # get all pixels with the anomaly id color
+    lidar_mask = get_lidar_mask(instance_ids, instance_pcd_data)
+    u_coord, v_coord, in_canvas = project_lidar_to_camera(
+        instance_pcd_data[lidar_mask, :3],
+        camera_inverse_trans,
+        lidar_trans
+    )
+    if u_coord.size == 0:  # if no target pixels were found
+        return camera_data
+    point_instances = instance_pcd_data[lidar_mask, 3][in_canvas].astype(np.int64)
 
-    camera_data[_anomaly_mask] = new_color
+    # the instance color of every pixel as a single 24 bit integer, ordered like the colors themselves
+    instance_codes = (
+            (instance_data[..., 0].astype(np.int64) << 16)
+            | (instance_data[..., 1].astype(np.int64) << 8)
+            | instance_data[..., 2]
+    )
 
+    # count the points of every (lidar instance, image segment) pair and take the segment with most points per
+    # instance, ties go to the smallest color
+    pairs, counts = np.unique(
+        (point_instances << 24) | instance_codes[v_coord, u_coord],
+        return_counts=True
+    )
+    pair_instances, pair_codes = pairs >> 24, pairs & 0xFFFFFF
+    order = np.lexsort((pair_codes, -counts, pair_instances))
+    first = order[np.flatnonzero(np.r_[True, np.diff(pair_instances[order]) != 0])]
+    segment_codes = pair_codes[first]
+    logging.debug(f"anomaly instance colors: {segment_codes}")
+
+    # apply the relabels in lookup order, so a segment claimed by several instances gets the latest label
+    sorter = np.argsort(instance_ids)
+    position = sorter[np.searchsorted(instance_ids, pair_instances[first], sorter=sorter)]
+    segment_order = np.argsort(position)
+    labels, found = lookup_labels(instance_codes, segment_codes[segment_order], new_labels[position][segment_order])
+
+    if not camera_data.flags.writeable:  # data of a frame slot is relabeled in place, read-only buffers are copied
+        camera_data = np.copy(camera_data)
+    camera_data[found] = labels[found]
     return camera_data
 
 # endregion
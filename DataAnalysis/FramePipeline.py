@@ -0,0 +1,134 @@
+"""This module overlaps the post-processing of recorded frames with the simulation. The tick loop collects everything
+of frame N that depends on the state of the simulator (sensor data, action states, ego vehicle transform) and hands it
+to a background thread, which decodes, relabels, renders the BEV route map and schedules the writes, while the agents
+compute their controls and the world ticks frame N+1. A single worker processes the frames in the order they were
+recorded, so the output does not depend on the timing of the two stages. At most Definitions.FRAME_PIPELINE_DEPTH
+frames are pending, submitting blocks while this limit is reached (back-pressure), so the throughput approaches the one
+of the slower stage. flush() is the barrier that waits for all pending frames, e.g. at the end of a scenario."""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import Definitions
+from DataAnalysis import Profiler
+
+
+# ======================================================================================================================
+# region -- FRAME PIPELINE ---------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class FramePipeline:
+    """
+    Post-processes frames on a single worker thread. At most depth frames are queued or running at the same time,
+    submit blocks while this limit is reached. With depth 0 the frames are processed in submit directly. Failed frames
+    are logged and counted, they do not stop the simulation.
+    """
+
+    def __init__(self, depth=Definitions.FRAME_PIPELINE_DEPTH):
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame_pipeline") if depth else None
+        self._slots = threading.BoundedSemaphore(max(1, depth))
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._results = list()  # results of the processed frames, in submit order
+        self.failed_frames = 0
+
+    def submit(self, frame_id, process_function, *args, **kwargs):
+        """
+        Schedules process_function(*args, **kwargs) for the frame frame_id. The arguments must not be modified
+        afterwards and must not depend on the simulator anymore, they are used while the world ticks on.
+        """
+        with Profiler.phase("frame_pipeline_backpressure"):
+            self._slots.acquire()
+        with self._condition:
+            self._pending += 1
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(process_function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            try:
+                future = self._executor.submit(process_function, *args, **kwargs)
+            except Exception:
+                self._slots.release()
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify_all()
+                raise
+        future.add_done_callback(lambda f: self._on_done(f, frame_id))
+        return future
+
+    def _on_done(self, future, frame_id):
+        if future.exception() is not None:
+            logging.error(f"Could not post-process frame {frame_id}", exc_info=future.exception())
+        self._slots.release()
+        with self._condition:
+            self._pending -= 1
+            if future.exception() is not None:
+                self.failed_frames += 1
+            else:
+                # the single worker finishes the frames in submit order
+                self._results.append(future.result())
+            self._condition.notify_all()
+
+    @property
+    def pending_frames(self):
+        with self._condition:
+            return self._pending
+
+    def flush(self):
+        """
+        Blocks until all frames submitted so far are processed. Returns the results of the processed frames in submit
+        order and the number of frames that failed since the last flush.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending == 0)
+            results, self._results = self._results, list()
+            failed, self.failed_frames = self.failed_frames, 0
+        logging.debug(f"Post-processed {len(results)} frames, {failed} failed")
+        return results, failed
+
+    def shutdown(self):
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+_FRAME_PIPELINE = None
+_FRAME_PIPELINE_LOCK = threading.Lock()
+
+
+def get_frame_pipeline():
+    """
+    Returns the frame pipeline shared by all scenarios, it is created on first use.
+    """
+    global _FRAME_PIPELINE
+    with _FRAME_PIPELINE_LOCK:
+        if _FRAME_PIPELINE is None:
+            _FRAME_PIPELINE = FramePipeline()
+        return _FRAME_PIPELINE
+
+
+def flush_frames():
+    """
+    Waits for all pending frames. Returns the results of the processed frames in submit order and the number of frames
+    that failed since the last flush.
+    """
+    if _FRAME_PIPELINE is None:
+        return list(), 0
+    return _FRAME_PIPELINE.flush()
+
+
+def shutdown_frames():
+    """
+    Waits for all pending frames and stops the worker thread.
+    """
+    global _FRAME_PIPELINE
+    with _FRAME_PIPELINE_LOCK:
+        if _FRAME_PIPELINE is not None:
+            _FRAME_PIPELINE.shutdown()
+            _FRAME_PIPELINE = None
+
+# endregion
+# ======================================================================================================================
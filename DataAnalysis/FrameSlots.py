@@ -0,0 +1,200 @@
+"""This module hands the decoded sensor data of a frame from the tick loop to the relabeling, the BEV generation and the
+write behind workers without copying it. Every sensor output (e.g. the RGB image of one sensor pose) gets a ring of
+preallocated frame slots in shared memory. The sensor callback decodes the carla buffer into a free slot once, all
+later steps work on views of the slot, and the slot is reused as soon as the last of them releases it. Other processes
+attach a slot by its FrameSlotRef (name of the shared memory block, offset, shape and dtype), the data itself is never
+pickled.
+
+If all slots of a ring are in use (e.g. the disk writes fall behind) or the data does not fit into a slot, a plain
+array is allocated for this frame instead, so the simulation never waits for a slot."""
+import logging
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import Definitions
+from DataAnalysis import Profiler
+
+FrameSlotRef = namedtuple("FrameSlotRef", ["shm_name", "offset", "shape", "dtype"])
+"""Picklable reference to the data of a frame slot, see open_frame_slot."""
+
+
+# ======================================================================================================================
+# region -- FRAME SLOT -------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class FrameSlot:
+    """
+    The data of one sensor output of a frame. array is a writable view of the slot, or a plain array if the slot ring
+    had no free slot. The slot is reused once it is released as often as it was acquired and retained.
+    """
+
+    def __init__(self, array, ring=None, index=None):
+        self.array = array
+        self._ring = ring
+        self._index = index
+
+    @property
+    def shared(self):
+        return self._ring is not None
+
+    def retain(self):
+        if self._ring is not None:
+            self._ring.retain(self._index)
+        return self
+
+    def release(self):
+        if self._ring is not None:
+            self._ring.release(self._index)
+
+    def ref(self):
+        """
+        Returns the FrameSlotRef of the data, None if the data is not in shared memory.
+        """
+        if self._ring is None:
+            return None
+        offset = self._index * self._ring.slot_bytes
+        return FrameSlotRef(self._ring.shm.name, offset, self.array.shape, self.array.dtype.str)
+
+
+class FrameSlotRing:
+    """
+    Ring of slot_count slots in one shared memory block. Every slot holds up to rows rows of item_shape and dtype. A
+    retired ring hands out no more slots and frees its shared memory once the last of its slots is released.
+    """
+
+    def __init__(self, name, rows, item_shape, dtype, slot_count=Definitions.FRAME_SLOTS_PER_SENSOR):
+        self.name = name
+        self.rows = rows
+        self.item_shape = tuple(item_shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_bytes = int(rows * np.prod(self.item_shape, dtype=np.int64) * self.dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, self.slot_bytes * slot_count))
+        self._slots = np.ndarray(
+            (slot_count, rows) + self.item_shape,
+            dtype=self.dtype,
+            buffer=self.shm.buf
+        )
+        self._lock = threading.Lock()
+        self._references = [0] * slot_count
+        self._free = list(range(slot_count))
+        self.retired = False
+        self.closed = False
+        logging.debug(f"Created {slot_count} frame slots of {self.slot_bytes / 2 ** 20:.1f} MiB for {name}")
+
+    def acquire(self, rows):
+        """
+        Returns a FrameSlot with rows rows. The caller holds one reference and releases it when done.
+        """
+        if rows <= self.rows:
+            with self._lock:
+                if self._free:
+                    index = self._free.pop()
+                    self._references[index] = 1
+                    return FrameSlot(self._slots[index, :rows], self, index)
+        Profiler.count("frame_slot_misses")
+        return FrameSlot(np.empty((rows,) + self.item_shape, dtype=self.dtype))
+
+    def retain(self, index):
+        with self._lock:
+            self._references[index] += 1
+
+    def release(self, index):
+        with self._lock:
+            self._references[index] -= 1
+            if self._references[index] == 0:
+                self._free.append(index)
+            unused = self.retired and not any(self._references)
+        if unused:
+            self.close()
+
+    def retire(self):
+        """
+        Stops handing out slots, e.g. because the setup of the sensor changed. The shared memory is freed once all slots
+        are released, slots still in use (e.g. by pending writes or by the online voxelization) stay valid until then.
+        """
+        with self._lock:
+            self.retired = True
+            unused = not any(self._references)
+        if unused:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        del self._slots
+        try:
+            self.shm.close()
+        except BufferError:  # views of slots are still alive, the memory is freed once they are gone
+            logging.debug(f"Frame slots of {self.name} are still in use while closing")
+        self.shm.unlink()
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- RINGS ------------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+_RINGS = dict()  # (sensor name, output) -> FrameSlotRing
+_RETIRED_RINGS = list()  # rings replaced by a changed sensor setup whose slots are still in use
+_RINGS_LOCK = threading.Lock()
+
+
+def acquire_frame_slot(sensor_name, output, rows, item_shape, dtype, headroom=1.0):
+    """
+    Returns a FrameSlot for rows rows of item_shape and dtype of the output output of the sensor sensor_name. The ring
+    is created on first use with room for rows * headroom rows per slot, outputs with a varying number of rows (e.g.
+    the points of a lidar) need headroom. Without Definitions.FRAME_SLOTS_PER_SENSOR the slot is a plain array.
+    """
+    if not Definitions.FRAME_SLOTS_PER_SENSOR:
+        return FrameSlot(np.empty((rows,) + tuple(item_shape), dtype=dtype))
+    key = (sensor_name, output)
+    with _RINGS_LOCK:
+        ring = _RINGS.get(key)
+        if ring is None or ring.item_shape != tuple(item_shape) or ring.dtype != np.dtype(dtype):
+            if ring is not None:
+                # the setup of the sensor changed, slots of the old ring may still be in use
+                ring.retire()
+                _RETIRED_RINGS[:] = [retired for retired in _RETIRED_RINGS if not retired.closed]
+                if not ring.closed:
+                    _RETIRED_RINGS.append(ring)
+            ring = FrameSlotRing(f"{sensor_name}/{output}", int(np.ceil(rows * headroom)), item_shape, dtype)
+            _RINGS[key] = ring
+    return ring.acquire(rows)
+
+
+def close_frame_slots():
+    """
+    Frees the shared memory of all rings, also of the retired ones. No slot may be in use anymore, e.g. call it after
+    flushing the writes.
+    """
+    with _RINGS_LOCK:
+        for ring in list(_RINGS.values()) + _RETIRED_RINGS:
+            ring.close()
+        _RINGS.clear()
+        _RETIRED_RINGS.clear()
+
+
+_ATTACHED = dict()  # shared memory name -> SharedMemory, per process
+
+
+def open_frame_slot(ref):
+    """
+    Returns a read-only view of the data of ref in a child process of the owner of the slot (children share the
+    resource tracker of the owner, which unlinks the shared memory). The view is valid as long as the owner of the slot
+    holds a reference to it.
+    """
+    shm = _ATTACHED.get(ref.shm_name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=ref.shm_name)
+        _ATTACHED[ref.shm_name] = shm
+    array = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=shm.buf, offset=ref.offset)
+    array.flags.writeable = False
+    return array
+
+# endregion
+# ======================================================================================================================
@@ -1,49 +1,52 @@
-"""This module facilitates output management by generating CSV files and zipping output directories in a
-scenario-based system."""
+"""This module facilitates output management by collecting the action states of the frames of a scenario in its
+action log (see DataAnalysis/ActionLog.py), which is written once at the end of the scenario."""
 import logging
+import os
+import threading
 
 import Definitions
-from FileStructureManager import create_file_name
+from DataAnalysis.ActionLog import ACTION_LOG_FILE_NAME, ActionLog, export_csv
+from FileStructureManager import get_scenario_path
 
 
 # ======================================================================================================================
-# region -- CSV_FILES---------------------------------------------------------------------------------------------------
+# region -- ACTION_LOGS ------------------------------------------------------------------------------------------------
 # ======================================================================================================================
+_ACTION_LOGS = dict()  # scenario folder -> ActionLog
+_ACTION_LOGS_LOCK = threading.Lock()
 
 
-def generate_action_csv(action_obj):
+def append_action_data(action_obj):
     """
-    Generate a CSV file for the given action object.
+    Adds the action and anomaly dicts of the given action object to the action log of its scenario.
     """
-    file_path = create_file_name(
-        frame_id=action_obj.frame_id,
-        scenario_id=action_obj.scenario_id,
-        subfolder=Definitions.DataFormat.ACTION.name,
-        file_ending=Definitions.DataFormat.ACTION.value,
-    )
-    logging.debug(f"file_path: {file_path}")
+    scenario_path = get_scenario_path(action_obj.scenario_id, action_obj.output_path)
+    with _ACTION_LOGS_LOCK:
+        action_log = _ACTION_LOGS.get(scenario_path)
+        if action_log is None:
+            action_log = _ACTION_LOGS[scenario_path] = ActionLog(action_obj.scenario_id)
+        action_log.append(action_obj.action_dict, action_obj.anomaly_dict)
 
-    with open(file_path, "w") as f:
-        for key, value in action_obj.action_dict.items():
-            f.write(f"{key} ; {value}\n")
 
-
-def generate_anomaly_csv(action_obj):
+def flush_action_logs():
     """
-    Generates a CSV file containing anomaly data based on the provided action object.
+    Writes the action logs of all scenarios with frames since the last flush into their scenario folders and, if
+    Definitions.ACTION_LOG_EXPORT_CSV is set, the per-frame csv files of the previous output layout. Returns the paths
+    of the written logs.
     """
-    file_path = create_file_name(
-        frame_id=action_obj.frame_id,
-        scenario_id=action_obj.scenario_id,
-        subfolder=Definitions.DataFormat.ANOMALY.name,
-        file_ending=Definitions.DataFormat.ANOMALY.value,
-    )
-
-    logging.debug(f"file_path: {file_path}")
-
-    with open(file_path, "w") as f:
-        for key, value in action_obj.anomaly_dict.items():
-            f.write(f"{key} ; {value}\n")
+    with _ACTION_LOGS_LOCK:
+        action_logs = list(_ACTION_LOGS.items())
+        _ACTION_LOGS.clear()
+
+    file_paths = list()
+    for scenario_path, action_log in action_logs:
+        file_path = os.path.join(scenario_path, ACTION_LOG_FILE_NAME)
+        action_log.save(file_path)
+        logging.debug(f"Wrote {len(action_log)} frames to {file_path}")
+        if Definitions.ACTION_LOG_EXPORT_CSV:
+            export_csv(file_path)
+        file_paths.append(file_path)
+    return file_paths
 
 # endregion
-# =====================================================================================================================
+# ======================================================================================================================
@@ -0,0 +1,188 @@
+"""This module measures where the time of a scenario goes. The tick loop and the data generation wrap each of their
+phases (world tick, behavior agents, traffic lights, sensor waits, relabeling, BEV rendering, disk writes, ...) in
+named timers and count events with named counters. The measurements are aggregated per scenario and written as
+profile.json and profile.csv next to the sensor setup file of the scenario, Tools/compare_profiles.py compares the
+profiles of different runs.
+
+Profiling is off unless Definitions.PROFILE_SCENARIOS is set. Disabled, phase() returns a shared no-op context manager
+and count() returns immediately, so the instrumentation can stay in the hot loop."""
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import Definitions
+from FileStructureManager import get_scenario_path
+
+CSV_FIELDS = ["phase", "calls", "total", "mean", "p50", "p95", "max", "share"]
+
+
+class _NoOpTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_OP_TIMER = _NoOpTimer()
+
+
+class _PhaseTimer:
+    __slots__ = ("_profile", "_name", "_start")
+
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profile.add_time(self._name, time.perf_counter() - self._start)
+        return False
+
+
+# ======================================================================================================================
+# region -- SCENARIO PROFILE -------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class ScenarioProfile:
+    """
+    Durations of the phases and counters of one scenario. Phases may be timed from several threads, e.g. the disk
+    writes of the write behind workers. scenario_path is the folder finish_profile writes the report to.
+    """
+
+    def __init__(self, scenario_id, scenario_path=None):
+        self.scenario_id = scenario_id
+        self.scenario_path = scenario_path
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._durations = dict()  # phase -> list of durations in seconds
+        self._counters = dict()  # counter -> value
+
+    def phase(self, name):
+        return _PhaseTimer(self, name)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self._durations.setdefault(name, []).append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def report(self):
+        """
+        Returns the profile as a dict: the wall time of the scenario, the statistics of every phase in seconds (share
+        is the total of the phase relative to the wall time, phases of worker threads can overlap the tick loop) and
+        the counters.
+        """
+        wall_time = time.perf_counter() - self.start
+        with self._lock:
+            durations = {name: np.array(values) for name, values in self._durations.items()}
+            counters = dict(self._counters)
+
+        phases = dict()
+        for name, values in sorted(durations.items()):
+            phases[name] = {
+                "calls": len(values),
+                "total": float(values.sum()),
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+                "share": float(values.sum() / wall_time) if wall_time > 0 else 0.0,
+            }
+        return {
+            "scenario_id": self.scenario_id,
+            "wall_time": wall_time,
+            "phases": phases,
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def save(self, directory):
+        """
+        Writes the report to profile.json and the phase statistics to profile.csv in directory.
+        """
+        report = self.report()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, Definitions.PROFILE_FILE_NAME + ".json"), "w") as f:
+            json.dump(report, f, indent=2)
+        with open(os.path.join(directory, Definitions.PROFILE_FILE_NAME + ".csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for name, stats in report["phases"].items():
+                writer.writerow({"phase": name, **stats})
+        return report
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- CURRENT PROFILE --------------------------------------------------------------------------------------------
+# ======================================================================================================================
+_PROFILE = None
+
+
+def start_profile(scenario_id, output_path=None):
+    """
+    Starts the profile of the scenario scenario_id, if Definitions.PROFILE_SCENARIOS is set. The report is written into
+    the scenario folder in output_path (default FileStructureManager.THIS_OUTPUT_PATH).
+    """
+    global _PROFILE
+    if Definitions.PROFILE_SCENARIOS:
+        _PROFILE = ScenarioProfile(scenario_id, get_scenario_path(scenario_id, output_path))
+    else:
+        _PROFILE = None
+
+
+def finish_profile():
+    """
+    Writes the profile of the current scenario next to its sensor setup file and stops profiling. Returns the report,
+    None if profiling is disabled.
+    """
+    global _PROFILE
+    profile, _PROFILE = _PROFILE, None
+    if profile is None:
+        return None
+    report = profile.save(profile.scenario_path)
+    slowest = sorted(report["phases"].items(), key=lambda item: item[1]["total"], reverse=True)[:5]
+    summary = ", ".join(f"{name} {stats['total']:.1f}s" for name, stats in slowest)
+    logging.info(f"Profile of scenario {profile.scenario_id} ({report['wall_time']:.1f}s): {summary}")
+    return report
+
+
+def phase(name):
+    """
+    Returns a context manager that adds the time spent in it to the phase name of the current profile.
+    """
+    if _PROFILE is None:
+        return _NO_OP_TIMER
+    return _PROFILE.phase(name)
+
+
+def add_time(name, seconds):
+    """
+    Adds seconds measured elsewhere, e.g. in a worker process, to the phase name of the current profile.
+    """
+    if _PROFILE is not None:
+        _PROFILE.add_time(name, seconds)
+
+
+def count(name, value=1):
+    """
+    Adds value to the counter name of the current profile.
+    """
+    if _PROFILE is not None:
+        _PROFILE.count(name, value)
+
+# endregion
+# ======================================================================================================================
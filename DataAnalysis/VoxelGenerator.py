@@ -0,0 +1,205 @@
+"""This module creates the voxel ground truth of the frames while the scenario is running. The relabeled depth images,
+semantic images and semantic lidar point clouds of a frame are handed to a pool of worker processes as references to
+their frame slots (see DataAnalysis/FrameSlots.py), so the data is neither copied nor read back from disk. The voxel
+grids are written to the voxel grid container of the scenario, the same container voxelize_separate.py writes, and
+flush() is the barrier that waits for all pending frames and closes the containers, e.g. at the end of a scenario."""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+import Definitions
+from DataAnalysis import Profiler
+from DataAnalysis.FrameSlots import FrameSlotRef, open_frame_slot
+from EgoVehicleSetup import DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE
+from FileStructureManager import get_scenario_path
+from Voxelization.VoxelContainer import VOXEL_GRID_CONTAINER_FILE_NAME, VoxelGridWriter
+
+VOXELIZED_SENSOR_TYPES = (DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE)
+
+
+def _voxelize(frame_id, inputs, camera_params):
+    """
+    Worker function of the online voxelizer. inputs holds a FrameSlotRef or an array per sensor type and pose.
+    """
+    # open3d is only needed by the workers, not by the simulation
+    from Voxelization.FrameVoxelization import voxelize_frame
+
+    start = time.perf_counter()
+    data = {
+        sensor_type: {
+            location_rotation: open_frame_slot(item) if isinstance(item, FrameSlotRef) else item
+            for location_rotation, item in items.items()
+        }
+        for sensor_type, items in inputs.items()
+    }
+    return frame_id, voxelize_frame(data, camera_params), time.perf_counter() - start
+
+
+# ======================================================================================================================
+# region -- ONLINE VOXELIZER -------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class OnlineVoxelizer:
+    """
+    Voxelizes frames on worker processes. At most max_pending frames are pending at the same time, submit blocks
+    while this limit is reached. Failed frames are logged and counted, they do not stop the simulation.
+    """
+
+    def __init__(
+            self,
+            workers=Definitions.ONLINE_VOXELIZATION_WORKERS,
+            max_pending=Definitions.ONLINE_VOXELIZATION_MAX_PENDING
+    ):
+        # the simulation runs carla client threads, so the workers are spawned instead of forked
+        self._pool = multiprocessing.get_context("spawn").Pool(processes=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._writers = dict()  # scenario folder -> VoxelGridWriter
+        self.failed_frames = 0
+        self.completed_frames = 0
+
+    def submit(self, frame_data, camera_params):
+        """
+        Schedules the voxelization of the sensor data of frame_data that is saved, after relabeling. camera_params
+        are the image_width, image_height and camera_fov of the depth camera of every sensor pose. The frame slots of
+        the data are retained until the frame is voxelized.
+        """
+        inputs, frame_slots = dict(), list()
+        for location_rotation, sensor_data in frame_data.sensor_data.items():
+            for sensor_type in VOXELIZED_SENSOR_TYPES:
+                entry = sensor_data.get(sensor_type)
+                if not entry or not entry.get('save_data') or entry.get('data') is None:
+                    continue
+                slot = entry.get('slot')
+                if slot is not None and slot.shared:
+                    frame_slots.append(slot.retain())
+                    item = slot.ref()
+                else:
+                    item = entry['data']
+                inputs.setdefault(sensor_type, dict())[location_rotation] = item
+        if not inputs:
+            return
+
+        with Profiler.phase("voxelization_backpressure"):
+            self._slots.acquire()
+        with self._condition:
+            self._pending += 1
+        scenario_path = get_scenario_path(frame_data.scenario_id, frame_data.output_path)
+        self._pool.apply_async(
+            _voxelize,
+            (frame_data.frame_id, inputs, camera_params),
+            callback=lambda result: self._on_done(scenario_path, frame_slots, result=result),
+            error_callback=lambda error: self._on_done(scenario_path, frame_slots, error=error),
+        )
+
+    def _get_writer(self, scenario_path):
+        if scenario_path not in self._writers:
+            self._writers[scenario_path] = VoxelGridWriter(
+                os.path.join(scenario_path, VOXEL_GRID_CONTAINER_FILE_NAME),
+                Definitions.VOXEL_SIZE_YC,
+                value_dtype=np.uint8,
+                voxel_resolution=Definitions.VOXEL_RESOLUTION_YC,
+                ground_truth_version=Definitions.VOXEL_GROUND_TRUTH_VERSION,
+            )
+        return self._writers[scenario_path]
+
+    def _on_done(self, scenario_path, frame_slots, result=None, error=None):
+        # runs on the result thread of the pool, which must not raise
+        for slot in frame_slots:
+            slot.release()
+        try:
+            if error is not None:
+                raise error
+            frame_id, voxel_data, seconds = result
+            Profiler.add_time("voxelize", seconds)
+            with self._condition:
+                self._get_writer(scenario_path).write_frame_array(frame_id, voxel_data)
+        except Exception as e:
+            logging.error(f"Could not voxelize a frame of {scenario_path}", exc_info=e)
+            succeeded = False
+        else:
+            succeeded = True
+        self._slots.release()
+        with self._condition:
+            self._pending -= 1
+            if succeeded:
+                self.completed_frames += 1
+            else:
+                self.failed_frames += 1
+            self._condition.notify_all()
+
+    @property
+    def pending_frames(self):
+        with self._condition:
+            return self._pending
+
+    def flush(self):
+        """
+        Blocks until all frames submitted so far are voxelized and closes the containers. Returns the number of frames
+        that failed since the last flush.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending == 0)
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+            failed, self.failed_frames = self.failed_frames, 0
+            completed, self.completed_frames = self.completed_frames, 0
+        logging.debug(f"Voxelized {completed} frames, {failed} failed")
+        return failed
+
+    def shutdown(self):
+        self.flush()
+        self._pool.close()
+        self._pool.join()
+
+
+_ONLINE_VOXELIZER = None
+_ONLINE_VOXELIZER_LOCK = threading.Lock()
+
+
+def get_online_voxelizer():
+    """
+    Returns the online voxelizer shared by all frames, it is created on first use.
+    """
+    global _ONLINE_VOXELIZER
+    with _ONLINE_VOXELIZER_LOCK:
+        if _ONLINE_VOXELIZER is None:
+            _ONLINE_VOXELIZER = OnlineVoxelizer()
+        return _ONLINE_VOXELIZER
+
+
+def generate_data(frame_data, camera_params):
+    """
+    Schedules the voxelization of a frame, if Definitions.ONLINE_VOXELIZATION is set.
+    """
+    if Definitions.ONLINE_VOXELIZATION:
+        get_online_voxelizer().submit(frame_data, camera_params)
+
+
+def flush_voxel_grids():
+    """
+    Waits for all pending frames and closes the voxel grid containers. Returns the number of frames that failed since
+    the last flush.
+    """
+    if _ONLINE_VOXELIZER is None:
+        return 0
+    return _ONLINE_VOXELIZER.flush()
+
+
+def shutdown_voxel_grids():
+    """
+    Waits for all pending frames and stops the worker processes.
+    """
+    global _ONLINE_VOXELIZER
+    with _ONLINE_VOXELIZER_LOCK:
+        if _ONLINE_VOXELIZER is not None:
+            _ONLINE_VOXELIZER.shutdown()
+            _ONLINE_VOXELIZER = None
+
+# endregion
+# ======================================================================================================================
@@ -0,0 +1,148 @@
+"""This module writes sensor data to disk in the background, so the simulation does not wait for PNG encoding and disk
+writes. Writes are handed to a bounded pool of worker threads: the frame buffers are passed on as they are (no copy),
+and once too many writes are pending, submitting blocks until a worker is free again (back-pressure). PNG encoding and
+file writes release the GIL, so threads are sufficient. flush() is the barrier that waits for all pending writes,
+e.g. at the end of a scenario."""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import Definitions
+from DataAnalysis import Profiler
+
+
+# ======================================================================================================================
+# region -- WRITE BEHIND EXECUTOR --------------------------------------------------------------------------------------
+# ======================================================================================================================
+class WriteBehindExecutor:
+    """
+    Runs write jobs on worker threads. At most max_pending jobs are queued or running at the same time, submit blocks
+    while this limit is reached. Failed writes are logged and counted, they do not stop the simulation.
+    """
+
+    def __init__(self, workers=Definitions.WRITE_BEHIND_WORKERS, max_pending=Definitions.WRITE_BEHIND_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="write_behind")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._condition = threading.Condition()
+        self._pending = 0
+        self.failed_writes = 0
+        self.completed_writes = 0
+
+    def submit(self, write_function, file_path, data):
+        """
+        Schedules write_function(file_path, data). data must not be modified afterwards, it is written as is.
+        """
+        with Profiler.phase("write_backpressure"):
+            self._slots.acquire()
+        with self._condition:
+            self._pending += 1
+        try:
+            future = self._executor.submit(write_function, file_path, data)
+        except Exception:
+            self._slots.release()
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify_all()
+            raise
+        future.add_done_callback(lambda f: self._on_done(f, file_path))
+        return future
+
+    def _on_done(self, future, file_path):
+        if future.exception() is not None:
+            logging.error(f"Could not write {file_path}", exc_info=future.exception())
+        self._slots.release()
+        with self._condition:
+            self._pending -= 1
+            if future.exception() is not None:
+                self.failed_writes += 1
+            else:
+                self.completed_writes += 1
+            self._condition.notify_all()
+
+    @property
+    def pending_writes(self):
+        with self._condition:
+            return self._pending
+
+    def flush(self):
+        """
+        Blocks until all writes submitted so far are finished. Returns the number of writes that failed since the last
+        flush.
+        """
+        with self._condition:
+            # the done callbacks log errors and update the counters, so wait for them instead of the futures
+            self._condition.wait_for(lambda: self._pending == 0)
+            failed, self.failed_writes = self.failed_writes, 0
+            completed, self.completed_writes = self.completed_writes, 0
+        logging.debug(f"Flushed {completed} writes, {failed} failed")
+        return failed
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
+_WRITE_BEHIND_EXECUTOR = None
+_WRITE_BEHIND_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_write_behind_executor():
+    """
+    Returns the write behind executor shared by all frames, it is created on first use.
+    """
+    global _WRITE_BEHIND_EXECUTOR
+    with _WRITE_BEHIND_EXECUTOR_LOCK:
+        if _WRITE_BEHIND_EXECUTOR is None:
+            _WRITE_BEHIND_EXECUTOR = WriteBehindExecutor()
+        return _WRITE_BEHIND_EXECUTOR
+
+
+def flush_writes():
+    """
+    Waits for all pending writes. Returns the number of writes that failed since the last flush.
+    """
+    if _WRITE_BEHIND_EXECUTOR is None:
+        return 0
+    return _WRITE_BEHIND_EXECUTOR.flush()
+
+
+def shutdown_writes():
+    """
+    Waits for all pending writes and stops the worker threads.
+    """
+    global _WRITE_BEHIND_EXECUTOR
+    with _WRITE_BEHIND_EXECUTOR_LOCK:
+        if _WRITE_BEHIND_EXECUTOR is not None:
+            _WRITE_BEHIND_EXECUTOR.shutdown()
+            _WRITE_BEHIND_EXECUTOR = None
+
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- WRITE FUNCTIONS --------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def write_image(file_path, data):
+    with Profiler.phase("disk_write"):
+        Image.fromarray(data).save(file_path)
+
+
+def write_npy(file_path, data):
+    with Profiler.phase("disk_write"):
+        np.save(file_path, data)
+
+
+def save_image_async(file_path, data):
+    return get_write_behind_executor().submit(write_image, file_path, data)
+
+
+def save_npy_async(file_path, data):
+    return get_write_behind_executor().submit(write_npy, file_path, data)
+
+# endregion
+# ======================================================================================================================
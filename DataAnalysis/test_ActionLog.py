@@ -0,0 +1,141 @@
+"""Tests of the action log: round trip of the rows and export of the csv files of the previous output layout."""
+import os
+
+import numpy as np
+import pytest
+
+from DataAnalysis.ActionLog import ActionLog, ActionLogReader, export_csv, read_anomaly_attributes
+
+SCENARIO_ID = "abc-123"
+WHEELS = ("FR", "FL", "BR", "BL")
+MATRICES = ("camera transformation matrix", "camera inverse transformation matrix", "lidar transformation matrix",
+            "lidar inverse transformation matrix")
+
+
+def float32(rng):
+    """Carla reports float32 values, their float64 repr survives the round trip through the log."""
+    return float(np.float32(rng.normal()))
+
+
+def action_dict(rng, frame_id, vehicle_id=7, vehicle_type_id="vehicle.tesla.model3"):
+    """Returns the action dict of a frame as Util.get_action_state_data builds it and the dict of its csv file."""
+    steering_curve = ((float32(rng), float32(rng)), (float32(rng), float32(rng)))
+    values = {
+        "frame_id": frame_id, "scenario_id": SCENARIO_ID, "vehicle_id": vehicle_id, "vehicle_type_id": vehicle_type_id,
+        "speed": 3.6 * float32(rng) ** 2, "throttle": float32(rng), "steer": float32(rng), "brake": 0.0,
+        "hand_brake": False, "reverse": bool(frame_id % 2), "gear": frame_id % 5, "max_rpm": float32(rng),
+        "final_ratio": float32(rng), "mass": 1845.0,
+        "center_of_mass": (float32(rng), float32(rng), float32(rng)), "steering_curve": steering_curve,
+    }
+    values.update({f"{wheel}_wheel max steer angle": float32(rng) for wheel in WHEELS})
+    values.update({f"{wheel}_wheel tire friction": float32(rng) for wheel in WHEELS})
+    values.update({key: [[float32(rng) for _ in range(4)] for _ in range(4)] for key in MATRICES})
+
+    legacy = dict(values)
+    (x_0, y_0), (x_1, y_1) = steering_curve
+    legacy["steering_curve"] = (f"{x_0},{y_0})", f"({x_1}/{y_1}")
+    return values, legacy
+
+
+def anomaly_dict(rng, frame_id, semantic_tags=(30,), anomaly_type_id="static.prop.o_barbedwire_special"):
+    values = {
+        "frame_id": frame_id, "scenario_id": SCENARIO_ID, "anomaly_id": 99, "anomaly_type_id": anomaly_type_id,
+        "anomaly_is_alive": True, "semantic_tags": list(semantic_tags),
+        "location": (float32(rng), float32(rng), float32(rng)), "velocity": (0.0, 0.0, 0.0),
+        "acceleration": (float32(rng), float32(rng), float32(rng)),
+        # blueprint attributes of the anomaly actor
+        "role_name": "", "size": "medium", "is_invincible": "true",
+    }
+    return values, values
+
+
+def write_legacy_csv(path, values):
+    """The per-frame csv files as OutputGenerator wrote them before the action log."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        for key, value in values.items():
+            f.write(f"{key} ; {value}\n")
+
+
+def record_scenario(rng, legacy_dir, anomaly_kind, frame_ids):
+    log = ActionLog(SCENARIO_ID)
+    for frame_id in frame_ids:
+        action, legacy_action = action_dict(rng, frame_id)
+        if anomaly_kind == "anomaly":
+            anomaly, legacy_anomaly = anomaly_dict(rng, frame_id)
+        elif anomaly_kind == "vehicle":
+            anomaly, legacy_anomaly = action_dict(rng, frame_id, 12, "vehicle.audi.a2")
+        else:
+            anomaly = legacy_anomaly = None
+        log.append(action, anomaly)
+        write_legacy_csv(os.path.join(legacy_dir, "ACTION", f"ACTION_{frame_id}.csv"), legacy_action)
+        if legacy_anomaly is not None:
+            write_legacy_csv(os.path.join(legacy_dir, "ANOMALY", f"ANOMALY_{frame_id}.csv"), legacy_anomaly)
+    return log
+
+
+@pytest.mark.parametrize("anomaly_kind", ["anomaly", "vehicle", None])
+def test_export_csv_matches_previous_layout(tmp_path, anomaly_kind):
+    rng = np.random.default_rng(0)
+    frame_ids = rng.permutation(np.arange(100, 130)).tolist()
+    legacy_dir = tmp_path / "legacy"
+    log = record_scenario(rng, legacy_dir, anomaly_kind, frame_ids)
+    assert len(log) == len(frame_ids)
+
+    path = tmp_path / "Scenario" / "ACTION_LOG.npz"
+    log.save(str(path))
+    written = export_csv(str(path))
+
+    expected_files = [os.path.join(subfolder, name) for subfolder in ("ACTION", "ANOMALY")
+                      if (legacy_dir / subfolder).is_dir() for name in os.listdir(legacy_dir / subfolder)]
+    assert written == len(expected_files) == len(frame_ids) * (2 if anomaly_kind else 1)
+    for file in expected_files:
+        assert (tmp_path / "Scenario" / file).read_text() == (legacy_dir / file).read_text(), file
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    frame_ids = [5, 3, 4]
+    log = record_scenario(rng, tmp_path / "legacy", "anomaly", frame_ids)
+    path = str(tmp_path / "ACTION_LOG.npz")
+    log.save(path)
+
+    reader = ActionLogReader(path)
+    assert reader.scenario_id == SCENARIO_ID
+    assert reader.anomaly_schema == "anomaly"
+    assert reader.anomaly_attributes == {"role_name": "", "size": "medium", "is_invincible": "true"}
+    assert reader.ego_vehicle["frame_id"].tolist() == sorted(frame_ids)
+    assert reader.anomaly["frame_id"].tolist() == sorted(frame_ids)
+    assert reader.ego_vehicle["vehicle_type_id"][0] == "vehicle.tesla.model3"
+    assert reader.ego_vehicle["camera_matrix"].shape == (3, 4, 4)
+    assert reader.anomaly["semantic_tags"][0].tolist()[0] == 30
+
+    assert read_anomaly_attributes(path) == {"anomaly_type_id": "static.prop.o_barbedwire_special", "size": "medium"}
+
+
+def test_long_type_ids_and_many_semantic_tags(tmp_path):
+    rng = np.random.default_rng(2)
+    vehicle_type_id = "vehicle." + "x" * 100
+    anomaly_type_id = "static.prop." + "y" * 200
+    log = ActionLog(SCENARIO_ID)
+    for frame_id, semantic_tags in enumerate([(30,), (), tuple(range(1, 10))]):
+        log.append(action_dict(rng, frame_id, vehicle_type_id=vehicle_type_id)[0],
+                   anomaly_dict(rng, frame_id, semantic_tags, anomaly_type_id)[0])
+    path = str(tmp_path / "ACTION_LOG.npz")
+    log.save(path)
+
+    reader = ActionLogReader(path)
+    assert reader.ego_vehicle["vehicle_type_id"].tolist() == [vehicle_type_id] * 3
+    assert reader.anomaly["anomaly_type_id"].tolist() == [anomaly_type_id] * 3
+    assert reader.anomaly["semantic_tags"].shape == (3, 9)
+    assert [values["semantic_tags"] for values in reader.legacy_dicts("anomaly")] == [[30], [], list(range(1, 10))]
+    assert read_anomaly_attributes(path)["anomaly_type_id"] == anomaly_type_id
+
+
+def test_empty_log(tmp_path):
+    path = str(tmp_path / "ACTION_LOG.npz")
+    ActionLog(SCENARIO_ID).save(path)
+    reader = ActionLogReader(path)
+    assert len(reader.ego_vehicle) == len(reader.anomaly) == 0
+    assert read_anomaly_attributes(path) == dict()
+    assert export_csv(path) == 0
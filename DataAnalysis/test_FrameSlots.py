@@ -0,0 +1,108 @@
+"""Tests of the frame slot rings: reuse of released slots, fallback to plain arrays and attaching a slot by its ref."""
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import Definitions
+from DataAnalysis.FrameSlots import FrameSlotRing, acquire_frame_slot, close_frame_slots, open_frame_slot
+
+
+@pytest.fixture
+def ring():
+    ring = FrameSlotRing("test/rgb", rows=4, item_shape=(3,), dtype=np.uint8, slot_count=2)
+    yield ring
+    ring.close()
+
+
+def test_slots_are_reused_after_the_last_release(ring):
+    first = ring.acquire(4)
+    second = ring.acquire(2)
+    assert first.shared and second.shared
+    assert second.array.shape == (2, 3)
+
+    # the ring is exhausted, the next frame gets a plain array
+    fallback = ring.acquire(4)
+    assert not fallback.shared
+    assert fallback.ref() is None
+
+    first.retain()
+    first.release()
+    assert not ring.acquire(1).shared
+    first.release()
+    assert ring.acquire(1).shared
+
+
+def test_too_many_rows_fall_back_to_a_plain_array(ring):
+    slot = ring.acquire(5)
+    assert not slot.shared
+    assert slot.array.shape == (5, 3)
+
+
+def test_open_frame_slot(ring):
+    slot = ring.acquire(3)
+    slot.array[:] = np.arange(9, dtype=np.uint8).reshape(3, 3)
+
+    view = open_frame_slot(slot.ref())
+    np.testing.assert_array_equal(view, slot.array)
+    assert not view.flags.writeable
+
+
+def _sum_frame_slot(ref):
+    return int(open_frame_slot(ref).astype(np.int64).sum())
+
+
+def test_open_frame_slot_in_a_child_process(ring):
+    slot = ring.acquire(4)
+    slot.array[:] = 7
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert pool.apply(_sum_frame_slot, (slot.ref(),)) == 7 * 12
+
+
+def test_acquire_frame_slot(monkeypatch):
+    monkeypatch.setattr(Definitions, "FRAME_SLOTS_PER_SENSOR", 2)
+    try:
+        slot = acquire_frame_slot("lidar", "points", 10, (4,), np.float32, headroom=1.5)
+        assert slot.shared
+        slot.release()
+        # up to rows * headroom rows fit into the slots of the ring
+        assert acquire_frame_slot("lidar", "points", 15, (4,), np.float32).shared
+        assert not acquire_frame_slot("lidar", "points", 16, (4,), np.float32).shared
+        # a changed setup of the sensor replaces the ring
+        assert acquire_frame_slot("lidar", "points", 10, (3,), np.float32).array.shape == (10, 3)
+    finally:
+        close_frame_slots()
+
+    monkeypatch.setattr(Definitions, "FRAME_SLOTS_PER_SENSOR", 0)
+    assert not acquire_frame_slot("lidar", "points", 10, (4,), np.float32).shared
+
+
+def test_changed_setup_keeps_slots_in_use_valid(monkeypatch):
+    monkeypatch.setattr(Definitions, "FRAME_SLOTS_PER_SENSOR", 2)
+    try:
+        slot = acquire_frame_slot("camera", "rgb", 4, (3,), np.uint8)
+        slot.array[:] = 5
+        ref = slot.ref()
+
+        # the ring of the old setup is retired, the slot is still attachable, e.g. by a pending voxelization
+        acquire_frame_slot("camera", "rgb", 4, (4,), np.uint8).release()
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            assert pool.apply(_sum_frame_slot, (ref,)) == 5 * 12
+
+        # the shared memory of the retired ring is freed with its last slot
+        slot.release()
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=ref.shm_name)
+    finally:
+        close_frame_slots()
+
+
+def test_close_frame_slots_frees_retired_rings(monkeypatch):
+    monkeypatch.setattr(Definitions, "FRAME_SLOTS_PER_SENSOR", 2)
+    slot = acquire_frame_slot("camera", "depth", 4, (3,), np.uint8)
+    acquire_frame_slot("camera", "depth", 4, (4,), np.uint8)
+    close_frame_slots()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=slot.ref().shm_name)
+    slot.release()  # releasing a slot after closing does not fail
@@ -24,6 +24,16 @@ PORT = 2000
 TIMEOUT = 10000  # Default is 5sec
 """Timeout for carla connection"""
 
+TRAFFIC_MANAGER_PORT = 8000
+"""Port of the traffic manager. Every carla server that is used at the same time needs its own port."""
+
+DISPATCH_MAX_ATTEMPTS = 3
+"""How often the scenario dispatcher runs a scenario before it is given up (see Scenarios/ScenarioDispatcher.py)"""
+
+ROUTE_PLANNER_DISK_CACHE = True
+"""Whether the route planner graph of every map is stored on disk and reused by later runs (see
+Models/World/RoutePlannerCache.py)"""
+
 # endregion
 # ======================================================================================================================
 
@@ -44,6 +54,12 @@ By changing this you change the interval in which data gets "recorded" - 2 means
 With fixed delta seconds 0.1 (100ms) with 400 max Tick count means every second data package out of 400 - which is 200.
 """
 
+SENSOR_SYNC_TIMEOUT = 10.0
+"""Seconds to wait for the data of all sensors of a recorded frame, the frame is skipped afterwards"""
+
+SENSOR_SYNC_MAX_FRAMES = 4
+"""Maximum number of frames buffered per sensor, older frames are dropped (see Scenarios/SensorSync.py)"""
+
 # endregion
 # ======================================================================================================================
 
@@ -175,6 +191,17 @@ Uncomment every Static object category that should be used in the dataset
 
 DISTANCE_INTERVAL = [65, 105]  # in Waypoints (the route length of the ego vehicle should be at least 105 waypoints)
 
+ROUTE_CANDIDATE_INDEX = True
+"""Whether ego routes are drawn from the route candidate index of the map (see Scenarios/RouteCandidateIndex.py)
+instead of planning routes between random spawn points until one is valid"""
+
+ROUTE_CANDIDATE_MAX_PAIRS = 5000
+"""Maximum number of spawn point pairs planned for the route candidate index of a map, larger maps are sampled"""
+
+ROUTE_CANDIDATE_EXTEND_PAIRS = 500
+"""Number of further sampled spawn point pairs planned each time the route candidate index of a map that does not
+contain all pairs yet is loaded"""
+
 # --- SUDDEN BREAKING OF VEHICLE AHEAD ---------------------------------------------------------------------------------
 DISTANCE_INTERVAL_SUDDEN_BREAKING = [7, 12]  # in Waypoints (the route length of the ego vehicle should be at least 12 waypoints)
 
@@ -218,6 +245,7 @@ class DataFormat(Enum):
     ACTION = ".csv"
     ANOMALY = ".csv"
     ROUTE_MAP = ".png"
+    ROUTE_MAP_PACKED = ".npy"
 
 
 IMAGE_HEIGHT = 512
@@ -284,6 +312,21 @@ BEV_OFFSET_FORWARD_YC = 0  # in px
 BEV_RESOLUTION_YC = 0.2
 OFFSET_Z_YC = 0  # in px
 
+VOXEL_GROUND_TRUTH_VERSION = 2
+"""Version of the voxel ground truth, stored in every voxel grid container. Version 2 merges the back-projected depth
+images and the semantic lidar point clouds, version 1 (containers without a version) only the semantic lidar point
+clouds. voxelize_separate.py voxelizes containers of another version again"""
+
+ONLINE_VOXELIZATION = False
+"""Whether the voxel ground truth is created while the scenarios run, from the frames in memory, instead of by
+voxelize_separate.py afterwards (see DataAnalysis/VoxelGenerator.py)"""
+
+ONLINE_VOXELIZATION_WORKERS = 4
+"""Number of processes that voxelize the frames of the running scenario"""
+
+ONLINE_VOXELIZATION_MAX_PENDING = 8
+"""Maximum number of frames waiting for the voxelization. If reached, the simulation waits until a frame is done"""
+
 # --- ROUTEMAP  --------------------------------------------------------------------------------------------------
 
 ROUTE_COLOR_WHITE = (255, 255, 255)
@@ -294,6 +337,10 @@ BEV_WIDTH = 192
 BEV_PIXELS_PER_METER = float(5.0)
 BEV_PIXELS_EV_TO_BOTTOM = 40
 
+BEV_ROUTE_MAP_PACKED = False
+"""Whether the route maps are written as bit-packed boolean masks (.npy, 8 pixels per byte) instead of PNG images, see
+DataAnalysis.BevGenerator.unpack_route_map"""
+
 # --- COLORS -----------------------------------------------------------------------------------------------------------
 
 Label = namedtuple(
@@ -582,11 +629,58 @@ logging.getLogger().addHandler(console_handler)
 # endregion
 # ======================================================================================================================
 
+# ======================================================================================================================
+# region -- WRITE BEHIND -----------------------------------------------------------------------------------------------
+# ======================================================================================================================
+
+WRITE_BEHIND_WORKERS = 4
+"""Number of threads that encode and write sensor data in the background."""
+
+WRITE_BEHIND_MAX_PENDING = 64
+"""Maximum number of pending writes. If reached, the simulation waits until a write is finished, which bounds the
+memory used by frames that are not written yet."""
+
+FRAME_SLOTS_PER_SENSOR = 16
+"""Number of preallocated shared memory slots per sensor output that the decoded sensor data of a frame is written to
+(see DataAnalysis/FrameSlots.py). 0 allocates new arrays for every frame."""
+
+FRAME_SLOT_LIDAR_HEADROOM = 1.5
+"""Room of a lidar frame slot relative to the number of points of the first frame, the point count varies per frame"""
+
+FRAME_PIPELINE_DEPTH = 2
+"""Number of recorded frames that are post-processed (decoding, relabeling, BEV route map, writes) on a background
+thread while the simulation ticks on (see DataAnalysis/FramePipeline.py). If reached, the simulation waits until a
+frame is done. 0 post-processes every frame in the tick loop."""
+
+# endregion
+# ======================================================================================================================
+
+# ======================================================================================================================
+# region -- PROFILING --------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+
+PROFILE_SCENARIOS = False
+"""Whether the phases of the tick loop and the data generation are timed and written to a profile per scenario
+(see DataAnalysis/Profiler.py)"""
+
+PROFILE_FILE_NAME = 'profile'
+"""Name of the profile files of a scenario, written as .json and .csv next to the sensor setup file"""
+
+# endregion
+# ======================================================================================================================
+
 # ======================================================================================================================
 # region -- GENERAL DEFAULTS -------------------------------------------------------------------------------------------
 # ======================================================================================================================
 
 SENSOR_SETUP_FILE_NAME = 'sensor_setup.json'
 
+RUN_MANIFEST_FILE_NAME = 'run_manifest.jsonl'
+"""State of every scenario of a run, used to resume interrupted runs (see Scenarios/RunManifest.py)"""
+
+ACTION_LOG_EXPORT_CSV = False
+"""Whether the per-frame ACTION and ANOMALY csv files of the previous output layout are exported from the action log of
+every scenario (see DataAnalysis/ActionLog.py), Tools/export_action_csv.py exports them later on"""
+
 # endregion
 # ======================================================================================================================
@@ -11,6 +11,8 @@ from Definitions import SENSOR_SETUP_FILE_NAME
 
 ROOT_DATA_DIR = os.path.join(Path(__file__).parent, "Data")
 ROOT_OUTPUTS_DIR = os.path.join(ROOT_DATA_DIR, "Outputs")
+ROUTE_PLANNER_CACHE_DIR = os.path.join(ROOT_DATA_DIR, "Cache", "RoutePlanner")
+ROUTE_CANDIDATE_CACHE_DIR = os.path.join(ROOT_DATA_DIR, "Cache", "RouteCandidates")
 TIME_STAMP = None
 THIS_OUTPUT_PATH = ""
 
@@ -50,23 +52,21 @@ def initialize_variables():
     logging.info(f"Initialized variables: TIME_STAMP={TIME_STAMP}, THIS_OUTPUT_PATH={THIS_OUTPUT_PATH}")
 
 
-def create_file_name(frame_id, scenario_id, subfolder, file_ending, run_makedirs=True):
+def create_file_name(frame_id, scenario_id, subfolder, file_ending, run_makedirs=True, output_path=None):
     """
     Create a file name based on the given parameters.
     """
     file_name = f"{subfolder}_{str(frame_id)}{file_ending}"  # RGB_IMG + 0123 + .png
-    file_path = generate_path_in_scenario(scenario_id, subfolder, file_name, run_makedirs)
+    file_path = generate_path_in_scenario(scenario_id, subfolder, file_name, run_makedirs, output_path)
     return file_path
 
 
-def generate_path_in_scenario(scenario_id, sensor_name, file_name, run_makedirs=True):
+def generate_path_in_scenario(scenario_id, sensor_name, file_name, run_makedirs=True, output_path=None):
     """
-    This method generates a path for a file in a given scenario and sensor.
+    This method generates a path for a file in a given scenario and sensor. output_path is the output folder of the
+    run, THIS_OUTPUT_PATH by default.
     """
-    scenario_path = os.path.join(
-        THIS_OUTPUT_PATH,
-        f"Scenario_{scenario_id}",
-    )
+    scenario_path = get_scenario_path(scenario_id, output_path)
     if run_makedirs:
         os.makedirs(scenario_path, exist_ok=True)
     sensor_path = os.path.join(scenario_path, f"{sensor_name}")
@@ -76,11 +76,18 @@ def generate_path_in_scenario(scenario_id, sensor_name, file_name, run_makedirs=
     return file_path
 
 
-def save_sensor_setup(scenario_id, sensor_setup_data):
-    scenario_path = os.path.join(
-        THIS_OUTPUT_PATH,
+def get_scenario_path(scenario_id, output_path=None):
+    """
+    Returns the output directory of the scenario scenario_id in output_path, THIS_OUTPUT_PATH by default.
+    """
+    return os.path.join(
+        output_path or THIS_OUTPUT_PATH,
         f"Scenario_{scenario_id}",
     )
+
+
+def save_sensor_setup(scenario_id, sensor_setup_data, output_path=None):
+    scenario_path = get_scenario_path(scenario_id, output_path)
     os.makedirs(scenario_path, exist_ok=True)
     file_path = os.path.join(scenario_path, SENSOR_SETUP_FILE_NAME)
 
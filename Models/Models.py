@@ -1,9 +1,8 @@
 """This module defines classes for representing data related to actions, frames, and worlds in a scenario,
 with functionality for generating output files and saving various types of data."""
 import numpy as np
-from PIL import Image
 
-from DataAnalysis import OutputGenerator
+from DataAnalysis.WriteBehind import save_image_async, save_npy_async
 from EgoVehicleSetup import RGB_CAM_TYPE, DEPTH_CAM_TYPE, INSTANCE_CAM_TYPE, SEMANTIC_CAM_TYPE, LIDAR_TYPE, \
     SEMANTIC_LIDAR_TYPE
 
@@ -22,15 +21,13 @@ class ActionData:
             frame_id,
             action_dict,
             anomaly_dict,
+            output_path=None,
     ):
         self.scenario_id = scenario_id
         self.frame_id = frame_id
         self.action_dict = action_dict
         self.anomaly_dict = anomaly_dict
-        self._action_csv_path = None
-        self.action_csv_path
-        self._anomaly_csv_path = None
-        self.anomaly_csv_path
+        self.output_path = output_path  # output folder of the run, FileStructureManager.THIS_OUTPUT_PATH if None
 
     @property
     def action_dict(self):
@@ -40,18 +37,6 @@ class ActionData:
     def action_dict(self, action_dict):
         self._action_dict = action_dict
 
-    @property
-    def action_csv_path(self):
-        if not self._action_csv_path:
-            self._action_csv_path = OutputGenerator.generate_action_csv(self)
-        return self._action_csv_path
-
-    @property
-    def anomaly_csv_path(self):
-        if not self._anomaly_csv_path and self.anomaly_dict != None:
-            self._anomaly_csv_path = OutputGenerator.generate_anomaly_csv(self)
-        return self._anomaly_csv_path
-
 
 # endregion
 # ======================================================================================================================
@@ -65,10 +50,11 @@ class FrameData:
     Class representing a frame of data in a data set.contains all types of data relevant to finished data set
     """
 
-    def __init__(self, frame_id, scenario_id):
+    def __init__(self, frame_id, scenario_id, output_path=None):
         # Tuple of scenario ID and frame number
         self.frame_id = frame_id
         self.scenario_id = scenario_id
+        self.output_path = output_path  # output folder of the run, FileStructureManager.THIS_OUTPUT_PATH if None
         self.anomalies = []  # List to store anomalies
         self.route_map = None
         self.route_map_data = None
@@ -93,13 +79,14 @@ class FrameData:
         #     }
         # }
 
-    def set_point_ids(self, point_ids, location, rotation):
+    def set_point_ids(self, point_ids, location, rotation, slot=None):
         if not self.sensor_data.get((location, rotation)):
             self.sensor_data[(location, rotation)] = dict()
         if not self.sensor_data[(location, rotation)].get(SEMANTIC_LIDAR_TYPE):
             self.sensor_data[(location, rotation)][SEMANTIC_LIDAR_TYPE] = dict()
 
         self.sensor_data[(location, rotation)][SEMANTIC_LIDAR_TYPE]['point_ids'] = point_ids
+        self.sensor_data[(location, rotation)][SEMANTIC_LIDAR_TYPE]['point_ids_slot'] = slot
 
     def set_data(
             self,
@@ -108,14 +95,16 @@ class FrameData:
             sensor_type,
             location,
             rotation,
-            save_data
+            save_data,
+            slot=None
     ):
         if not self.sensor_data.get((location, rotation)):
             self.sensor_data[(location, rotation)] = dict()
         self.sensor_data[(location, rotation)][sensor_type] = {
             'file_path': file_path,
             'data': raw_data,
-            'save_data': save_data
+            'save_data': save_data,
+            'slot': slot
         }
 
     def set_route_map(self, file_path, raw_data):
@@ -123,22 +112,49 @@ class FrameData:
         self.route_map_data = raw_data
 
     def save_files(self):
-
+        """
+        Hands the sensor data to the write behind executor, the files are written in the background. The data arrays
+        are not copied, so they must not be modified afterwards. Every write holds a reference to the frame slot of its
+        data until it is finished. Use DataAnalysis.WriteBehind.flush_writes to wait until all files are written.
+        """
         for location_rotation in self.sensor_data:
             for sensor_type in self.sensor_data[location_rotation]:
                 if self.sensor_data[location_rotation][sensor_type]['save_data']:
                     if sensor_type in (RGB_CAM_TYPE, DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, INSTANCE_CAM_TYPE):
-                        im = Image.fromarray(self.sensor_data[location_rotation][sensor_type]['data'])
-                        im.save(self.sensor_data[location_rotation][sensor_type]['file_path'])
+                        save_async = save_image_async
                     elif sensor_type in (LIDAR_TYPE, SEMANTIC_LIDAR_TYPE):
-                        np.save(
-                            self.sensor_data[location_rotation][sensor_type]['file_path'],
-                            self.sensor_data[location_rotation][sensor_type]['data']
-                        )
-
-    def save_route_map(self):
-        route_map = Image.fromarray((self.route_map_data * 255).astype(np.uint8), mode='L')
-        route_map.save(self.route_map)
+                        save_async = save_npy_async
+                    else:
+                        continue
+                    slot = self.sensor_data[location_rotation][sensor_type].get('slot')
+                    if slot is not None:
+                        slot.retain()
+                    future = save_async(
+                        self.sensor_data[location_rotation][sensor_type]['file_path'],
+                        self.sensor_data[location_rotation][sensor_type]['data']
+                    )
+                    if slot is not None:
+                        future.add_done_callback(lambda f, s=slot: s.release())
+
+    def release_slots(self):
+        """
+        Releases the frame slots of the sensor data once the frame is processed. The data of a released slot is
+        overwritten by later frames, so it is removed from the frame.
+        """
+        for sensor_data in self.sensor_data.values():
+            for data in sensor_data.values():
+                for data_key, slot_key in (('data', 'slot'), ('point_ids', 'point_ids_slot')):
+                    if data.get(slot_key) is not None:
+                        data[slot_key].release()
+                        data[slot_key] = None
+                        data[data_key] = None
+
+    def save_route_map(self, packed=False):
+        if packed:
+            # 8 pixels of a row per byte, see DataAnalysis.BevGenerator.unpack_route_map
+            save_npy_async(self.route_map, np.packbits(self.route_map_data, axis=-1))
+        else:
+            save_image_async(self.route_map, (self.route_map_data * 255).astype(np.uint8))
 
 
 # endregion
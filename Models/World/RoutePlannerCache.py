@@ -0,0 +1,271 @@
+"""This module caches the graph of the GlobalRoutePlanner per map and sampling resolution. Building the graph retrieves
+the topology of the map and samples waypoints along every lane, which used to be done again for every planned route.
+The graph is built once, kept in memory for all later routes of the process and stored on disk in a compact form (node
+coordinates, edges and the OpenDRIVE keys of their waypoints), so later runs and other processes only load it. The cache
+file name contains a hash of the OpenDRIVE map, a changed map is built again."""
+import hashlib
+import logging
+import os
+import time
+
+import carla
+import networkx as nx
+import numpy as np
+
+import Definitions
+import FileStructureManager
+from Models.World.global_route_planner import GlobalRoutePlanner
+from Models.World.local_planner import RoadOption
+
+CACHE_VERSION = 1
+
+# edges of road segments, of loose ends and lane change links carry different attributes
+SEGMENT_EDGE, LOOSE_END_EDGE, LANE_CHANGE_EDGE = 0, 1, 2
+
+WAYPOINT_LOCATION_TOLERANCE = 0.1
+"""Maximum distance in meters between a waypoint loaded by its OpenDRIVE key and its stored location."""
+
+_WAYPOINT_DTYPE = np.dtype([("road_id", "<i4"), ("lane_id", "<i4"), ("s", "<f8"), ("location", "<f8", (3,))])
+_NODE_DTYPE = np.dtype([("id", "<i8"), ("vertex", "<f8", (3,))])
+_EDGE_DTYPE = np.dtype([
+    ("n1", "<i8"),
+    ("n2", "<i8"),
+    ("kind", "u1"),
+    ("type", "<i1"),
+    ("length", "<i8"),
+    ("intersection", "?"),
+    ("entry_waypoint", "<i8"),
+    ("exit_waypoint", "<i8"),
+    ("change_waypoint", "<i8"),
+    ("path_start", "<i8"),
+    ("path_end", "<i8"),
+    ("entry_vector", "<f8", (3,)),
+    ("exit_vector", "<f8", (3,)),
+    ("net_vector", "<f8", (3,)),
+])
+_ROAD_EDGE_DTYPE = np.dtype([
+    ("road_id", "<i8"),
+    ("section_id", "<i8"),
+    ("lane_id", "<i8"),
+    ("n1", "<i8"),
+    ("n2", "<i8"),
+])
+
+_PLANNERS = dict()  # (map name, sampling resolution) -> GlobalRoutePlanner
+
+
+# ======================================================================================================================
+# region -- SERIALIZATION ----------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def _edge_kind(edge):
+    if "change_waypoint" in edge:
+        return LANE_CHANGE_EDGE
+    if edge["entry_vector"] is None:
+        return LOOSE_END_EDGE
+    return SEGMENT_EDGE
+
+
+def serialize_graph(planner):
+    """
+    Returns the graph of the planner as numpy arrays. Every waypoint is stored once, as its OpenDRIVE key (road id,
+    lane id, s) and its location, the edges refer to the waypoints by index.
+    """
+    waypoint_index = dict()  # waypoint id -> index
+    waypoints = []
+
+    def add_waypoint(waypoint):
+        if waypoint.id not in waypoint_index:
+            waypoint_index[waypoint.id] = len(waypoints)
+            location = waypoint.transform.location
+            waypoints.append((waypoint.road_id, waypoint.lane_id, waypoint.s, (location.x, location.y, location.z)))
+        return waypoint_index[waypoint.id]
+
+    graph = planner._graph
+    nodes = np.array([(node, vertex) for node, vertex in graph.nodes(data="vertex")], dtype=_NODE_DTYPE)
+
+    edges = np.zeros(graph.number_of_edges(), dtype=_EDGE_DTYPE)
+    path_indices = []
+    for i, (n1, n2, edge) in enumerate(graph.edges(data=True)):
+        kind = _edge_kind(edge)
+        record = edges[i]
+        record["n1"], record["n2"], record["kind"] = n1, n2, kind
+        record["type"], record["length"], record["intersection"] = edge["type"], edge["length"], edge["intersection"]
+        record["entry_waypoint"] = add_waypoint(edge["entry_waypoint"])
+        record["exit_waypoint"] = add_waypoint(edge["exit_waypoint"])
+        record["change_waypoint"] = add_waypoint(edge["change_waypoint"]) if kind == LANE_CHANGE_EDGE else -1
+        record["path_start"] = len(path_indices)
+        path_indices.extend(add_waypoint(waypoint) for waypoint in edge["path"])
+        record["path_end"] = len(path_indices)
+        if kind == SEGMENT_EDGE:
+            record["entry_vector"], record["exit_vector"] = edge["entry_vector"], edge["exit_vector"]
+            record["net_vector"] = edge["net_vector"]
+
+    road_edges = np.array([
+        (road_id, section_id, lane_id, n1, n2)
+        for road_id, sections in planner._road_id_to_edge.items()
+        for section_id, lanes in sections.items()
+        for lane_id, (n1, n2) in lanes.items()
+    ], dtype=_ROAD_EDGE_DTYPE)
+
+    return {
+        "version": np.array(CACHE_VERSION),
+        "sampling_resolution": np.array(planner._sampling_resolution, dtype=np.float64),
+        "waypoints": np.array(waypoints, dtype=_WAYPOINT_DTYPE),
+        "nodes": nodes,
+        "edges": edges,
+        "path_indices": np.array(path_indices, dtype=np.int64),
+        "road_edges": road_edges,
+    }
+
+
+def _load_waypoints(wmap, waypoint_table):
+    """
+    Looks up the waypoints by their OpenDRIVE key. Waypoints that are not found at their stored location are
+    projected from the location instead.
+    """
+    waypoints = []
+    projected = 0
+    for road_id, lane_id, s, (x, y, z) in zip(
+            waypoint_table["road_id"].tolist(),
+            waypoint_table["lane_id"].tolist(),
+            waypoint_table["s"].tolist(),
+            waypoint_table["location"].tolist(),
+    ):
+        location = carla.Location(x=x, y=y, z=z)
+        waypoint = wmap.get_waypoint_xodr(road_id, lane_id, s)
+        if waypoint is None or waypoint.transform.location.distance(location) > WAYPOINT_LOCATION_TOLERANCE:
+            waypoint = wmap.get_waypoint(location, project_to_road=False, lane_type=carla.LaneType.Any)
+            projected += 1
+        waypoints.append(waypoint)
+    if projected:
+        logging.debug(f"Route planner cache: {projected} of {len(waypoints)} waypoints projected from their location")
+    return waypoints
+
+
+def deserialize_graph(wmap, arrays):
+    """
+    Creates a GlobalRoutePlanner for wmap from the arrays of serialize_graph.
+    """
+    waypoints = _load_waypoints(wmap, arrays["waypoints"])
+    path_indices = arrays["path_indices"]
+
+    graph = nx.DiGraph()
+    id_map = dict()
+    nodes = arrays["nodes"]
+    for node, vertex in zip(nodes["id"].tolist(), map(tuple, nodes["vertex"].tolist())):
+        graph.add_node(node, vertex=vertex)
+        if node >= 0:  # loose ends get negative ids and are not part of the id map
+            id_map[vertex] = node
+
+    for edge in arrays["edges"]:
+        kind = edge["kind"]
+        attributes = dict(
+            length=int(edge["length"]),
+            path=[waypoints[index] for index in path_indices[edge["path_start"]:edge["path_end"]]],
+            entry_waypoint=waypoints[edge["entry_waypoint"]],
+            exit_waypoint=waypoints[edge["exit_waypoint"]],
+            intersection=bool(edge["intersection"]),
+            exit_vector=None,
+            type=RoadOption(int(edge["type"])),
+        )
+        if kind == SEGMENT_EDGE:
+            attributes.update(
+                entry_vector=np.array(edge["entry_vector"]),
+                exit_vector=np.array(edge["exit_vector"]),
+                net_vector=edge["net_vector"].tolist(),
+            )
+        elif kind == LOOSE_END_EDGE:
+            attributes.update(entry_vector=None, net_vector=None)
+        else:
+            attributes.update(change_waypoint=waypoints[edge["change_waypoint"]])
+        graph.add_edge(int(edge["n1"]), int(edge["n2"]), **attributes)
+
+    road_id_to_edge = dict()
+    for road_id, section_id, lane_id, n1, n2 in arrays["road_edges"].tolist():
+        road_id_to_edge.setdefault(road_id, dict()).setdefault(section_id, dict())[lane_id] = (n1, n2)
+
+    sampling_resolution = float(arrays["sampling_resolution"])
+    return GlobalRoutePlanner.from_graph(wmap, sampling_resolution, graph, id_map, road_id_to_edge)
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- CACHE ------------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def get_map_hash(wmap):
+    """
+    Returns a hash of the OpenDRIVE description of wmap, which changes whenever the road network changes.
+    """
+    return hashlib.sha1(wmap.to_opendrive().encode()).hexdigest()[:16]
+
+
+def get_cache_file_path(wmap, sampling_resolution):
+    """
+    Returns the cache file of the graph of wmap, named by the map, the sampling resolution and a hash of the OpenDRIVE
+    map.
+    """
+    map_name = os.path.basename(wmap.name)
+    file_name = f"{map_name}_{sampling_resolution:g}m_{get_map_hash(wmap)}_v{CACHE_VERSION}.npz"
+    return os.path.join(FileStructureManager.ROUTE_PLANNER_CACHE_DIR, file_name)
+
+
+def save_route_planner(planner, file_path):
+    """
+    Writes the graph of the planner to file_path. The file is written under a temporary name and renamed afterwards, so
+    processes that build the same graph at the same time never read a partial file.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez_compressed(f, **serialize_graph(planner))
+    os.replace(temp_path, file_path)
+
+
+def load_route_planner(wmap, file_path):
+    with np.load(file_path) as arrays:
+        if int(arrays["version"]) != CACHE_VERSION:
+            raise ValueError(f"Route planner cache {file_path} has version {int(arrays['version'])}")
+        return deserialize_graph(wmap, {key: arrays[key] for key in arrays.files})
+
+
+def get_route_planner(wmap, sampling_resolution):
+    """
+    Returns the GlobalRoutePlanner of wmap with sampling_resolution. The planner is shared by all routes of this
+    process, it is loaded from the disk cache or built and stored there (if Definitions.ROUTE_PLANNER_DISK_CACHE) the
+    first time a map is used.
+    """
+    key = (wmap.name, sampling_resolution)
+    planner = _PLANNERS.get(key)
+    if planner is None:
+        planner = _load_or_build_route_planner(wmap, sampling_resolution)
+        _PLANNERS[key] = planner
+    return planner
+
+
+def _load_or_build_route_planner(wmap, sampling_resolution):
+    if not Definitions.ROUTE_PLANNER_DISK_CACHE:
+        return GlobalRoutePlanner(wmap, sampling_resolution)
+
+    file_path = get_cache_file_path(wmap, sampling_resolution)
+    if os.path.isfile(file_path):
+        start = time.perf_counter()
+        try:
+            planner = load_route_planner(wmap, file_path)
+            logging.info(f"Loaded route planner graph from {file_path} in {time.perf_counter() - start:.2f}s")
+            return planner
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Route planner cache {file_path} is unusable, building the graph again: {e}")
+
+    start = time.perf_counter()
+    planner = GlobalRoutePlanner(wmap, sampling_resolution)
+    logging.info(f"Built route planner graph of {wmap.name} in {time.perf_counter() - start:.2f}s")
+    try:
+        save_route_planner(planner, file_path)
+    except OSError as e:
+        logging.warning(f"Could not write route planner cache {file_path}: {e}")
+    return planner
+
+# endregion
+# ======================================================================================================================
@@ -0,0 +1,106 @@
+"""This module contains grid hashes over 2d locations and polylines that answer the occupancy and radius queries of
+the world, e.g. which spawn points have a vehicle within a tolerance, and the window queries of the BEV route map. The
+locations are bucketed into square cells once, a query only compares against the locations in the cells around it
+instead of against all locations."""
+from collections import defaultdict
+
+import numpy as np
+
+
+def to_xy(locations):
+    """
+    Returns the x and y coordinates of carla.Location objects as an array of shape (<number of locations>, 2).
+    """
+    return np.array([(location.x, location.y) for location in locations], dtype=np.float64).reshape(-1, 2)
+
+
+class GridIndex:
+    """
+    Grid hash over the 2d points of shape (<number of points>, 2) with square cells of cell_size meters.
+    """
+
+    def __init__(self, points, cell_size):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = cell_size
+
+        cells = defaultdict(list)
+        for i, cell in enumerate(map(tuple, self._cells_of(self.points).tolist())):
+            cells[cell].append(i)
+        self._cells = {cell: np.array(indices) for cell, indices in cells.items()}
+
+    def _cells_of(self, points):
+        return np.floor(points / self.cell_size).astype(np.int64)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _candidates(self, cell, reach):
+        indices = [
+            self._cells[(cell[0] + dx, cell[1] + dy)]
+            for dx in range(-reach, reach + 1)
+            for dy in range(-reach, reach + 1)
+            if (cell[0] + dx, cell[1] + dy) in self._cells
+        ]
+        return np.concatenate(indices) if indices else None
+
+    def any_within(self, queries, tolerance):
+        """
+        Returns a boolean array that is True for every query point with an indexed point within tolerance in x and in y
+        (|dx| <= tolerance and |dy| <= tolerance, like the checks of World it replaces).
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros(len(queries), dtype=bool)
+        if not len(self.points):
+            return result
+
+        reach = int(np.ceil(tolerance / self.cell_size))
+        for i, (query, cell) in enumerate(zip(queries, self._cells_of(queries).tolist())):
+            candidates = self._candidates(cell, reach)
+            if candidates is not None:
+                result[i] = (np.abs(self.points[candidates] - query) <= tolerance).all(axis=1).any()
+        return result
+
+
+class SegmentGridIndex:
+    """
+    Grid hash over the segments of a 2d polyline of shape (<number of points>, 2) with square cells of cell_size. Every
+    segment is bucketed into all cells its bounding box overlaps.
+    """
+
+    def __init__(self, polyline, cell_size):
+        self.polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = cell_size
+        self.segment_min = np.minimum(self.polyline[:-1], self.polyline[1:])
+        self.segment_max = np.maximum(self.polyline[:-1], self.polyline[1:])
+
+        cells = defaultdict(list)
+        first_cells = np.floor(self.segment_min / cell_size).astype(np.int64).tolist()
+        last_cells = np.floor(self.segment_max / cell_size).astype(np.int64).tolist()
+        for i, (first, last) in enumerate(zip(first_cells, last_cells)):
+            for cell_x in range(first[0], last[0] + 1):
+                for cell_y in range(first[1], last[1] + 1):
+                    cells[(cell_x, cell_y)].append(i)
+        self._cells = {cell: np.array(indices) for cell, indices in cells.items()}
+
+    def __len__(self):
+        return len(self.segment_min)
+
+    def segments_in_box(self, box_min, box_max):
+        """
+        Returns the sorted indices of the segments whose bounding box overlaps the box from box_min to box_max. Segment
+        i connects the points i and i + 1 of the polyline.
+        """
+        first = np.floor(np.asarray(box_min) / self.cell_size).astype(np.int64)
+        last = np.floor(np.asarray(box_max) / self.cell_size).astype(np.int64)
+        indices = [
+            self._cells[(cell_x, cell_y)]
+            for cell_x in range(first[0], last[0] + 1)
+            for cell_y in range(first[1], last[1] + 1)
+            if (cell_x, cell_y) in self._cells
+        ]
+        if not indices:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(indices))
+        overlaps = (self.segment_max[candidates] >= box_min).all(axis=1) & \
+                   (self.segment_min[candidates] <= box_max).all(axis=1)
+        return candidates[overlaps]
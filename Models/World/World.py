@@ -7,6 +7,7 @@ import logging
 import math
 import random
 import sys
+import time
 
 import carla
 import numpy as np
@@ -16,9 +17,8 @@ from Definitions import WeatherPresets
 from Models.World.misc import compute_distance
 
 sys.path.append("../")
-from Models.World.global_route_planner import (
-    GlobalRoutePlanner,
-)
+from Models.World.RoutePlannerCache import get_route_planner
+from Models.World.SpatialIndex import GridIndex, to_xy
 from Models.World.behavior_agent import (
     BehaviorAgent,
 )
@@ -28,6 +28,7 @@ from Models.World.behavior_agent import (
 # ======================================================================================================================
 TOLERANCE = 5
 LARGE_TOLERANCE = 15
+ROUTE_SAMPLING_RESOLUTION = 1
 
 
 class WorldState:
@@ -59,16 +60,32 @@ class WorldState:
 
         self.anomalous_behavior_started = False
 
+        self.ACTOR_TIMINGS = {}  # seconds spent on the batched spawn, autopilot and destroy commands of a scenario
+
         self.client = carla.Client(Definitions.HOST, Definitions.PORT)
         self.client.set_timeout(Definitions.TIMEOUT)
 
         self.traffic_manager = None
+        self.tm_port = Definitions.TRAFFIC_MANAGER_PORT
         self.world_offset = None
 
 
 WORLD_STATE = WorldState()
 
 
+def connect_world_state(self, host, port, tm_port):
+    """
+    Points the world state to another carla server and traffic manager port. The world state is changed in place,
+    because functions of this module use WORLD_STATE as default argument. Each process has its own WORLD_STATE, so
+    every process can be connected to its own server.
+    """
+    self.client = carla.Client(host, port)
+    self.client.set_timeout(Definitions.TIMEOUT)
+    self.tm_port = tm_port
+    self.WORLD = None
+    self.traffic_manager = None
+
+
 # endregion
 # ======================================================================================================================
 
@@ -80,10 +97,37 @@ def spawn_npcs_to_world(self, npc_vehicle_amount, npc_walker_amount):
     """
     Spawns NPC vehicles and walkers to the world.
     """
+    start = time.perf_counter()
     if npc_vehicle_amount > 0:
         spawn_npc_vehicle(self, npc_vehicle_amount)
     if npc_walker_amount > 0:
         spawn_npc_walker_to_world(self, npc_walker_amount)
+    self.ACTOR_TIMINGS = {"spawn": time.perf_counter() - start}
+
+
+def apply_batch(self, commands, description):
+    """
+    Applies the carla commands as one batch, which is a single round trip to the server instead of one per command.
+    Failed commands are logged. Returns the responses in the order of the commands.
+    """
+    if not commands:
+        return []
+    responses = self.client.apply_batch_sync(commands, False)
+    errors = [response.error for response in responses if response.has_error()]
+    if errors:
+        logging.debug(f"{description}: {len(errors)} of {len(commands)} commands failed, e.g. {errors[0]}")
+    return responses
+
+
+def spawn_actors_batch(self, commands, description):
+    """
+    Spawns the actors of the SpawnActor commands as one batch. Returns the spawned actors, None for every command
+    that failed.
+    """
+    responses = apply_batch(self, commands, description)
+    actor_ids = [response.actor_id for response in responses if not response.has_error()]
+    actors = {actor.id: actor for actor in self.WORLD.get_actors(actor_ids)} if actor_ids else {}
+    return [None if response.has_error() else actors.get(response.actor_id) for response in responses]
 
 
 # ======================================================================================================================
@@ -118,10 +162,8 @@ def spawn_npc_vehicle(self, number_of_vehicles):
             f"requested {number_of_vehicles} vehicles, but could only find {number_of_spawn_points} " f"spawn points")
 
     # Spawn vehicles at selected spawn points
-    for spawn_point in spawn_points:
-        vehicle_name = random.choice(vehicle_bp)
-
-        actor = self.WORLD.try_spawn_actor(vehicle_name, spawn_point)
+    commands = [carla.command.SpawnActor(random.choice(vehicle_bp), spawn_point) for spawn_point in spawn_points]
+    for actor in spawn_actors_batch(self, commands, "Spawning npc vehicles"):
         if actor:
             # Add the spawned actor to the global list
             self.NORMAL_VEHICLE_LIST[actor] = None
@@ -158,30 +200,41 @@ def get_not_occupied_spawn_points(self):
     return spawn_points
 
 
-def remove_occupied_spawn_points(self, spawn_points):
+def get_vehicle_locations(self):
     """
-    Removes occupied spawn points from a given list.
+    Returns the x and y coordinates of all vehicles. The locations are read from one snapshot of the world instead of
+    asking every vehicle for its location, only vehicles spawned after the last tick are asked directly.
     """
-    global TOLERANCE
-    not_occupied_spawn_points = []
     vehicles = self.WORLD.get_actors().filter("*vehicle*")
+    snapshot = self.WORLD.get_snapshot()
+    locations = []
+    for vehicle in vehicles:
+        actor_snapshot = snapshot.find(vehicle.id)
+        if actor_snapshot is not None:
+            locations.append(actor_snapshot.get_transform().location)
+        else:
+            locations.append(vehicle.get_location())
+    return to_xy(locations)
 
-    for spawn_point in spawn_points:
-        occupied = False
 
-        for vehicle in vehicles:
-            vehicle_location = vehicle.get_location()
-            if (
-                    abs(vehicle_location.x - spawn_point.location.x) <= TOLERANCE
-                    and abs(vehicle_location.y - spawn_point.location.y) <= TOLERANCE
-            ):
-                occupied = True
-                break
+def remove_spawn_points_near(spawn_points, locations, tolerance):
+    """
+    Removes the spawn points that have one of the locations (array of x and y) within tolerance in x and y.
+    """
+    if not spawn_points:
+        return []
+    occupied = GridIndex(locations, tolerance).any_within(
+        to_xy(spawn_point.location for spawn_point in spawn_points),
+        tolerance,
+    )
+    return [spawn_point for spawn_point, is_occupied in zip(spawn_points, occupied) if not is_occupied]
 
-        if not occupied:
-            not_occupied_spawn_points.append(spawn_point)
 
-    return not_occupied_spawn_points
+def remove_occupied_spawn_points(self, spawn_points):
+    """
+    Removes occupied spawn points from a given list.
+    """
+    return remove_spawn_points_near(spawn_points, get_vehicle_locations(self), TOLERANCE)
 
 
 def remove_vehicles_on_the_road_of_ego_vehicle_to_anomaly(
@@ -190,23 +243,9 @@ def remove_vehicles_on_the_road_of_ego_vehicle_to_anomaly(
     """
     This method removes vehicles on the road of the ego vehicle to the anomaly.
     """
-    global TOLERANCE
     route_ego_to_anomaly = get_route_from_ego_to_anomaly(WORLD_STATE)
-
-    not_occupied_spawn_points = []
-
-    for spawn_point in spawn_points:
-        occupied = False
-        for ego_vehicle_waypoint in route_ego_to_anomaly:
-            ego_location = ego_vehicle_waypoint[0].transform.location
-            if abs(ego_location.x - spawn_point.location.x) <= TOLERANCE and abs(
-                    ego_location.y - spawn_point.location.y) <= TOLERANCE:
-                occupied = True
-                break
-        if not occupied:
-            not_occupied_spawn_points.append(spawn_point)
-
-    return not_occupied_spawn_points
+    route_locations = to_xy(waypoint[0].transform.location for waypoint in route_ego_to_anomaly)
+    return remove_spawn_points_near(spawn_points, route_locations, TOLERANCE)
 
 
 def remove_spawn_points_in_radius_of_ego_vehicle(
@@ -215,24 +254,8 @@ def remove_spawn_points_in_radius_of_ego_vehicle(
     """
     Remove spawn points within a certain radius of the ego vehicle.
     """
-    global LARGE_TOLERANCE
-
-    ego_location = get_ego_vehicle().get_location()
-
-    not_occupied_spawn_points = []
-
-    for spawn_point in spawn_points:
-        spawn_location = spawn_point.location
-
-        x_difference = abs(ego_location.x - spawn_location.x)
-        y_difference = abs(ego_location.y - spawn_location.y)
-
-        if x_difference <= LARGE_TOLERANCE and y_difference <= LARGE_TOLERANCE:
-            continue
-        else:
-            not_occupied_spawn_points.append(spawn_point)
-
-    return not_occupied_spawn_points
+    ego_location = to_xy([get_ego_vehicle().get_location()])
+    return remove_spawn_points_near(spawn_points, ego_location, LARGE_TOLERANCE)
 
 
 def get_route_from_ego_to_anomaly(self):
@@ -241,33 +264,29 @@ def get_route_from_ego_to_anomaly(self):
     waypoint. It takes no parameters and returns a list representing the route *.
     """
     ego_vehicle_waypoints = self.EGO_VEHICLE_ROUTE
-    anomaly_waypoint = self.ANOMALY_WAYPOINT
-    route_ego_to_anomaly = []
+    anomaly_location = to_xy([self.ANOMALY_WAYPOINT[0].transform.location])
 
-    index = None
+    route_locations = to_xy(waypoint[0].transform.location for waypoint in ego_vehicle_waypoints)
+    near_anomaly = np.flatnonzero((np.abs(route_locations - anomaly_location) <= TOLERANCE).all(axis=1))
 
-    for i, ego_vehicle_waypoint in enumerate(ego_vehicle_waypoints):
-        ego_location = ego_vehicle_waypoint[0].transform.location
-        if (
-                abs(ego_location.x - anomaly_waypoint[0].transform.location.x) <= TOLERANCE
-                and abs(ego_location.y - anomaly_waypoint[0].transform.location.y) <= TOLERANCE
-        ):
-            index = i  # Store the index of the current waypoint
-
-    if index is not None:
-        route_ego_to_anomaly = ego_vehicle_waypoints[: index + 1]
-
-    return route_ego_to_anomaly
+    # the route ends at the last waypoint near the anomaly
+    if len(near_anomaly):
+        return ego_vehicle_waypoints[: near_anomaly[-1] + 1]
+    return []
 
 
 def set_normal_vehicles_on_autopilot(self, tm_port):
     """
     Sets normal vehicles on autopilot.
     """
+    start = time.perf_counter()
     try:
-        for vehicle in self.NORMAL_VEHICLE_LIST.keys():
-            if vehicle:
-                vehicle.set_autopilot(True, tm_port)
+        commands = [
+            carla.command.SetAutopilot(vehicle.id, True, tm_port)
+            for vehicle in self.NORMAL_VEHICLE_LIST.keys() if vehicle
+        ]
+        apply_batch(self, commands, "Setting npc vehicles on autopilot")
+        self.ACTOR_TIMINGS["autopilot"] = time.perf_counter() - start
 
     except Exception as e:
         error_message = "Could not set on autopilot"
@@ -301,6 +320,7 @@ def spawn_npc_walker_to_world(self, npc_walker_amount):
             spawn_points.append(spawn_point)
 
     # 2. we spawn the walker object
+    commands = []
     for spawn_point in spawn_points:
         walker_bp = random.choice(walker_bp_library)
 
@@ -308,8 +328,9 @@ def spawn_npc_walker_to_world(self, npc_walker_amount):
         if walker_bp.has_attribute("is_invincible"):
             walker_bp.set_attribute("is_invincible", "false")
 
-        actor = self.WORLD.try_spawn_actor(walker_bp, spawn_point)
+        commands.append(carla.command.SpawnActor(walker_bp, spawn_point))
 
+    for actor in spawn_actors_batch(self, commands, "Spawning npc walkers"):
         if actor:
             self.NORMAL_WALKER_LIST.append(actor)
             logging.debug(f"spawned npc_walker: {actor} ")
@@ -318,13 +339,11 @@ def spawn_npc_walker_to_world(self, npc_walker_amount):
 
     # 3. we spawn the walker controller
     walker_controller_bp = self.WORLD.get_blueprint_library().find("controller.ai.walker")
-    for i in range(len(self.NORMAL_WALKER_LIST)):
-        controller = self.WORLD.spawn_actor(
-            walker_controller_bp,
-            carla.Transform(),
-            self.NORMAL_WALKER_LIST[i],
-        )
-
+    commands = [
+        carla.command.SpawnActor(walker_controller_bp, carla.Transform(), walker.id)
+        for walker in self.NORMAL_WALKER_LIST
+    ]
+    for controller in spawn_actors_batch(self, commands, "Spawning walker controllers"):
         if controller:
             self.CONTROLLER_LIST.append(controller)
             logging.debug(f"spawned controller: {controller}")
@@ -444,7 +463,7 @@ def activate_traffic_manager(self=WORLD_STATE):
     Activate Traffic Manager. This method activates the traffic manager and sets various parameters for controlling
     the behavior of the simulated traffic.
     """
-    self.traffic_manager = self.client.get_trafficmanager(8000)
+    self.traffic_manager = self.client.get_trafficmanager(self.tm_port)
     self.traffic_manager.set_global_distance_to_leading_vehicle(2.5)
     self.traffic_manager.set_hybrid_physics_mode(True)
     self.traffic_manager.set_hybrid_physics_radius(200)
@@ -574,11 +593,11 @@ def destroy_everything(self=WORLD_STATE):
     Destroy everything in the world. This method destroys all actors and clears the lists in the current world state.
     """
     logging.info("Trying to destroy everything ...")
+    start = time.perf_counter()
 
     # Collect all actor IDs to be destroyed
     actor_ids = (
-            get_object_ids(self.SENSORS)
-            + [self.EGO_VEHICLE.id]
+            [self.EGO_VEHICLE.id]
             + get_object_ids(self.ANOMALY_OBJECTS)
             + list(get_object_ids(self.NORMAL_VEHICLE_LIST.keys()))
             + get_object_ids(self.NORMAL_WALKER_LIST)
@@ -590,10 +609,14 @@ def destroy_everything(self=WORLD_STATE):
         if controller.is_alive:
             controller.stop()
 
-    # Destroy each actor if it is alive
-    for actor in self.WORLD.get_actors(actor_ids=actor_ids):
-        if actor.is_alive:
-            actor.destroy()
+    # Sensors are destroyed one by one, destroying them on the client also closes their data streams
+    for sensor in self.WORLD.get_actors(actor_ids=get_object_ids(self.SENSORS)):
+        if sensor.is_alive:
+            sensor.destroy()
+
+    # Destroy all other actors that are alive in one batch
+    alive_ids = [actor.id for actor in self.WORLD.get_actors(actor_ids=actor_ids) if actor.is_alive]
+    apply_batch(self, [carla.command.DestroyActor(actor_id) for actor_id in alive_ids], "Destroying actors")
 
     # Clear the lists
     self.SENSORS.clear()
@@ -614,7 +637,8 @@ def destroy_everything(self=WORLD_STATE):
 
     self.ANOMALY_WAYPOINT = None
 
-    logging.info("Destroyed everything")
+    self.ACTOR_TIMINGS["teardown"] = time.perf_counter() - start
+    logging.info(f"Destroyed everything in {self.ACTOR_TIMINGS['teardown']:.2f}s")
 
 
 # endregion
@@ -807,10 +831,7 @@ def create_shortest_path(self, start_transform, end_transform):
     """
     Create shortest path between two given transforms.
     """
-    amap = self.WORLD.get_map()
-    sampling_resolution = 1
-
-    grp = GlobalRoutePlanner(amap, sampling_resolution)
+    grp = get_route_planner(self.WORLD.get_map(), ROUTE_SAMPLING_RESOLUTION)
 
     ego_vehicle_start_location = carla.Location(start_transform.location)
     ego_vehicle_end_location = carla.Location(end_transform.location)
@@ -827,10 +848,7 @@ def create_shortest_path_anomaly(self, start_transform, end_transform):
     """
     Create shortest path between two given transforms.
     """
-    amap = self.WORLD.get_map()
-    sampling_resolution = 1
-
-    grp = GlobalRoutePlanner(amap, sampling_resolution)
+    grp = get_route_planner(self.WORLD.get_map(), ROUTE_SAMPLING_RESOLUTION)
 
     anomaly_vehicle_start_location = carla.Location(start_transform.location)
     anomaly_vehicle_end_location = carla.Location(end_transform.location)
@@ -847,10 +865,7 @@ def create_shortest_path_data(self, start_transform, end_transform):
     """
     Create the shortest path data between start and end transforms.
     """
-    amap = self.WORLD.get_map()
-    sampling_resolution = 1
-
-    grp = GlobalRoutePlanner(amap, sampling_resolution)
+    grp = get_route_planner(self.WORLD.get_map(), ROUTE_SAMPLING_RESOLUTION)
 
     ego_vehicle_start_location = carla.Location(start_transform.location)
     ego_vehicle_end_location = carla.Location(end_transform.location)
@@ -958,9 +973,7 @@ def create_shortest_path_normal_vehicle(self, start_transform, end_transform):
     """
     Create shortest path for a normal vehicle.
     """
-    amap = self.WORLD.get_map()
-    sampling_resolution = 1
-    grp = GlobalRoutePlanner(amap, sampling_resolution)
+    grp = get_route_planner(self.WORLD.get_map(), ROUTE_SAMPLING_RESOLUTION)
     normal_vehicle_start_location = carla.Location(start_transform.location)
     normal_vehicle_end_location = carla.Location(end_transform.location)
     normal_vehicle_route = grp.trace_route(
@@ -20,6 +20,7 @@ from Models.World.local_planner import (
     LocalPlanner,
     RoadOption,
 )
+from Models.World.RoutePlannerCache import get_route_planner
 from Models.World.misc import (
     get_speed,
     is_within_distance,
@@ -119,7 +120,7 @@ class BasicAgent(object):
                     self._sampling_resolution,
                 )
         else:
-            self._global_planner = GlobalRoutePlanner(
+            self._global_planner = get_route_planner(
                 self._map,
                 self._sampling_resolution,
             )
@@ -40,11 +40,36 @@ class GlobalRoutePlanner(object):
         self._find_loose_ends()
         self._lane_change_link()
 
+    @classmethod
+    def from_graph(cls, wmap, sampling_resolution, graph, id_map, road_id_to_edge):
+        """
+        Creates a planner from a graph that was built before (see Models/World/RoutePlannerCache.py) without
+        retrieving the topology from the server again
+        """
+        planner = cls.__new__(cls)
+        planner._sampling_resolution = sampling_resolution
+        planner._wmap = wmap
+        planner._topology = None
+        planner._graph = graph
+        planner._id_map = id_map
+        planner._road_id_to_edge = road_id_to_edge
+        planner.reset()
+        return planner
+
+    def reset(self):
+        """
+        Resets the turn decision state, so a planner that is shared by several routes traces every route like a newly
+        built one
+        """
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+
     def trace_route(self, origin, destination):
         """
         This method returns list of (carla.Waypoint, RoadOption)
         from origin to destination
         """
+        self.reset()
         route_trace = []
         route = self._path_search(origin, destination)
         current_waypoint = self._wmap.get_waypoint(origin)
@@ -0,0 +1,130 @@
+"""Tests of the serialization of the route planner graph with a small hand-built graph and an in-memory map."""
+import types
+
+import numpy as np
+import pytest
+
+carla = pytest.importorskip("carla")
+nx = pytest.importorskip("networkx")
+
+from Models.World import RoutePlannerCache  # noqa: E402
+from Models.World.global_route_planner import GlobalRoutePlanner  # noqa: E402
+from Models.World.local_planner import RoadOption  # noqa: E402
+
+
+class Waypoint:
+    """The attributes of carla.Waypoint the route planner graph uses."""
+
+    def __init__(self, waypoint_id, road_id, lane_id, s, location):
+        self.id = waypoint_id
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.s = s
+        self.transform = types.SimpleNamespace(location=carla.Location(*location))
+
+
+class Map:
+    """Looks up the waypoints of the graph by their OpenDRIVE key, like carla.Map of a running server."""
+
+    def __init__(self, waypoints, name="Carla/Maps/Town10HD_Opt", opendrive="<OpenDRIVE/>"):
+        self.waypoints = waypoints
+        self.name = name
+        self.opendrive = opendrive
+        self.projected = []
+
+    def to_opendrive(self):
+        return self.opendrive
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        for waypoint in self.waypoints:
+            if (waypoint.road_id, waypoint.lane_id, waypoint.s) == (road_id, lane_id, s):
+                return waypoint
+        return None
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=None):
+        self.projected.append(location)
+        return min(self.waypoints, key=lambda waypoint: waypoint.transform.location.distance(location))
+
+
+def build_planner(waypoints):
+    """A road segment, a loose end and a lane change link, the three kinds of edges of the graph."""
+    graph = nx.DiGraph()
+    graph.add_node(0, vertex=(1.0, 2.0, 0.0))
+    graph.add_node(1, vertex=(3.0, 4.0, 0.0))
+    graph.add_node(-1, vertex=(5.5, 6.1, 0.2))
+    graph.add_edge(0, 1, length=3, path=[waypoints[1], waypoints[2]], entry_waypoint=waypoints[0],
+                   exit_waypoint=waypoints[3], entry_vector=np.array([1.0, 0.0, 0.0]),
+                   exit_vector=np.array([0.0, 1.0, 0.0]), net_vector=[0.5, 0.5, 0.0], intersection=True,
+                   type=RoadOption.LANEFOLLOW)
+    graph.add_edge(1, -1, length=2, path=[waypoints[4]], entry_waypoint=waypoints[3], exit_waypoint=waypoints[4],
+                   entry_vector=None, exit_vector=None, net_vector=None, intersection=False,
+                   type=RoadOption.LANEFOLLOW)
+    graph.add_edge(0, -1, length=0, path=[], entry_waypoint=waypoints[5], exit_waypoint=waypoints[6],
+                   exit_vector=None, intersection=False, type=RoadOption.CHANGELANELEFT,
+                   change_waypoint=waypoints[6])
+    id_map = {(1.0, 2.0, 0.0): 0, (3.0, 4.0, 0.0): 1}
+    road_id_to_edge = {7: {0: {-1: (0, 1)}}, 8: {0: {1: (1, -1)}}}
+    return GlobalRoutePlanner.from_graph(Map(waypoints), 2.0, graph, id_map, road_id_to_edge)
+
+
+def comparable(value):
+    if isinstance(value, np.ndarray):
+        return "array", value.tolist()
+    if isinstance(value, list):
+        return [comparable(item) for item in value]
+    if isinstance(value, Waypoint):
+        return "waypoint", value.id
+    return value
+
+
+@pytest.fixture
+def waypoints():
+    return [Waypoint(i, i % 3, -1, i * 1.5, (i, 2 * i, 0.5)) for i in range(7)]
+
+
+def test_round_trip(tmp_path, waypoints):
+    planner = build_planner(waypoints)
+    path = str(tmp_path / "planner.npz")
+    RoutePlannerCache.save_route_planner(planner, path)
+
+    wmap = Map(waypoints)
+    loaded = RoutePlannerCache.load_route_planner(wmap, path)
+    assert not wmap.projected
+    assert loaded._sampling_resolution == 2.0
+    assert dict(loaded._graph.nodes(data="vertex")) == dict(planner._graph.nodes(data="vertex"))
+    assert loaded._id_map == planner._id_map
+    assert loaded._road_id_to_edge == planner._road_id_to_edge
+    assert set(loaded._graph.edges) == set(planner._graph.edges)
+    for n1, n2, edge in planner._graph.edges(data=True):
+        loaded_edge = loaded._graph.edges[n1, n2]
+        assert set(loaded_edge) == set(edge)
+        for key, value in edge.items():
+            assert comparable(loaded_edge[key]) == comparable(value), key
+
+
+def test_moved_waypoints_are_projected(tmp_path, waypoints):
+    path = str(tmp_path / "planner.npz")
+    RoutePlannerCache.save_route_planner(build_planner(waypoints), path)
+
+    # the OpenDRIVE key of waypoint 2 now leads somewhere else, waypoint 20 is at its stored location
+    moved = list(waypoints)
+    moved[2] = Waypoint(2, 2, -1, 3.0, (100.0, 100.0, 0.0))
+    wmap = Map(moved + [Waypoint(20, 9, 9, 0.0, (2.0, 4.0, 0.5))])
+    loaded = RoutePlannerCache.load_route_planner(wmap, path)
+    assert len(wmap.projected) == 1
+    assert [waypoint.id for waypoint in loaded._graph.edges[0, 1]["path"]] == [1, 20]
+
+
+def test_unsupported_version(tmp_path, waypoints, monkeypatch):
+    path = str(tmp_path / "planner.npz")
+    RoutePlannerCache.save_route_planner(build_planner(waypoints), path)
+    monkeypatch.setattr(RoutePlannerCache, "CACHE_VERSION", RoutePlannerCache.CACHE_VERSION + 1)
+    with pytest.raises(ValueError):
+        RoutePlannerCache.load_route_planner(Map(waypoints), path)
+
+
+def test_cache_file_path_depends_on_the_map(waypoints):
+    path = RoutePlannerCache.get_cache_file_path(Map(waypoints), 2.0)
+    assert path.endswith(".npz") and "Town10HD_Opt_2m_" in path
+    assert RoutePlannerCache.get_cache_file_path(Map(waypoints, opendrive="<OpenDRIVE>changed"), 2.0) != path
+    assert RoutePlannerCache.get_cache_file_path(Map(waypoints), 1.0) != path
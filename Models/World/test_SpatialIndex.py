@@ -0,0 +1,43 @@
+"""Tests of the grid hashes against comparing every query with every location or segment."""
+import numpy as np
+import pytest
+
+from Models.World.SpatialIndex import GridIndex, SegmentGridIndex
+
+
+@pytest.mark.parametrize("cell_size", [0.5, 2.0, 10.0])
+@pytest.mark.parametrize("tolerance", [0.0, 0.3, 1.0, 4.5])
+def test_any_within_matches_brute_force(cell_size, tolerance):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-50, 50, size=(300, 2))
+    queries = np.concatenate([rng.uniform(-60, 60, size=(500, 2)), points[:20], points[20:40] + tolerance])
+
+    expected = (np.abs(queries[:, None, :] - points[None, :, :]) <= tolerance).all(axis=2).any(axis=1)
+    np.testing.assert_array_equal(GridIndex(points, cell_size).any_within(queries, tolerance), expected)
+
+
+def test_empty_grid_index():
+    index = GridIndex(np.zeros((0, 2)), 1.0)
+    assert len(index) == 0
+    assert not index.any_within([(0.0, 0.0)], 100.0).any()
+
+
+@pytest.mark.parametrize("cell_size", [1.0, 5.0, 50.0])
+def test_segments_in_box_match_brute_force(cell_size):
+    rng = np.random.default_rng(1)
+    polyline = np.cumsum(rng.normal(scale=3.0, size=(400, 2)), axis=0)
+    index = SegmentGridIndex(polyline, cell_size)
+    assert len(index) == len(polyline) - 1
+
+    segment_min = np.minimum(polyline[:-1], polyline[1:])
+    segment_max = np.maximum(polyline[:-1], polyline[1:])
+    for _ in range(100):
+        box_min = rng.uniform(polyline.min(axis=0) - 10, polyline.max(axis=0))
+        box_max = box_min + rng.uniform(0, 30, size=2)
+        expected = np.flatnonzero((segment_max >= box_min).all(axis=1) & (segment_min <= box_max).all(axis=1))
+        np.testing.assert_array_equal(index.segments_in_box(box_min, box_max), expected)
+
+
+def test_segments_in_empty_box():
+    index = SegmentGridIndex([(0.0, 0.0), (1.0, 1.0)], 1.0)
+    assert index.segments_in_box((100.0, 100.0), (101.0, 101.0)).size == 0
@@ -0,0 +1,188 @@
+"""This module keeps an index of route candidates per map for the generation of scenario configurations. Finding a valid
+ego route used to be rejection sampling: random pairs of spawn points were planned until one passed the checks of
+Util.get_valid_route, which takes minutes per scenario on maps with few valid pairs. The index plans the routes between
+all pairs of spawn points once (or a random sample of them on large maps) and stores route length, lane changes and the
+road id check of every pair on disk. Valid routes are then drawn from the index in constant time, only the drawn route
+is planned again to get its waypoints. The checks are applied when the index is loaded, so changing
+Definitions.DISTANCE_INTERVAL does not require a new index. The sample of a large map is drawn from the random state of
+the run and extended by further pairs every time the index is loaded, so the routes are not limited to the first
+sample."""
+import hashlib
+import logging
+import os
+import random
+import time
+
+import carla
+import networkx as nx
+import numpy as np
+
+import Definitions
+import FileStructureManager
+from Models.World import World
+from Models.World.RoutePlannerCache import get_map_hash
+from Scenarios import Util
+
+INDEX_VERSION = 1
+
+_CANDIDATE_DTYPE = np.dtype([
+    ("start", "<i4"),
+    ("end", "<i4"),
+    ("route_length", "<i4"),
+    ("lane_changes", "<i4"),
+    ("same_road", "?"),
+])
+
+_INDICES = dict()  # (map name, cache file name) -> RouteCandidateIndex
+
+
+# ======================================================================================================================
+# region -- ROUTE CANDIDATE INDEX --------------------------------------------------------------------------------------
+# ======================================================================================================================
+class RouteCandidateIndex:
+    """
+    Route candidates between the spawn points of a map. candidates is a structured array with the indices of the start
+    and end spawn point (in the order of carla.Map.get_spawn_points), the route length in waypoints, the number of
+    lane changes at the start of the route and if the route starts on the road of the start spawn point. A pair
+    without a route has length 0.
+    """
+
+    def __init__(self, spawn_points, candidates):
+        self.spawn_points = spawn_points
+        self._set_candidates(candidates)
+
+    def _set_candidates(self, candidates):
+        self.candidates = candidates
+        self.valid_candidates = candidates[Util.is_valid_route(
+            candidates["lane_changes"],
+            candidates["route_length"],
+            candidates["same_road"],
+        )]
+
+    @classmethod
+    def build(cls, wmap, spawn_points, max_pairs=Definitions.ROUTE_CANDIDATE_MAX_PAIRS):
+        """
+        Plans the routes between all ordered pairs of different spawn points of wmap, or between max_pairs pairs sampled
+        with the random state of the run if there are more.
+        """
+        index = cls(spawn_points, np.zeros(0, dtype=_CANDIDATE_DTYPE))
+        index.extend(wmap, max_pairs)
+        return index
+
+    def extend(self, wmap, max_pairs=Definitions.ROUTE_CANDIDATE_EXTEND_PAIRS):
+        """
+        Plans the routes between up to max_pairs randomly sampled pairs of spawn points that are not in the index yet.
+        Returns the number of planned pairs, 0 if the index already contains all pairs.
+        """
+        planned = set(zip(self.candidates["start"].tolist(), self.candidates["end"].tolist()))
+        pairs = [
+            (start, end) for start in range(len(self.spawn_points)) for end in range(len(self.spawn_points))
+            if start != end and (start, end) not in planned
+        ]
+        if len(pairs) > max_pairs:
+            pairs = random.sample(pairs, max_pairs)
+        if not pairs:
+            return 0
+
+        candidates = np.zeros(len(pairs), dtype=_CANDIDATE_DTYPE)
+        start_time = time.perf_counter()
+        for i, (start, end) in enumerate(pairs):
+            candidates[i]["start"], candidates[i]["end"] = start, end
+            try:
+                route = World.create_shortest_path_data(
+                    World.WORLD_STATE, self.spawn_points[start], self.spawn_points[end]
+                )
+            except (nx.NetworkXException, TypeError):  # no route or spawn point is not on a road of the planner
+                continue
+            if not route:
+                continue
+            start_waypoint = wmap.get_waypoint(carla.Location(self.spawn_points[start].location))
+            candidates[i]["route_length"] = len(route)
+            candidates[i]["lane_changes"] = Util.count_different_lanes(route, start_waypoint)
+            candidates[i]["same_road"] = start_waypoint.road_id == route[0][0].road_id
+            if (i + 1) % 500 == 0:
+                logging.info(f"Route candidate index: planned {i + 1}/{len(pairs)} routes")
+
+        logging.info(f"Planned {len(pairs)} route candidates in {time.perf_counter() - start_time:.1f}s")
+        self._set_candidates(np.concatenate([self.candidates, candidates]))
+        return len(pairs)
+
+    def __len__(self):
+        return len(self.valid_candidates)
+
+    def draw(self):
+        """
+        Returns the start and end spawn point and the route of a random valid candidate.
+        """
+        if not len(self.valid_candidates):
+            raise ValueError("The route candidate index contains no valid route")
+        candidate = self.valid_candidates[random.randrange(len(self.valid_candidates))]
+        start_spawnpoint = self.spawn_points[candidate["start"]]
+        end_spawnpoint = self.spawn_points[candidate["end"]]
+        route = World.create_shortest_path_data(World.WORLD_STATE, start_spawnpoint, end_spawnpoint)
+        return start_spawnpoint, end_spawnpoint, route
+
+    def save(self, file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(f, version=np.array(INDEX_VERSION), candidates=self.candidates)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, spawn_points, file_path):
+        with np.load(file_path) as arrays:
+            if int(arrays["version"]) != INDEX_VERSION:
+                raise ValueError(f"Route candidate index {file_path} has version {int(arrays['version'])}")
+            return cls(spawn_points, arrays["candidates"])
+
+
+def get_index_file_path(wmap, spawn_points):
+    """
+    Returns the file of the index of wmap. It is named by the map, a hash of the OpenDRIVE map and a hash of the spawn
+    points, the index of a changed map is built again.
+    """
+    spawn_point_hash = hashlib.sha1(np.array([
+        (spawn_point.location.x, spawn_point.location.y, spawn_point.location.z, spawn_point.rotation.yaw)
+        for spawn_point in spawn_points
+    ]).round(2).tobytes()).hexdigest()[:16]
+    file_name = f"{os.path.basename(wmap.name)}_{get_map_hash(wmap)}_{spawn_point_hash}_v{INDEX_VERSION}.npz"
+    return os.path.join(FileStructureManager.ROUTE_CANDIDATE_CACHE_DIR, file_name)
+
+
+def get_route_candidate_index(wmap=None):
+    """
+    Returns the route candidate index of wmap (default the map of the current world), loaded from disk or built and
+    stored the first time a map is used.
+    """
+    wmap = wmap or World.get_map()
+    spawn_points = wmap.get_spawn_points()
+    file_path = get_index_file_path(wmap, spawn_points)
+    key = (wmap.name, file_path)
+    if key in _INDICES:
+        return _INDICES[key]
+
+    index = None
+    if os.path.isfile(file_path):
+        try:
+            index = RouteCandidateIndex.load(spawn_points, file_path)
+            logging.info(f"Loaded route candidate index {file_path}: {len(index)} valid routes")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Route candidate index {file_path} is unusable, building it again: {e}")
+    if index is None:
+        index = RouteCandidateIndex.build(wmap, spawn_points)
+        logging.info(f"Built route candidate index of {wmap.name}: {len(index)} valid routes")
+        changed = True
+    else:
+        # the index of a large map covers a sample of the pairs, every run adds further pairs until all are planned
+        changed = index.extend(wmap) > 0
+    if changed:
+        try:
+            index.save(file_path)
+        except OSError as e:
+            logging.warning(f"Could not write route candidate index {file_path}: {e}")
+    _INDICES[key] = index
+    return index
+
+# endregion
+# ======================================================================================================================
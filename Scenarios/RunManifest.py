@@ -0,0 +1,126 @@
+"""This module keeps the run manifest of a scenario generation run. The manifest is an append-only JSONL file in the
+output folder of the run, with one line per state change of a scenario (started, completed or failed). The last line of
+a scenario is its current state, so a crashed run leaves its unfinished scenarios in the started state. A run can be
+resumed from the manifest: completed scenarios are skipped, the output folders of all other scenarios are removed and
+the scenarios are run again."""
+import json
+import logging
+import os
+import shutil
+import time
+from glob import glob
+
+import Definitions
+import FileStructureManager
+
+STARTED = "started"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+# ======================================================================================================================
+# region -- RUN MANIFEST -----------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class RunManifest:
+    """
+    Run manifest of the output folder output_path. Every state change is appended and synced to disk immediately,
+    so the manifest survives crashes of the simulator and of this process.
+    """
+
+    def __init__(self, output_path=None):
+        self.output_path = output_path or FileStructureManager.THIS_OUTPUT_PATH
+        self.file_path = os.path.join(self.output_path, Definitions.RUN_MANIFEST_FILE_NAME)
+        self.scenarios = self.load()
+
+    def load(self):
+        """
+        Returns the last record of every scenario in the manifest. A line that was cut off by a crash is skipped.
+        """
+        scenarios = dict()
+        if not os.path.isfile(self.file_path):
+            return scenarios
+        with open(self.file_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping incomplete line in run manifest {self.file_path}")
+                    continue
+                scenarios[record["scenario_id"]] = record
+        return scenarios
+
+    def record(self, scenario_id, state, **fields):
+        record = {"scenario_id": scenario_id, "state": state, "time": time.time(), **fields}
+        os.makedirs(self.output_path, exist_ok=True)
+        with open(self.file_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.scenarios[scenario_id] = record
+
+    def started(self, scenario_id, map_name=None, attempt=None):
+        self.record(scenario_id, STARTED, map=map_name, attempt=attempt)
+
+    def completed(self, scenario_id, frames):
+        self.record(scenario_id, COMPLETED, frames=frames)
+
+    def failed(self, scenario_id, error=None):
+        self.record(scenario_id, FAILED, error=error)
+
+    def state(self, scenario_id):
+        record = self.scenarios.get(scenario_id)
+        return record["state"] if record else None
+
+    def is_completed(self, scenario_id):
+        return self.state(scenario_id) == COMPLETED
+
+    def completed_ids(self):
+        return {scenario_id for scenario_id, record in self.scenarios.items() if record["state"] == COMPLETED}
+
+    def clean_partial_scenarios(self):
+        """
+        Removes the output folders of all scenarios that are not completed, i.e. that failed or were interrupted.
+        Returns the ids of the removed scenarios.
+        """
+        removed = []
+        for scenario_path in glob(os.path.join(self.output_path, "Scenario_*")):
+            if not os.path.isdir(scenario_path) or scenario_path.endswith("Scenario_Configuration_Files"):
+                continue
+            scenario_id = os.path.basename(scenario_path)[len("Scenario_"):]
+            if not self.is_completed(scenario_id):
+                shutil.rmtree(scenario_path)
+                removed.append(scenario_id)
+        if removed:
+            logging.info(f"Removed {len(removed)} partial scenarios: {removed}")
+        return removed
+
+    def summary(self):
+        states = [record["state"] for record in self.scenarios.values()]
+        return {state: states.count(state) for state in (STARTED, COMPLETED, FAILED)}
+
+
+def find_latest_output_path():
+    """
+    Returns the output folder of the latest run.
+    """
+    output_paths = sorted(glob(os.path.join(FileStructureManager.ROOT_OUTPUTS_DIR, "Final_Output_*")))
+    if not output_paths:
+        raise FileNotFoundError(f"No run to resume in {FileStructureManager.ROOT_OUTPUTS_DIR}")
+    return output_paths[-1]
+
+
+def prepare_resume(output_path=None):
+    """
+    Prepares resuming the run in output_path (default the latest run): the output of the run is written to output_path
+    again. Returns the run manifest and the scenario configuration files of the run. The partial scenarios are not
+    removed here, call clean_partial_scenarios of the manifest right before the scenarios are run again.
+    """
+    output_path = output_path or find_latest_output_path()
+    FileStructureManager.THIS_OUTPUT_PATH = output_path
+    manifest = RunManifest(output_path)
+    file_paths = sorted(glob(os.path.join(FileStructureManager.get_scenario_config_output_dir(), "*.json")))
+    logging.info(f"Resuming run {output_path}: {manifest.summary()}")
+    return manifest, file_paths
+
+# endregion
+# ======================================================================================================================
@@ -16,6 +16,7 @@ from FileStructureManager import (
 )
 from Models.World import World
 from Scenarios import Util
+from Scenarios.RouteCandidateIndex import get_route_candidate_index
 
 
 # ======================================================================================================================
@@ -87,6 +88,9 @@ def generate_scenario_definition(amount, map_name, selected_anomaly_types):
     # Get configuration data for the map
     town_config = TOWN_CONFIGS[map_name]
 
+    # Valid ego routes are drawn from the route candidate index of the map instead of trying random spawn points
+    route_candidates = get_route_candidate_index() if Definitions.ROUTE_CANDIDATE_INDEX else None
+
     for i in range(amount):
         # Selecting a random anomaly type
         anomaly_type = random.choice(selected_anomaly_types)
@@ -98,7 +102,10 @@ def generate_scenario_definition(amount, map_name, selected_anomaly_types):
         # Generating random spawn points for ego vehicle
         list_of_spawnpoints = World.get_world().get_map().get_spawn_points()
 
-        ego_start_spawnpoint, ego_end_spawnpoint, ego_vehicle_route = Util.get_valid_route(list_of_spawnpoints)
+        ego_start_spawnpoint, ego_end_spawnpoint, ego_vehicle_route = Util.get_valid_route(
+            list_of_spawnpoints,
+            route_candidates,
+        )
 
         # Generate scenario template based on anomaly config, spawn points, and route
         scenario_template = generate_scenario_template(
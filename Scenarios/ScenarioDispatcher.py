@@ -0,0 +1,251 @@
+"""This module runs the scenarios of the scenario configuration files on several carla servers at the same time. Every
+server is driven by its own worker process with its own WorldState. The scenarios are handed out one by one, failed
+scenarios are retried on any server, and the output of every successful scenario is merged into one dataset tree.
+The output of a scenario is written into a staging folder first, so failed attempts never leave partial scenarios in
+the dataset. The worker processes and the scenario runners are in Scenarios/ScenarioWorker.py, FakeScenarioRunner is a
+stand-in for a carla server that can be used to test the dispatching without a simulator."""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import time
+from collections import deque, namedtuple
+
+from colorama import Fore, Style
+
+import Definitions
+import FileStructureManager
+from Scenarios.RunManifest import RunManifest
+from Scenarios.ScenarioWorker import CarlaScenarioRunner, get_staging_path, run_worker
+
+ServerEndpoint = namedtuple("ServerEndpoint", ["host", "port", "tm_port"])
+
+STAGING_DIR_NAME = ".staging"
+
+
+# ======================================================================================================================
+# region -- SCENARIO JOBS ----------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def parse_server_endpoint(endpoint):
+    """
+    Parses a server endpoint given as "host:port:tm_port". The traffic manager port can be omitted, then it is
+    port + 6000 (8000 for the default port 2000).
+    """
+    parts = endpoint.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Server endpoint {endpoint} is not of the form host:port[:tm_port]")
+    port = int(parts[1])
+    tm_port = int(parts[2]) if len(parts) == 3 else port + 6000
+    return ServerEndpoint(parts[0], port, tm_port)
+
+
+def collect_scenario_jobs(file_paths):
+    """
+    Returns one job per scenario of the scenario configuration files. A job contains the map, the scenario definition
+    and the number of attempts so far.
+    """
+    jobs = []
+    with_map = dict()
+    for file_path in file_paths:
+        with open(file_path, "r") as json_file:
+            scenario_definitions = json.load(json_file)
+        map_name = scenario_definitions["scenario_definition"]["map"]
+        for scenario in scenario_definitions["scenario_definition"]["scenarios"]:
+            jobs.append({"id": scenario["id"], "map": map_name, "scenario": scenario, "attempt": 0})
+            with_map[map_name] = with_map.get(map_name, 0) + 1
+
+    # scenarios of the same map follow each other, so the workers seldom have to load another map
+    jobs.sort(key=lambda job: job["map"])
+    logging.info(f"Collected {len(jobs)} scenarios: {with_map}")
+    return jobs
+
+
+def merge_into_dataset(source, destination):
+    """
+    Moves all files of the source folder into the destination folder. Existing folders are merged, existing files are
+    replaced.
+    """
+    os.makedirs(destination, exist_ok=True)
+    for entry in os.listdir(source):
+        source_path = os.path.join(source, entry)
+        destination_path = os.path.join(destination, entry)
+        if os.path.isdir(source_path) and os.path.isdir(destination_path):
+            merge_into_dataset(source_path, destination_path)
+        else:
+            if os.path.isdir(destination_path):
+                shutil.rmtree(destination_path)
+            shutil.move(source_path, destination_path)
+    shutil.rmtree(source, ignore_errors=True)
+
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- DISPATCHER -------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class _Worker:
+    """
+    Worker process of one server as seen by the dispatcher. The dispatcher hands out the jobs itself, so it always
+    knows which job was lost when a worker dies.
+    """
+
+    def __init__(self, context, worker_id, endpoint, result_queue, staging_root, runner_factory):
+        self.endpoint = endpoint
+        self.job_queue = context.Queue()
+        self.job = None
+        self.connected = True
+        self.process = context.Process(
+            target=run_worker,
+            args=(worker_id, endpoint, self.job_queue, result_queue, staging_root, runner_factory),
+            name=f"scenario_worker_{endpoint.host}_{endpoint.port}",
+        )
+        self.process.start()
+
+    @property
+    def available(self):
+        return self.connected and self.process.is_alive()
+
+    def assign(self, job):
+        self.job = job
+        self.job_queue.put(job)
+
+    def stop(self):
+        if self.process.is_alive():
+            self.job_queue.put(None)
+        self.process.join()
+
+
+def dispatch_scenarios(
+        file_paths,
+        endpoints,
+        output_path=None,
+        max_attempts=Definitions.DISPATCH_MAX_ATTEMPTS,
+        runner_factory=CarlaScenarioRunner,
+        manifest=None
+):
+    """
+    Runs all scenarios of the scenario configuration files on the given servers, one worker process per server.
+    Failed scenarios are retried up to max_attempts times, on whichever server is free next. A worker that dies while
+    running a scenario (e.g. because its server crashed) is restarted. The output of every completed scenario is moved
+    into output_path (default FileStructureManager.THIS_OUTPUT_PATH). runner_factory(endpoint) creates the runner inside
+    the worker process, pass ScenarioWorker.FakeScenarioRunner (or e.g. functools.partial(FakeScenarioRunner,
+    failure_rate=0.2)) to test without carla.
+
+    Every attempt is recorded in the run manifest of output_path, scenarios that are already completed in the
+    manifest are skipped.
+
+    Returns a summary with the ids of all completed and failed scenarios and the attempts per scenario.
+    """
+    if not endpoints:
+        raise ValueError("No server endpoints given")
+    if not output_path:
+        if not FileStructureManager.THIS_OUTPUT_PATH:
+            FileStructureManager.initialize_variables()
+        output_path = FileStructureManager.THIS_OUTPUT_PATH
+    staging_root = os.path.join(output_path, STAGING_DIR_NAME)
+    os.makedirs(staging_root, exist_ok=True)
+
+    manifest = manifest or RunManifest(output_path)
+    jobs = [job for job in collect_scenario_jobs(file_paths) if not manifest.is_completed(job["id"])]
+    pending_jobs = deque(jobs)
+    summary = {"completed": [], "failed": [], "attempts": {}}
+
+    # spawn instead of fork, the carla client of the parent process must not be shared with the workers
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+
+    def start_worker(worker_id):
+        return _Worker(context, worker_id, endpoints[worker_id], result_queue, staging_root, runner_factory)
+
+    workers = {worker_id: start_worker(worker_id) for worker_id in range(len(endpoints))}
+    logging.info(f"Started {len(workers)} scenario workers for {len(jobs)} scenarios")
+
+    remaining = len(jobs)
+    start_time = time.time()
+    finished_attempts = set()  # (scenario id, attempt)
+
+    def finish_attempt(job, status, error, staging_path, frames=0):
+        nonlocal remaining
+        # a worker that dies right after reporting its attempt is also noticed as a lost attempt, whichever comes
+        # second is ignored
+        if (job["id"], job["attempt"]) in finished_attempts:
+            return
+        finished_attempts.add((job["id"], job["attempt"]))
+        summary["attempts"][job["id"]] = job["attempt"] + 1
+        if status == "completed":
+            merge_into_dataset(staging_path, output_path)
+            manifest.completed(job["id"], frames=frames)
+            summary["completed"].append(job["id"])
+            remaining -= 1
+            logging.info(f"{Fore.GREEN}Scenario {job['id']} completed ({len(summary['completed'])}/{len(jobs)}, "
+                         f"{time.time() - start_time:.0f}s){Style.RESET_ALL}")
+            return
+
+        shutil.rmtree(staging_path, ignore_errors=True)
+        manifest.failed(job["id"], error)
+        if job["attempt"] + 1 < max_attempts:
+            logging.warning(f"Scenario {job['id']} failed ({error}), retrying")
+            pending_jobs.append({**job, "attempt": job["attempt"] + 1})
+        else:
+            logging.error(f"{Fore.RED}Scenario {job['id']} failed {max_attempts} times ({error}){Style.RESET_ALL}")
+            summary["failed"].append(job["id"])
+            remaining -= 1
+
+    try:
+        while remaining > 0:
+            for worker_id, worker in list(workers.items()):
+                if worker.connected and not worker.process.is_alive() and worker.job is not None:
+                    # the worker died while running a scenario, the scenario is retried and the worker restarted
+                    job = worker.job
+                    finish_attempt(job, "failed", f"worker exit code {worker.process.exitcode}",
+                                   get_staging_path(staging_root, job))
+                    worker.stop()
+                    workers[worker_id] = worker = start_worker(worker_id)
+                if worker.available and worker.job is None and pending_jobs:
+                    worker.assign(pending_jobs.popleft())
+                    manifest.started(worker.job["id"], worker.job["map"], worker.job["attempt"])
+
+            if not any(worker.available for worker in workers.values()):
+                logging.error(f"{Fore.RED}No scenario worker is left, {remaining} scenarios left{Style.RESET_ALL}")
+                break
+
+            try:
+                status, worker_id, job, error, staging_path, frames = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            if status == "worker_failed":
+                logging.error(f"Scenario worker of {endpoints[worker_id].host}:{endpoints[worker_id].port} stopped: "
+                              f"{error}")
+                workers[worker_id].connected = False
+                if workers[worker_id].job is not None:
+                    pending_jobs.appendleft(workers[worker_id].job)
+                    workers[worker_id].job = None
+            else:
+                # the report of a dead worker can arrive after its restart, the job of the new worker is kept
+                current_job = workers[worker_id].job
+                if current_job is not None and current_job["id"] == job["id"] \
+                        and current_job["attempt"] == job["attempt"]:
+                    workers[worker_id].job = None
+                finish_attempt(job, status, error, staging_path, frames)
+    finally:
+        for worker in workers.values():
+            worker.stop()
+        shutil.rmtree(staging_root, ignore_errors=True)
+
+    # scenarios that were never finished because no worker was left
+    finished = set(summary["completed"]) | set(summary["failed"])
+    summary["failed"].extend(job["id"] for job in jobs if job["id"] not in finished)
+
+    logging.info(
+        f"Dispatched {len(jobs)} scenarios to {len(endpoints)} servers in {time.time() - start_time:.1f}s: "
+        f"{len(summary['completed'])} completed, {len(summary['failed'])} failed"
+    )
+    return summary
+
+# endregion
+# ======================================================================================================================
@@ -12,11 +12,17 @@ from collections import namedtuple
 from colorama import Fore, Style
 
 import Definitions
-from DataAnalysis import DataGenerator, BevGenerator
+from DataAnalysis import DataGenerator, BevGenerator, Profiler
+from DataAnalysis.FramePipeline import flush_frames, get_frame_pipeline, shutdown_frames
+from DataAnalysis.FrameSlots import close_frame_slots
+from DataAnalysis.OutputGenerator import append_action_data, flush_action_logs
+from DataAnalysis.VoxelGenerator import flush_voxel_grids, shutdown_voxel_grids
+from DataAnalysis.WriteBehind import flush_writes, shutdown_writes
 from DataAnalysis.Utils import (
     get_label_attributes,
 )
 from Definitions import AnomalyTypes
+from EgoVehicleSetup import DEPTH_CAM_TYPE
 from FileStructureManager import save_sensor_setup
 from Models.World import World
 from Models.World.World import (
@@ -24,6 +30,8 @@ from Models.World.World import (
     compute_world_offset,
     start_movement_of_npcs, debug_route, )
 from Scenarios import Util
+from .RunManifest import RunManifest
+from .SensorSync import SensorSyncTimeout
 from .AnomalyBehaviourDefinitions import (
     ANOMALY_BEHAVIORS,
 )
@@ -32,7 +40,7 @@ from .ScenarioUtil import (
     build_scenario_config,
     stop_sensors,
     start_listening_cameras_lidars,
-    initialize_cameras_and_sensors_queues,
+    initialize_sensor_sync,
 )
 from .Util import (
     get_action_state_data,
@@ -43,25 +51,32 @@ from .Util import (
 # ======================================================================================================================
 # region -- 1. RUN_ALL_SCENARIOS_FROM_CONFIGS --------------------------------------------------------------------------
 # ======================================================================================================================
-def run_all_scenarios_from_configs(file_paths):
+def run_all_scenarios_from_configs(file_paths, manifest=None):
     """
     Runs all scenarios defined in configuration files. This function iterates over scenario configuration files,
     sets up the simulation environment, spawns an ego vehicle, attaches sensors, runs each scenario, and collects the
-    output data.
+    output data. The state of every scenario is written to the run manifest, scenarios that are already completed in
+    the manifest are skipped.
     """
 
     World.create_world(synchronous_mode=False)
     scenario_config_files = file_paths
+    manifest = manifest or RunManifest()
 
     outputs_as_dict = {}
 
-    sensors = None
-    coll_detec = None
-
     try:
         # Iterate over each scenario configuration file
         for scenario_config_file in scenario_config_files:
             scenario_definitions = Util.get_scenario_config(scenario_config_file)
+            scenarios = [
+                scenario for scenario in scenario_definitions["scenario_definition"]["scenarios"]
+                if not manifest.is_completed(scenario["id"])
+            ]
+            if not scenarios:
+                logging.info(f"All scenarios of {scenario_config_file} are completed, skipping")
+                continue
+
             World.change_world(
                 World.WORLD_STATE,
                 scenario_definitions["scenario_definition"]["map"],
@@ -71,64 +86,22 @@ def run_all_scenarios_from_configs(file_paths):
             logging.debug(f'SCENARIO_CONFIG_MAP: {scenario_definitions["scenario_definition"]["map"]}')
 
             # Iterate over each scenario defined in the configuration
-            for scenario in scenario_definitions["scenario_definition"]["scenarios"]:
+            for scenario in scenarios:
+                manifest.started(scenario["id"], scenario_definitions["scenario_definition"]["map"])
                 try:
-                    # SCENARIO STARTED PREPARATION
-                    logging.info(f'Starting Scenario: {scenario["id"]}')
-                    logging.debug(f"{json.dumps(scenario, sort_keys=True, indent=4)}")
-
-                    # SETTING WEATHER
-                    World.set_weather(
-                        World.WORLD_STATE,
-                        scenario["weather_preset"],
-                    )
-
-                    # SPAWNING EGO_VEHICLE
-                    ego_spawnpoint = Util.get_transform(scenario["ego_spawnpoint"])
-                    ego_vehicle = World.spawn_ego_vehicle_to_world(
-                        World.WORLD_STATE,
-                        vehicle_name=Definitions.EGO_VEHICLE,
-                        spawn_points_num=ego_spawnpoint,
-                    )
-
-                    # ATTACHING ALL CAMERAS AND SENSORS TO EGO_VEHICLE
-                    sensors, transforms = construct_cameras_and_sensors(ego_vehicle)
-                    coll_detec = World.spawn_coll_detec_sensor(World.WORLD_STATE, ego_vehicle)
-
-                    # BUILD SCENARIO CONFIG
-                    scenario_config = build_scenario_config(scenario, ego_vehicle)
-
-                    # SAVE SERVER SETUP JSON SPECIFICATION FILE
-                    save_sensor_setup(scenario_id=scenario_config["scenario_id"], sensor_setup_data=sensors)
-
-                    # RUN_SCENARIO
-                    frame_datas_as_list = run_scenario(
-                        scenario_config,
-                        sensors,
-                        coll_detec,
-                        transforms
-                    )
-
                     # ADDING SCENARIO OUTPUT TO OUTPUTS
                     # 1700mb per scenario without this line
-                    outputs_as_dict[scenario_config["scenario_id"]] = frame_datas_as_list
-
-                    # SCENARIO FINISHED
-                    World.destroy_everything()
-                    logging.info(f"\n{Fore.GREEN}Finished Scenario {scenario['id']}{Style.RESET_ALL}\n")
-
-                except Exception:
-                    logging.error(
-                        "Exception, waiting 10 secs then continuing",
-                        exc_info=True,
-                    )
-                    time.sleep(10)
-                    stop_sensors(sensors)
-                    coll_detec.stop()
-                    World.destroy_everything()
-                    time.sleep(3)
+                    outputs_as_dict[scenario["id"]] = run_scenario_from_definition(scenario)
+                except Exception as e:
+                    # the scenario has already been cleaned up, continue with the next one
+                    manifest.failed(scenario["id"], repr(e))
                     continue
 
+                if outputs_as_dict[scenario["id"]]:
+                    manifest.completed(scenario["id"], frames=outputs_as_dict[scenario["id"]])
+                else:
+                    manifest.failed(scenario["id"], "scenario did not finish")
+
     except Exception as e:
         logging.error(
             "Exception in scenario run",
@@ -136,9 +109,95 @@ def run_all_scenarios_from_configs(file_paths):
         )
     finally:
         logging.info("All Scenarios finished, now creating output zip")
+        shutdown_frames()
+        shutdown_voxel_grids()
+        shutdown_writes()
+        close_frame_slots()
         deactivate_synchronous_mode_settings(World.WORLD_STATE)
 
 
+def run_scenario_from_definition(scenario, output_path=None):
+    """
+    Runs a single scenario of a scenario configuration file on the currently loaded map: spawns the ego vehicle,
+    attaches the sensors, runs the scenario and destroys all actors afterwards. The output is written into output_path,
+    FileStructureManager.THIS_OUTPUT_PATH by default. Returns the number of recorded frames. If the scenario fails, the
+    simulation is cleaned up and the exception is raised again.
+    """
+    sensors = None
+    coll_detec = None
+
+    try:
+        # SCENARIO STARTED PREPARATION
+        logging.info(f'Starting Scenario: {scenario["id"]}')
+        logging.debug(f"{json.dumps(scenario, sort_keys=True, indent=4)}")
+
+        # SETTING WEATHER
+        World.set_weather(
+            World.WORLD_STATE,
+            scenario["weather_preset"],
+        )
+
+        # SPAWNING EGO_VEHICLE
+        ego_spawnpoint = Util.get_transform(scenario["ego_spawnpoint"])
+        ego_vehicle = World.spawn_ego_vehicle_to_world(
+            World.WORLD_STATE,
+            vehicle_name=Definitions.EGO_VEHICLE,
+            spawn_points_num=ego_spawnpoint,
+        )
+
+        # ATTACHING ALL CAMERAS AND SENSORS TO EGO_VEHICLE
+        sensors, transforms = construct_cameras_and_sensors(ego_vehicle)
+        coll_detec = World.spawn_coll_detec_sensor(World.WORLD_STATE, ego_vehicle)
+
+        # BUILD SCENARIO CONFIG
+        scenario_config = build_scenario_config(scenario, ego_vehicle, output_path)
+        Profiler.start_profile(scenario_config["scenario_id"], output_path)
+
+        # SAVE SERVER SETUP JSON SPECIFICATION FILE
+        save_sensor_setup(
+            scenario_id=scenario_config["scenario_id"],
+            sensor_setup_data=sensors,
+            output_path=output_path,
+        )
+
+        # RUN_SCENARIO
+        frame_datas_as_list = run_scenario(
+            scenario_config,
+            sensors,
+            coll_detec,
+            transforms
+        )
+
+        # SCENARIO FINISHED
+        with Profiler.phase("teardown"):
+            World.destroy_everything()
+        Profiler.finish_profile()
+        actor_timings = World.WORLD_STATE.ACTOR_TIMINGS.items()
+        actor_timings = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in actor_timings)
+        logging.info(f"Actor batches of scenario {scenario['id']}: {actor_timings}")
+        logging.info(f"\n{Fore.GREEN}Finished Scenario {scenario['id']}{Style.RESET_ALL}\n")
+        return frame_datas_as_list
+
+    except Exception:
+        logging.error(
+            "Exception, waiting 10 secs then continuing",
+            exc_info=True,
+        )
+        time.sleep(10)
+        if sensors is not None:
+            stop_sensors(sensors)
+        if coll_detec is not None:
+            coll_detec.stop()
+        flush_frames()
+        flush_voxel_grids()
+        flush_writes()
+        flush_action_logs()
+        World.destroy_everything()
+        Profiler.finish_profile()
+        time.sleep(3)
+        raise
+
+
 # endregion
 # ======================================================================================================================
 
@@ -187,10 +246,11 @@ def run_in_synchronous_mode(
         transforms
 ):
     """
-    Run the scenario in synchronous mode.
+    Run the scenario in synchronous mode. Returns the number of recorded frames.
     """
 
-    frame_data_list = []
+    recorded_frames = 0
+    frame_pipeline = get_frame_pipeline()
     World.activate_synchronous_mode_settings(World.WORLD_STATE)
     traffic_manager = World.activate_traffic_manager()
 
@@ -213,8 +273,14 @@ def run_in_synchronous_mode(
     # COMPUTE MAP OFFSET FOR BEV ROUTE MAP
     compute_world_offset(World.WORLD_STATE)
 
-    # CAMERAS AND SENSORS QUEUE
-    image_lidar_queues = initialize_cameras_and_sensors_queues(sensors)
+    # CAMERAS AND SENSORS SYNC BUFFER
+    sensor_sync = initialize_sensor_sync(sensors)
+
+    # DEPTH CAMERAS FOR THE ONLINE VOXELIZATION
+    camera_params = {
+        (sensor['location'], sensor['rotation']): sensor['args']
+        for sensor in sensors.values() if sensor['sensor_type'] == DEPTH_CAM_TYPE
+    }
 
     # TICKING STARTED
     tick_count = 0
@@ -239,7 +305,7 @@ def run_in_synchronous_mode(
             scenario_config,
             static_dict,
             sensors,
-            image_lidar_queues,
+            sensor_sync,
             tick_count,
             Definitions.MAX_TICKCOUNT,
             frame_id,
@@ -251,7 +317,7 @@ def run_in_synchronous_mode(
             scenario_config,
             static_dict,
             sensors,
-            image_lidar_queues,
+            sensor_sync,
             tick_count,
             Definitions.MAX_TICKCOUNT,
             frame_id,
@@ -282,7 +348,8 @@ def run_in_synchronous_mode(
     # SPAWNING NPCS (VEHICLES AND WALKERS)
     npc_walker_amount = scenario_config["scenario"]["npc_walker_amount"]
     npc_vehicle_amount = scenario_config["scenario"]["npc_vehicle_amount"]
-    World.spawn_npcs_to_world(World.WORLD_STATE, npc_vehicle_amount, npc_walker_amount)
+    with Profiler.phase("spawn_npcs"):
+        World.spawn_npcs_to_world(World.WORLD_STATE, npc_vehicle_amount, npc_walker_amount)
 
     while tick_count < 15:
         frame_id, tick_count = update_progress(
@@ -291,156 +358,222 @@ def run_in_synchronous_mode(
             "Scenario Progress",
         )  # tick_count = 3 to 15
 
-    # START LISTENING OF CAMERAS AND SENSORS
-    start_listening_cameras_lidars(sensors, image_lidar_queues)
-
-    # START MOVEMENT OF NPCS
-    start_movement_of_npcs(traffic_manager.get_port())
-
-    excecute_scenario_behavior(
-        scenario_config,
-        static_dict,
-        sensors,
-        image_lidar_queues,
-        tick_count,
-        Definitions.MAX_TICKCOUNT,
-        frame_id,
-    )
-
-    instances_to_relabel = [Instance_Label(
-        "ego_vehicle",
-        ego_vehicle_id,
-        get_label_attributes("name", "ego_vehicle", "id"),
-    )
-        # ego vehicle should be relabeled as unseen
-    ]
-
-    # if scenario_config["anomaly_type"] == "STATIC":
-    #    instances_to_relabel.append(Instance_Label(
-    #        "anomaly",
-    #        anomaly_id,
-    #        get_label_attributes("name", "anomaly", "id"),
-    #    ))
-
-    # -- region START-REAL-SCENARIO-TIME -------------------------------------------------------------------------------
-
-    while tick_count < Definitions.MAX_TICKCOUNT:
-        World.set_green_relevant_traffic_light()
-
-        anomaly_type = scenario_config['anomaly_config']['anomalytype']
-        World.ego_vehicle_apply_control_run_step(World.WORLD_STATE, anomaly_type)
-
-        World.normal_vehicle_agent_apply_control_run_step(World.WORLD_STATE)
+    # the sensors, the frame pipeline and the writes are stopped and flushed even if the scenario fails, so no
+    # frame of this scenario is still processed when the world is torn down or leaks into the next scenario
+    frame_data_list = list()
+    try:
+        # START LISTENING OF CAMERAS AND SENSORS
+        start_listening_cameras_lidars(sensors, sensor_sync)
 
-        if len(World.WORLD_STATE.EGO_VEHICLE_COLLISIONS) > 0:
-            for collision in World.WORLD_STATE.EGO_VEHICLE_COLLISIONS:
-                if 'walker.pedestrian' in collision.other_actor.type_id:
-                    logging.error(f"Ego vehicle crashed into pedestrian. Ignore scenario")
-                    raise ValueError('pedestrian_crash')
-                    # write_scenario_id_to_file(scenario_config["scenario_id"])
+        # START MOVEMENT OF NPCS
+        start_movement_of_npcs(traffic_manager.get_port())
 
-        frame_id, tick_count = update_progress(
-            tick_count,
-            Definitions.MAX_TICKCOUNT,
-            "Scenario Progress",
-        )  # tick_count = 15 to Definitions.MAX_TICKCOUNT
-
-        behavior_update = excecute_scenario_behavior(
+        excecute_scenario_behavior(
             scenario_config,
             static_dict,
             sensors,
-            image_lidar_queues,
+            sensor_sync,
             tick_count,
             Definitions.MAX_TICKCOUNT,
             frame_id,
         )
 
-        if (
-                Definitions.BREAKING_START <= tick_count <= Definitions.BREAKING_STOP) and anomaly_type == "SUDDEN_BREAKING_OF_VEHICLE_AHEAD":
-            instances_to_relabel.append(Instance_Label(
-                "anomaly",
-                anomaly_id,
-                get_label_attributes("name", "anomaly", "id"),
-            ))
-
-        if not (
-                Definitions.BREAKING_START <= tick_count <= Definitions.BREAKING_STOP) and anomaly_type == "SUDDEN_BREAKING_OF_VEHICLE_AHEAD":
-            instances_to_relabel.append(Instance_Label(
-                "agent",
-                anomaly_id,
-                get_label_attributes("name", "agent_car", "id"),
-            ))
-
-        # behavior_update has values interesting for the data generation such as agent labels etc.
-        if scenario_config["anomaly_type"] == "STATIC":
-            actors_in_agent_mode = behavior_update.get("agent_mode_vehicles") or []
-
-            for agent in actors_in_agent_mode:
-                semantic_tag = agent.semantic_tags[0]
-                agent_semantic_tag = semantic_tag + 100
-                agent_instance_label = Instance_Label("agent", agent.id, agent_semantic_tag, )
-                instances_to_relabel.append(agent_instance_label)
-
-        if tick_count % Definitions.TICK_COUNT_MODULO_VALUE == 0:
-            logging.debug(f"Current ego_vehicle location: {scenario_config['ego_vehicle'].get_location()}")
-
-            # GETTING ACTION STATES
-            logging.debug("GETTING ACTION STATES")
-            action_state_dict = get_action_state_data(scenario_config["scenario_id"], frame_id,
-                                                      scenario_config['anomaly_config']['anomalytype'])
-
-            # GETTING FRAME DATA
-            frame_data_object = DataGenerator.generate_data(
-                scenario_id=scenario_config["scenario_id"],
-                frame_id=frame_id,
-                sensor_callbacks=[
-                    {
-                        "sensor": sensors[sensor_name]['sensor'],
-                        "callback": functools.partial(
-                            sensors[sensor_name]['callback'],
-                            data_queue=image_lidar_queues[sensor_name],
-                            sensor_name=sensor_name,
-                            file_ending=sensors[sensor_name]['file_ending'],
-                            dataformat=sensors[sensor_name]['dataformat'],
-                            sensor_type=sensors[sensor_name]['sensor_type'],
-                            location=sensors[sensor_name]['location'],
-                            rotation=sensors[sensor_name]['rotation'],
-                            save_data=sensors[sensor_name]['save_data']
-                        )
-                    } for sensor_name in sensors
-                ],
-                sensor_transforms=transforms,
-                id_labels=instances_to_relabel,
-                tick_count=tick_count,
-                anomaly_type=scenario_config['anomaly_config']['anomalytype'],
-            )
-
-            frame_bev_object = BevGenerator.generate_data(
-                scenario_config["scenario_id"],
-                frame_id
-            )
-
-            frame_data_object.action_state_dict = action_state_dict
-            if frame_data_object:
-                frame_data_list.append(frame_data_object)
+        instances_to_relabel = [Instance_Label(
+            "ego_vehicle",
+            ego_vehicle_id,
+            get_label_attributes("name", "ego_vehicle", "id"),
+        )
+            # ego vehicle should be relabeled as unseen
+        ]
+
+        # if scenario_config["anomaly_type"] == "STATIC":
+        #    instances_to_relabel.append(Instance_Label(
+        #        "anomaly",
+        #        anomaly_id,
+        #        get_label_attributes("name", "anomaly", "id"),
+        #    ))
+
+        # -- region START-REAL-SCENARIO-TIME ---------------------------------------------------------------------------
+
+        while tick_count < Definitions.MAX_TICKCOUNT:
+            with Profiler.phase("traffic_lights"):
+                World.set_green_relevant_traffic_light()
+
+            anomaly_type = scenario_config['anomaly_config']['anomalytype']
+            with Profiler.phase("ego_agent"):
+                World.ego_vehicle_apply_control_run_step(World.WORLD_STATE, anomaly_type)
+
+            with Profiler.phase("npc_agents"):
+                World.normal_vehicle_agent_apply_control_run_step(World.WORLD_STATE)
+
+            if len(World.WORLD_STATE.EGO_VEHICLE_COLLISIONS) > 0:
+                for collision in World.WORLD_STATE.EGO_VEHICLE_COLLISIONS:
+                    if 'walker.pedestrian' in collision.other_actor.type_id:
+                        logging.error(f"Ego vehicle crashed into pedestrian. Ignore scenario")
+                        raise ValueError('pedestrian_crash')
+                        # write_scenario_id_to_file(scenario_config["scenario_id"])
+
+            with Profiler.phase("world_tick"):
+                frame_id, tick_count = update_progress(
+                    tick_count,
+                    Definitions.MAX_TICKCOUNT,
+                    "Scenario Progress",
+                )  # tick_count = 15 to Definitions.MAX_TICKCOUNT
+            Profiler.count("ticks")
+
+            with Profiler.phase("scenario_behavior"):
+                behavior_update = excecute_scenario_behavior(
+                    scenario_config,
+                    static_dict,
+                    sensors,
+                    sensor_sync,
+                    tick_count,
+                    Definitions.MAX_TICKCOUNT,
+                    frame_id,
+                )
+
+            if (
+                    Definitions.BREAKING_START <= tick_count <= Definitions.BREAKING_STOP) and anomaly_type == "SUDDEN_BREAKING_OF_VEHICLE_AHEAD":
+                instances_to_relabel.append(Instance_Label(
+                    "anomaly",
+                    anomaly_id,
+                    get_label_attributes("name", "anomaly", "id"),
+                ))
+
+            if not (
+                    Definitions.BREAKING_START <= tick_count <= Definitions.BREAKING_STOP) and anomaly_type == "SUDDEN_BREAKING_OF_VEHICLE_AHEAD":
+                instances_to_relabel.append(Instance_Label(
+                    "agent",
+                    anomaly_id,
+                    get_label_attributes("name", "agent_car", "id"),
+                ))
+
+            # behavior_update has values interesting for the data generation such as agent labels etc.
+            if scenario_config["anomaly_type"] == "STATIC":
+                actors_in_agent_mode = behavior_update.get("agent_mode_vehicles") or []
+
+                for agent in actors_in_agent_mode:
+                    semantic_tag = agent.semantic_tags[0]
+                    agent_semantic_tag = semantic_tag + 100
+                    agent_instance_label = Instance_Label("agent", agent.id, agent_semantic_tag, )
+                    instances_to_relabel.append(agent_instance_label)
+
+            if tick_count % Definitions.TICK_COUNT_MODULO_VALUE == 0:
+                # WAITING FOR THE DATA OF ALL SENSORS OF THIS FRAME
+                try:
+                    with Profiler.phase("sensor_wait"):
+                        frame_sensor_data = sensor_sync.get_frame(frame_id)
+                except SensorSyncTimeout as e:
+                    logging.warning(f"Skipping frame {frame_id}: {e}")
+                    Profiler.count("skipped_frames")
+                    continue
 
-            frame_bev_object.action_state_dict = action_state_dict
-            if frame_bev_object:
-                frame_data_list.append(frame_bev_object)
-        else:
-            for queue in image_lidar_queues.values():
-                queue.get()
+                logging.debug(f"Current ego_vehicle location: {scenario_config['ego_vehicle'].get_location()}")
+
+                # GETTING ACTION STATES
+                logging.debug("GETTING ACTION STATES")
+                with Profiler.phase("action_states"):
+                    action_state_dict = get_action_state_data(scenario_config["scenario_id"], frame_id,
+                                                              scenario_config['anomaly_config']['anomalytype'],
+                                                              scenario_config["output_path"])
+                    append_action_data(action_state_dict)
+
+                with Profiler.phase("ego_transform"):
+                    ev_transform = World.WORLD_STATE.EGO_VEHICLE.get_transform()
+
+                # GETTING FRAME DATA, WHILE THE NEXT FRAMES ARE TICKED
+                frame_pipeline.submit(
+                    frame_id,
+                    post_process_frame,
+                    scenario_id=scenario_config["scenario_id"],
+                    frame_id=frame_id,
+                    output_path=scenario_config["output_path"],
+                    sensor_callbacks=[
+                        {
+                            "sensor": sensors[sensor_name]['sensor'],
+                            "callback": functools.partial(
+                                sensors[sensor_name]['callback'],
+                                sensor_data=frame_sensor_data[sensor_name],
+                                sensor_name=sensor_name,
+                                file_ending=sensors[sensor_name]['file_ending'],
+                                dataformat=sensors[sensor_name]['dataformat'],
+                                sensor_type=sensors[sensor_name]['sensor_type'],
+                                location=sensors[sensor_name]['location'],
+                                rotation=sensors[sensor_name]['rotation'],
+                                save_data=sensors[sensor_name]['save_data']
+                            )
+                        } for sensor_name in sensors
+                    ],
+                    sensor_transforms=transforms,
+                    # instances are added in later ticks, the frame is relabeled with the ones known now
+                    id_labels=tuple(instances_to_relabel),
+                    tick_count=tick_count,
+                    anomaly_type=scenario_config['anomaly_config']['anomalytype'],
+                    camera_params=camera_params,
+                    ev_transform=ev_transform,
+                    action_state_dict=action_state_dict,
+                )
+
+                recorded_frames += 1
+                Profiler.count("recorded_frames")
+            else:
+                sensor_sync.skip_frame(frame_id)
+
+        # endregion ----------------------------------------------------------------------------------------------------
 
-    # endregion --------------------------------------------------------------------------------------------------------
+    finally:
+        World.WORLD_STATE.anomalous_behavior_started = False  # for dynamic scenarios
+        stop_sensors(sensors)
+        coll_detec.stop()
+        sensor_sync.log_stats()
+
+        # wait until all frames of the scenario are post-processed
+        with Profiler.phase("flush_frames"):
+            frame_data_list, failed_frames = flush_frames()
+        if failed_frames:
+            logging.error(f"{failed_frames} frames of scenario {scenario_config['scenario_id']} could not be processed")
+
+        # wait until all sensor data of the scenario is written to disk
+        with Profiler.phase("flush_writes"):
+            failed_writes = flush_writes()
+        if failed_writes:
+            logging.error(f"{failed_writes} files of scenario {scenario_config['scenario_id']} could not be written")
+        with Profiler.phase("flush_voxel_grids"):
+            failed_voxel_grids = flush_voxel_grids()
+        if failed_voxel_grids:
+            logging.error(
+                f"{failed_voxel_grids} voxel grids of scenario {scenario_config['scenario_id']} could not be created"
+            )
 
-    World.WORLD_STATE.anomalous_behavior_started = False  # for dynamic scenarios
-    stop_sensors(sensors)
-    coll_detec.stop()
+        # write the action states of all frames of the scenario at once
+        with Profiler.phase("flush_action_log"):
+            flush_action_logs()
 
     # delete frame data from memory
     del frame_data_list
 
-    return True
+    return recorded_frames
+
+
+def post_process_frame(scenario_id, frame_id, output_path, ev_transform, action_state_dict, **generate_data_kwargs):
+    """
+    Generates the sensor data and the BEV route map of a recorded frame, runs on the frame pipeline. Returns the frame
+    data objects of the frame.
+    """
+    frame_data_object = DataGenerator.generate_data(
+        scenario_id=scenario_id,
+        frame_id=frame_id,
+        output_path=output_path,
+        **generate_data_kwargs
+    )
+    frame_bev_object = BevGenerator.generate_data(scenario_id, frame_id, ev_transform, output_path)
+
+    frame_data_objects = list()
+    for frame_object in (frame_data_object, frame_bev_object):
+        if frame_object:
+            frame_object.action_state_dict = action_state_dict
+            frame_data_objects.append(frame_object)
+    return frame_data_objects
 
 # endregion
 # ======================================================================================================================
@@ -2,7 +2,6 @@
 This file contains utility functions for scenarios.
 """
 import json
-from queue import Queue
 
 import Definitions
 from DataAnalysis.DataGenerator import image_callback, lidar_callback, semantic_lidar_callback
@@ -12,6 +11,7 @@ from EgoVehicleSetup import RGB_CAM_TYPE, DEPTH_CAM_TYPE, INSTANCE_CAM_TYPE, SEM
     LIDAR_TYPE, \
     SEMANTIC_LIDAR_TYPE
 from Models.World import World
+from Scenarios.SensorSync import SensorSyncBuffer
 
 
 def _create_sensor_name(sensor_type, location, rotation, sensor_arguments):
@@ -151,11 +151,13 @@ def construct_cameras_and_sensors(ego_vehicle):
     return sensors, transforms
 
 
-def build_scenario_config(scenario, ego_vehicle):
+def build_scenario_config(scenario, ego_vehicle, output_path=None):
     """
-    Builds a scenario configuration dictionary.
+    Builds a scenario configuration dictionary. output_path is the output folder of the run the scenario is written
+    to, FileStructureManager.THIS_OUTPUT_PATH if None.
     """
     return {
+        "output_path": output_path,
         "anomaly_config": scenario["anomaly_config"],
         "anomaly_type": AnomalyTypes[scenario["anomaly_config"]["anomalytype"]].name,
         "scenario_id": scenario["id"],
@@ -166,22 +168,21 @@ def build_scenario_config(scenario, ego_vehicle):
     }
 
 
-def start_listening_cameras_lidars(sensors, image_lidar_queues):
+def start_listening_cameras_lidars(sensors, sensor_sync):
     """
     Start listening to cameras and lidars. Starts listening to the given cameras and lidars and puts the captured
-    images and lidar data into the respective queues.
+    images and lidar data into the sensor sync buffer.
     """
 
     for sensor_name in sensors:
-        sensors[sensor_name]['sensor'].listen(image_lidar_queues[sensor_name].put)
+        sensors[sensor_name]['sensor'].listen(sensor_sync.callback(sensor_name))
 
 
-def initialize_cameras_and_sensors_queues(sensors):
+def initialize_sensor_sync(sensors):
     """
-    Initialize queues for each sensor.
+    Initialize the buffer that collects the data of all sensors by frame.
     """
-    image_lidar_queues = {sensor_name: Queue() for sensor_name in sensors}
-    return image_lidar_queues
+    return SensorSyncBuffer(sensors.keys())
 
 
 def stop_sensors(sensors):
@@ -0,0 +1,137 @@
+"""This module contains the worker processes of the ScenarioDispatcher and the scenario runners they drive. The
+dispatcher starts the workers with the spawn start method, which imports the module of the process target and the main
+script again in every worker. This module therefore does not import carla, only CarlaScenarioRunner imports it when it
+is created inside a worker of a real server, so FakeScenarioRunner can test the dispatching without carla."""
+import json
+import logging
+import os
+import random
+import shutil
+import time
+
+import Definitions
+
+
+def get_staging_path(staging_root, job):
+    """
+    Returns the staging folder of the current attempt of job, the output of the attempt is written into it.
+    """
+    return os.path.join(staging_root, f"{job['id']}_attempt_{job['attempt']}")
+
+
+# ======================================================================================================================
+# region -- SCENARIO RUNNERS -------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class CarlaScenarioRunner:
+    """
+    Runs scenarios on one carla server. It is created inside the worker process, so the WorldState of the process is
+    connected to the server of the worker.
+    """
+
+    def __init__(self, endpoint):
+        # carla is only imported in the worker processes of real servers
+        from Models.World import World
+
+        self.endpoint = endpoint
+        World.connect_world_state(World.WORLD_STATE, endpoint.host, endpoint.port, endpoint.tm_port)
+        World.create_world(synchronous_mode=False)
+        self.current_map = None
+
+    def run(self, job, output_path):
+        """
+        Runs the scenario of the job and writes its output below output_path. Returns the number of recorded frames.
+        """
+        from Models.World import World
+        from Scenarios import ScenarioMain
+
+        if job["map"] != self.current_map:
+            World.change_world(World.WORLD_STATE, job["map"])
+            self.current_map = job["map"]
+        return ScenarioMain.run_scenario_from_definition(job["scenario"], output_path)
+
+    def close(self):
+        from DataAnalysis.FramePipeline import shutdown_frames
+        from DataAnalysis.FrameSlots import close_frame_slots
+        from DataAnalysis.VoxelGenerator import shutdown_voxel_grids
+        from DataAnalysis.WriteBehind import shutdown_writes
+        from Models.World import World
+
+        shutdown_frames()
+        shutdown_voxel_grids()
+        shutdown_writes()
+        close_frame_slots()
+        if World.WORLD_STATE.WORLD is not None:
+            World.deactivate_synchronous_mode_settings(World.WORLD_STATE)
+
+
+class FakeScenarioRunner:
+    """
+    Stand-in for a carla server. A scenario takes scenario_seconds and writes a sensor setup file and one small file
+    per frame, a share of failure_rate of all attempts fails.
+    """
+
+    def __init__(self, endpoint, scenario_seconds=0.05, frames=5, failure_rate=0.0):
+        self.endpoint = endpoint
+        self.scenario_seconds = scenario_seconds
+        self.frames = frames
+        self.failure_rate = failure_rate
+
+    def run(self, job, output_path):
+        time.sleep(self.scenario_seconds)
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"Fake server {self.endpoint.host}:{self.endpoint.port} failed")
+
+        scenario_path = os.path.join(output_path, f"Scenario_{job['id']}")
+        os.makedirs(os.path.join(scenario_path, "FAKE"), exist_ok=True)
+        with open(os.path.join(scenario_path, Definitions.SENSOR_SETUP_FILE_NAME), "w") as f:
+            json.dump({"endpoint": list(self.endpoint), "map": job["map"]}, f)
+        for frame_id in range(self.frames):
+            with open(os.path.join(scenario_path, "FAKE", f"FAKE_{frame_id}.txt"), "w") as f:
+                f.write(f"{job['id']} {frame_id}\n")
+        return self.frames
+
+    def close(self):
+        pass
+
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- WORKER -----------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def run_worker(worker_id, endpoint, job_queue, result_queue, staging_root, runner_factory):
+    """
+    Worker process of one server. Runs the jobs of its job queue until it receives None and reports every job to the
+    dispatcher.
+    """
+    try:
+        runner = runner_factory(endpoint)
+    except Exception as e:
+        logging.error(f"Could not connect to server {endpoint.host}:{endpoint.port}", exc_info=True)
+        result_queue.put(("worker_failed", worker_id, None, repr(e), None, 0))
+        return
+
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+
+            staging_path = get_staging_path(staging_root, job)
+            shutil.rmtree(staging_path, ignore_errors=True)
+            frames = 0
+            try:
+                frames = runner.run(job, staging_path)
+                status = "completed" if frames else "failed"
+                error = None if frames else "scenario did not finish"
+            except Exception as e:
+                logging.error(f"Scenario {job['id']} failed on {endpoint.host}:{endpoint.port}", exc_info=True)
+                status, error = "failed", repr(e)
+            result_queue.put((status, worker_id, job, error, staging_path, frames))
+    finally:
+        runner.close()
+
+# endregion
+# ======================================================================================================================
@@ -0,0 +1,165 @@
+"""This module synchronizes the outputs of all sensors of the ego vehicle. Carla delivers the sensor data of a tick
+asynchronously on its own threads, every item carries the simulator frame it belongs to. The SensorSyncBuffer collects
+the items by frame and hands out one complete set of all sensors per tick, so the data of a recorded frame always
+belongs to the same simulator frame. Data of older frames is dropped as stale and at most max_frames frames are
+buffered, so the memory stays bounded even if the simulation falls behind."""
+import logging
+import threading
+import time
+
+import Definitions
+
+
+class SensorSyncTimeout(TimeoutError):
+    """
+    Raised if the data of a frame is not complete within the timeout.
+    """
+
+    def __init__(self, frame, missing_sensors):
+        super().__init__(f"No data of {len(missing_sensors)} sensors for frame {frame}: {sorted(missing_sensors)}")
+        self.frame = frame
+        self.missing_sensors = missing_sensors
+
+
+class _SensorStats:
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "mean_latency": self.latency_sum / self.received if self.received else 0.0,
+            "max_latency": self.latency_max,
+        }
+
+
+# ======================================================================================================================
+# region -- SENSOR SYNC BUFFER -----------------------------------------------------------------------------------------
+# ======================================================================================================================
+class SensorSyncBuffer:
+    """
+    Buffers the sensor data of the sensors sensor_names by frame. The sensors put their data with the callbacks of
+    callback(sensor_name), the simulation takes the complete set of a frame with get_frame or discards it with
+    skip_frame.
+
+    The latency of a sensor is the time between the first data of a frame (from any sensor) and the data of the sensor.
+    """
+
+    def __init__(
+            self,
+            sensor_names,
+            timeout=Definitions.SENSOR_SYNC_TIMEOUT,
+            max_frames=Definitions.SENSOR_SYNC_MAX_FRAMES
+    ):
+        self.sensor_names = frozenset(sensor_names)
+        self.timeout = timeout
+        self.max_frames = max_frames
+
+        self._condition = threading.Condition()
+        self._frames = dict()  # frame -> {sensor_name: data}
+        self._first_arrival = dict()  # frame -> time of the first data of the frame
+        self._oldest_accepted_frame = 0
+        self._stats = {sensor_name: _SensorStats() for sensor_name in self.sensor_names}
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    def callback(self, sensor_name):
+        """
+        Returns the function that is passed to sensor.listen for the sensor sensor_name.
+        """
+        return lambda data: self.put(sensor_name, data)
+
+    def put(self, sensor_name, data):
+        arrival = time.perf_counter()
+        frame = data.frame
+        with self._condition:
+            stats = self._stats[sensor_name]
+            if frame < self._oldest_accepted_frame:
+                stats.dropped += 1
+                return
+
+            if frame not in self._frames:
+                self._frames[frame] = dict()
+                self._first_arrival[frame] = arrival
+            latency = arrival - self._first_arrival[frame]
+            stats.received += 1
+            stats.latency_sum += latency
+            stats.latency_max = max(stats.latency_max, latency)
+            self._frames[frame][sensor_name] = data
+
+            while len(self._frames) > self.max_frames:
+                # the data of the sensors does not arrive in frame order, so the oldest frame is searched
+                oldest_frame = min(self._frames)
+                self._oldest_accepted_frame = oldest_frame + 1
+                self._drop_frame(oldest_frame, stale=True)
+            self._condition.notify_all()
+
+    def get_frame(self, frame, timeout=None):
+        """
+        Returns {sensor_name: data} of all sensors for frame. Waits up to timeout seconds (default self.timeout) for
+        missing data, raises SensorSyncTimeout afterwards. The frame and all older frames are removed from the buffer.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        with self._condition:
+            complete = self._condition.wait_for(
+                lambda: len(self._frames.get(frame, ())) == len(self.sensor_names),
+                timeout=timeout,
+            )
+            self.wait_time += time.perf_counter() - start
+            sensor_data = self._frames.get(frame, dict())
+            self._discard_until(frame)
+            if not complete:
+                self.timeouts += 1
+                raise SensorSyncTimeout(frame, self.sensor_names - sensor_data.keys())
+            return sensor_data
+
+    def skip_frame(self, frame):
+        """
+        Discards the data of frame and all older frames without waiting, data that arrives later for these frames is
+        dropped.
+        """
+        with self._condition:
+            self._discard_until(frame)
+
+    def _discard_until(self, frame):
+        self._oldest_accepted_frame = max(self._oldest_accepted_frame, frame + 1)
+        for buffered_frame in [buffered_frame for buffered_frame in self._frames if buffered_frame <= frame]:
+            self._drop_frame(buffered_frame, stale=buffered_frame < frame)
+
+    def _drop_frame(self, frame, stale):
+        sensor_data = self._frames.pop(frame)
+        self._first_arrival.pop(frame, None)
+        if stale:
+            for sensor_name in sensor_data:
+                self._stats[sensor_name].dropped += 1
+
+    @property
+    def buffered_frames(self):
+        with self._condition:
+            return len(self._frames)
+
+    def latency_stats(self):
+        """
+        Returns received and dropped items and the mean and max latency in seconds per sensor.
+        """
+        with self._condition:
+            return {sensor_name: stats.as_dict() for sensor_name, stats in self._stats.items()}
+
+    def log_stats(self):
+        stats = self.latency_stats()
+        dropped = sum(sensor_stats["dropped"] for sensor_stats in stats.values())
+        max_latency = max((sensor_stats["max_latency"] for sensor_stats in stats.values()), default=0.0)
+        logging.info(
+            f"Sensor sync: {dropped} stale items dropped, {self.timeouts} timeouts, "
+            f"max latency {max_latency * 1000:.1f}ms, waited {self.wait_time:.1f}s for sensor data"
+        )
+        for sensor_name, sensor_stats in stats.items():
+            logging.debug(f"Sensor sync {sensor_name}: {sensor_stats}")
+
+# endregion
+# ======================================================================================================================
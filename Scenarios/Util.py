@@ -64,8 +64,8 @@ def get_vehicle_action(scenario_id, frame_id, is_anomaly_vehicle=False):
                 veh_p_c.center_of_mass.z,
             ),
             "steering_curve": (
-                f"{veh_p_c.steering_curve[0].x},{veh_p_c.steering_curve[0].y})",
-                f"({veh_p_c.steering_curve[1].x}/{veh_p_c.steering_curve[1].y}",
+                (veh_p_c.steering_curve[0].x, veh_p_c.steering_curve[0].y),
+                (veh_p_c.steering_curve[1].x, veh_p_c.steering_curve[1].y),
             ),
             "FR_wheel max steer angle": front_right_wheel.max_steer_angle,
             "FL_wheel max steer angle": front_left_wheel.max_steer_angle,
@@ -130,7 +130,7 @@ def get_anomaly_dict(scenario_id, frame_id):
     return anomaly_dict
 
 
-def get_action_state_data(scenario_id, frame_id, scenario_type):
+def get_action_state_data(scenario_id, frame_id, scenario_type, output_path=None):
     action_data_dict = get_vehicle_action(scenario_id, frame_id)
     if scenario_type == "SUDDEN_BREAKING_OF_VEHICLE_AHEAD":
         anomaly_dict = get_vehicle_action(scenario_id, frame_id, True)
@@ -141,6 +141,7 @@ def get_action_state_data(scenario_id, frame_id, scenario_type):
         frame_id,
         action_data_dict,
         anomaly_dict,
+        output_path,
     )
 
     return action_data_object
@@ -266,7 +267,16 @@ def count_different_lanes(ego_vehicle_route, waypoint_ego_vehicle_start):
     return counter
 
 
-def get_valid_route(list_of_spawnpoints):
+def is_valid_route(lane_changes, route_length, same_road):
+    """
+    A route is valid if at most 2 of its first 5 waypoints are in a different lane than the start waypoint, it has at
+    least Definitions.DISTANCE_INTERVAL[1] waypoints and it starts on the road of the start waypoint. Works on single
+    values and on numpy arrays of the route candidate index.
+    """
+    return (lane_changes <= 2) & (route_length >= Definitions.DISTANCE_INTERVAL[1]) & same_road
+
+
+def get_valid_route(list_of_spawnpoints, route_candidates=None):
     """
     This function generates a valid route for the ego vehicle in a simulation environment.
 
@@ -275,7 +285,13 @@ def get_valid_route(list_of_spawnpoints):
     is less than or equal to 2, and the length of the route is greater than or equal to a predefined distance interval, and the road ID of the
     starting waypoint is the same as the road ID of the first waypoint in the route, the function returns the start and end spawnpoints, the route,
     and the starting waypoint. Otherwise, it continues to generate routes until it finds a valid one.
+
+    If a route candidate index (see Scenarios/RouteCandidateIndex.py) is given, the route is drawn from its valid
+    candidates instead.
     """
+    if route_candidates is not None:
+        return route_candidates.draw()
+
     while True:
         ego_start_spawnpoint = random.choice(list_of_spawnpoints)
         ego_end_spawnpoint = random.choice(list_of_spawnpoints)
@@ -289,10 +305,10 @@ def get_valid_route(list_of_spawnpoints):
         waypoint_ego_vehicle_start = World.get_map().get_waypoint(carla.Location(ego_start_spawnpoint.location))
         counter = count_different_lanes(ego_vehicle_route, waypoint_ego_vehicle_start)
 
-        if (
-                counter <= 2
-                and len(ego_vehicle_route) >= Definitions.DISTANCE_INTERVAL[1]
-                and waypoint_ego_vehicle_start.road_id == ego_vehicle_route[0][0].road_id
+        if is_valid_route(
+                counter,
+                len(ego_vehicle_route),
+                waypoint_ego_vehicle_start.road_id == ego_vehicle_route[0][0].road_id,
         ):
             return ego_start_spawnpoint, ego_end_spawnpoint, ego_vehicle_route
 
@@ -0,0 +1,101 @@
+"""Compares the scenario profiles (see DataAnalysis/Profiler.py) of several runs. Every run is a directory that is
+searched for profile.json files, e.g. an output directory Final_Output_<time stamp>. The phases of all scenarios of a
+run are summed up and printed as the mean time per tick, the first run is the baseline of the relative change.
+
+Usage: python compare_profiles.py <run directory> [<run directory> ...]"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Definitions
+
+
+def get_profile_files(run_dir):
+    profile_files = []
+    for root, _, files in os.walk(run_dir):
+        if Definitions.PROFILE_FILE_NAME + ".json" in files:
+            profile_files.append(os.path.join(root, Definitions.PROFILE_FILE_NAME + ".json"))
+    return sorted(profile_files)
+
+
+def summarize_run(run_dir):
+    """
+    Sums the phases and counters of all scenario profiles in run_dir.
+    """
+    summary = {"scenarios": 0, "wall_time": 0.0, "phases": {}, "counters": {}}
+    for profile_file in get_profile_files(run_dir):
+        with open(profile_file) as f:
+            profile = json.load(f)
+        summary["scenarios"] += 1
+        summary["wall_time"] += profile["wall_time"]
+        for name, stats in profile["phases"].items():
+            phase = summary["phases"].setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+            phase["calls"] += stats["calls"]
+            phase["total"] += stats["total"]
+            phase["max"] = max(phase["max"], stats["max"])
+        for name, value in profile["counters"].items():
+            summary["counters"][name] = summary["counters"].get(name, 0) + value
+    return summary
+
+
+def per_tick_ms(summary, name):
+    ticks = summary["counters"].get("ticks", 0)
+    phase = summary["phases"].get(name)
+    if phase is None or not ticks:
+        return None
+    return 1000 * phase["total"] / ticks
+
+
+def format_change(value, baseline):
+    if value is None or baseline is None or baseline == 0:
+        return ""
+    return f"({100 * (value - baseline) / baseline:+.0f}%)"
+
+
+def print_comparison(run_dirs, summaries):
+    names = [os.path.basename(os.path.normpath(run_dir)) for run_dir in run_dirs]
+    width = max(24, *(len(name) + 10 for name in names))
+
+    print(f"{'phase [ms per tick]':<24}" + "".join(f"{name:>{width}}" for name in names))
+    phases = sorted(
+        {phase for summary in summaries for phase in summary["phases"]},
+        key=lambda phase: -(summaries[0]["phases"].get(phase, {}).get("total", 0.0)),
+    )
+    for phase in phases:
+        baseline = per_tick_ms(summaries[0], phase)
+        cells = []
+        for summary in summaries:
+            value = per_tick_ms(summary, phase)
+            cells.append("-" if value is None else f"{value:.2f} {format_change(value, baseline)}".strip())
+        print(f"{phase:<24}" + "".join(f"{cell:>{width}}" for cell in cells))
+
+    print()
+    for key in ("scenarios", "wall_time"):
+        print(f"{key:<24}" + "".join(f"{summary[key]:>{width}.6g}" for summary in summaries))
+    counters = sorted({counter for summary in summaries for counter in summary["counters"]})
+    for counter in counters:
+        print(f"{counter:<24}" + "".join(f"{summary['counters'].get(counter, 0):>{width}}" for summary in summaries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the scenario profiles of several runs.")
+    parser.add_argument("run_dirs", nargs="+", help="Output directories of the runs, the first one is the baseline")
+    args = parser.parse_args()
+
+    for run_dir in args.run_dirs:
+        if not os.path.isdir(run_dir):
+            print(f"Error: {run_dir} does not exist.")
+            return
+
+    summaries = [summarize_run(run_dir) for run_dir in args.run_dirs]
+    for run_dir, summary in zip(args.run_dirs, summaries):
+        if not summary["scenarios"]:
+            print(f"Warning: no profiles found in {run_dir}, set Definitions.PROFILE_SCENARIOS to record them.")
+    print_comparison(args.run_dirs, summaries)
+
+
+if __name__ == "__main__":
+    main()
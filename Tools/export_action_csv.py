@@ -0,0 +1,38 @@
+"""Exports the action logs (see DataAnalysis/ActionLog.py) of all scenarios in a directory to the per-frame ACTION and
+ANOMALY csv files of the previous output layout, for tools that still read them. The csv files are written next to the
+log into the scenario folder, e.g. for an output directory Final_Output_<time stamp>.
+
+Usage: python export_action_csv.py <directory> [<directory> ...]"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataAnalysis.ActionLog import ACTION_LOG_FILE_NAME, export_csv
+
+
+def get_action_log_files(directory):
+    action_log_files = []
+    for root, _, files in os.walk(directory):
+        if ACTION_LOG_FILE_NAME in files:
+            action_log_files.append(os.path.join(root, ACTION_LOG_FILE_NAME))
+    return sorted(action_log_files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports action logs to the per-frame csv files.")
+    parser.add_argument("directories", nargs="+", help="Directories that are searched for action logs")
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        action_log_files = get_action_log_files(directory)
+        if not action_log_files:
+            print(f"No action logs found in {directory}")
+        for action_log_file in action_log_files:
+            written = export_csv(action_log_file)
+            print(f"{action_log_file}: {written} csv files")
+
+
+if __name__ == "__main__":
+    main()
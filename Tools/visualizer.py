@@ -25,6 +25,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from Tools.util import *
+from DataAnalysis.ActionLog import ACTION_LOG_FILE_NAME, ActionLogReader
 from pathlib import Path
 from tqdm import tqdm
 
@@ -151,6 +152,14 @@ def action_path_to_array(action_path):
     values_array.sort(axis=0)
     return values_array
 
+def action_log_to_array(action_log_path):
+    """
+    Returns frame_id, speed, throttle, steer and brake of every frame of an action log, like action_path_to_array
+    """
+    ego_vehicle = ActionLogReader(action_log_path).ego_vehicle
+    return np.stack([ego_vehicle[column].astype(np.float64)
+                     for column in ("frame_id", "speed", "throttle", "steer", "brake")], axis=1)
+
 def img_path_to_array(image_path):
     values_list = []
     itr = list(get_files(image_path))
@@ -278,7 +287,11 @@ def process_data(data_path, render_all, render_p, render_c, render_s, render_v,
 
     # Action Data Processing
     print("\nProcessing action data...")
-    values_array = action_path_to_array(action_path)
+    action_log_path = os.path.join(data_path, ACTION_LOG_FILE_NAME)
+    if os.path.isfile(action_log_path):
+        values_array = action_log_to_array(action_log_path)
+    else:
+        values_array = action_path_to_array(action_path)
     data = {
         "frame_id": values_array[:, 0],
         "speed": values_array[:, 1],
@@ -8,6 +8,7 @@ import open3d as o3d
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from Definitions import VOXEL_RESOLUTION_YC
 from LabelUtils import get_label_attributes
+from Voxelization.VoxelContainer import VoxelGridReader, is_voxel_grid_container
 
 
 def check_file_ending(path):
@@ -32,37 +33,67 @@ def open_npy(file_path):
         # Load voxel data from file
         voxel_data = np.load(file_path)
 
-        # Extract voxel points and colors
-        voxel_points = voxel_data[:, :3]
-        voxel_colors = voxel_data[:, 3:]
+        # Visualize the voxel world
+        show_voxel_grid(voxel_data)
 
-        # Retrieve colors for semantic labels
-        colors = [get_label_color(semantic_label) for semantic_label in voxel_colors]
-        voxel_colors = np.squeeze(colors) / 255.0
+    except Exception as e:
+        # Log error if file cannot be opened
+        logging.error(f"Could not open file: {file_path}", exc_info=True)
 
-        # Create PointCloud object
-        voxel_pcd = o3d.geometry.PointCloud()
-        voxel_pcd.points = o3d.utility.Vector3dVector(voxel_points)
-        voxel_pcd.colors = o3d.utility.Vector3dVector(voxel_colors)
 
-        # Create VoxelGrid from PointCloud
-        voxel_world = o3d.geometry.VoxelGrid.create_from_point_cloud(voxel_pcd, VOXEL_RESOLUTION_YC)
+def open_container(file_path, frame_ids=None):
+    """
+    Visualizes the voxel grids of a voxel grid container one after another. If frame_ids is given, only these frames
+    are shown, otherwise all frames of the container in ascending order.
+    """
+    try:
+        reader = VoxelGridReader(file_path)
+        logging.info(f"Container holds {len(reader)} frames: {reader.frame_ids}")
 
-        # Visualize the voxel world
-        o3d.visualization.draw_geometries([voxel_world])
+        for frame_id in frame_ids if frame_ids else reader.frame_ids:
+            logging.info(f"## Frame {frame_id} ##")
+            show_voxel_grid(reader.read_frame_array(frame_id))
 
     except Exception as e:
         # Log error if file cannot be opened
         logging.error(f"Could not open file: {file_path}", exc_info=True)
 
 
+def show_voxel_grid(voxel_data):
+    # Extract voxel points and colors
+    voxel_points = voxel_data[:, :3]
+    voxel_colors = voxel_data[:, 3:]
+
+    # Retrieve colors for semantic labels
+    colors = [get_label_color(semantic_label) for semantic_label in voxel_colors]
+    voxel_colors = np.squeeze(colors) / 255.0
+
+    # Create PointCloud object
+    voxel_pcd = o3d.geometry.PointCloud()
+    voxel_pcd.points = o3d.utility.Vector3dVector(voxel_points)
+    voxel_pcd.colors = o3d.utility.Vector3dVector(voxel_colors)
+
+    # Create VoxelGrid from PointCloud
+    voxel_world = o3d.geometry.VoxelGrid.create_from_point_cloud(voxel_pcd, VOXEL_RESOLUTION_YC)
+
+    # Visualize the voxel world
+    o3d.visualization.draw_geometries([voxel_world])
+
+
 def get_label_color(label_id):
     # Assuming you have a function to retrieve color for a given label ID
     return get_label_attributes("id", label_id, "color")
 
 
 if __name__ == "__main__":
+    # Usage: python3 voxel_reader.py <file.npy> [<file.npy> ...]
+    #    or: python3 voxel_reader.py <VOXEL_GRID.avox> [<frame id> ...]
     inputs = sys.argv[1:]
+    if inputs and is_voxel_grid_container(inputs[0]):
+        logging.info(f"## Opening {inputs[0]} ##")
+        open_container(inputs[0], [int(frame_id) for frame_id in inputs[1:]])
+        sys.exit(0)
+
     for input in inputs:
         logging.info(f"## Opening {input} ##")
         if check_file_ending(input):
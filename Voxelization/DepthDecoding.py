@@ -0,0 +1,45 @@
+"""This module decodes the 24-bit RGB depth images of the CARLA depth camera into metric depth. The decoding works on
+whole images or stacks of images at once and writes float32 depth, optionally into a preallocated output buffer."""
+import numpy as np
+
+MAX_DEPTH = 1000.0
+"""Depth in meters that corresponds to the largest encodable value of the depth camera."""
+
+DEPTH_SCALE = MAX_DEPTH / (256 * 256 * 256 - 1)
+"""Meters per unit of the 24-bit depth code."""
+
+
+# ======================================================================================================================
+# region -- DEPTH DECODING ---------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def decode_depth_code(depth_img):
+    """
+    Combines the R, G and B channels of a depth image of shape (..., height, width, >=3) into the 24-bit integer
+    depth code R + G * 256 + B * 256 * 256 of shape (..., height, width).
+    """
+    depth_img = np.asarray(depth_img)
+    code = np.left_shift(depth_img[..., 2], 16, dtype=np.uint32)
+    code |= np.left_shift(depth_img[..., 1], 8, dtype=np.uint32)
+    code |= depth_img[..., 0]
+    return code
+
+
+def decode_carla_depth(depth_img, out=None):
+    """
+    Decodes a CARLA depth image of shape (height, width, >=3), or a stack of depth images of shape
+    (frames, height, width, >=3), into metric depth in meters. The RGB channel order is expected, as stored by the
+    data generation. If out is given, the depth is written into it and out is returned, otherwise a new float32 array
+    is allocated.
+    """
+    code = decode_depth_code(depth_img)
+    if out is None:
+        out = np.empty(code.shape, dtype=np.float32)
+    elif out.shape != code.shape:
+        raise ValueError(f"Output buffer of shape {out.shape} does not match depth image of shape {code.shape}")
+
+    # The product is computed in double precision and rounded once when it is written to the output buffer
+    np.multiply(code, DEPTH_SCALE, out=out, casting="same_kind")
+    return out
+
+# endregion
+# ======================================================================================================================
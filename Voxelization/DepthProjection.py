@@ -0,0 +1,80 @@
+"""This module back-projects depth images into point clouds. The per-pixel ray grid of a camera only depends on its
+image size and field of view, so it is computed once per camera configuration and reused for every frame, which turns
+the projection of a whole depth image (or a stack of depth images) into a handful of array operations."""
+from functools import lru_cache
+
+import numpy as np
+
+MAX_DEPTH_RANGE = 100.0
+"""Points further away from the camera than this distance (in meters) are discarded."""
+
+
+# ======================================================================================================================
+# region -- BACK PROJECTION --------------------------------------------------------------------------------------------
+# ======================================================================================================================
+class DepthBackProjector:
+    """
+    Back-projects metric depth images of a pinhole camera into camera space point clouds.
+    """
+
+    def __init__(self, image_width, image_height, camera_fov):
+        self.image_width = image_width
+        self.image_height = image_height
+        self.camera_fov = camera_fov
+
+        # Calculate focal length based on fov
+        self.focal = image_width / (2.0 * np.tan(camera_fov * np.pi / 360.0))
+
+        # Define center of the image
+        cx = image_width / 2.0  # from camera projection matrix
+        cy = image_height / 2.0
+
+        # Pixel offsets from the image center, the ray of pixel (i, j) is ((j - cx) / focal, (i - cy) / focal, 1)
+        self.ray_x = np.broadcast_to(np.arange(image_width) - cx, (image_height, image_width))
+        self.ray_y = np.broadcast_to((np.arange(image_height) - cy)[:, None], (image_height, image_width))
+
+    def project(self, depth, max_range=MAX_DEPTH_RANGE):
+        """
+        Projects a depth image of shape (height, width) or a stack of depth images of shape (frames, height, width)
+        into camera space. Returns the x, y and z coordinates with the same shape as the input and a mask of all
+        points within max_range.
+        """
+        depth = np.asarray(depth)
+        x = self.ray_x * depth / self.focal
+        y = self.ray_y * depth / self.focal
+        z = np.broadcast_to(depth, x.shape)
+
+        in_range = np.sqrt(x * x + y * y + z * z) <= max_range
+        return x, y, z, in_range
+
+    def to_point_cloud(self, depth, labels, max_range=MAX_DEPTH_RANGE):
+        """
+        Converts a depth image and a per-pixel label image of the same size into a point cloud of shape
+        (<number of points>, 4), containing x, y, z and label, respectively. The points are ordered row by row.
+        Stacks of depth and label images are converted into one point cloud per frame.
+        """
+        depth, labels = np.asarray(depth), np.asarray(labels)
+        if depth.ndim == 3:
+            return [self.to_point_cloud(d, l, max_range) for d, l in zip(depth, labels)]
+
+        x, y, z, in_range = self.project(depth, max_range)
+        return np.stack([x[in_range], y[in_range], z[in_range], labels[in_range]], axis=1).astype(np.float64)
+
+
+@lru_cache(maxsize=None)
+def get_back_projector(image_width, image_height, camera_fov):
+    """
+    Returns the back projector for the given camera configuration. Projectors are cached, so the ray grid is only
+    computed once per (image_width, image_height, camera_fov).
+    """
+    return DepthBackProjector(image_width, image_height, camera_fov)
+
+
+def depth_to_point_cloud(depth, labels, image_width, image_height, camera_fov, max_range=MAX_DEPTH_RANGE):
+    """
+    Converts one depth image or a stack of depth images into point clouds, see DepthBackProjector.to_point_cloud.
+    """
+    return get_back_projector(image_width, image_height, camera_fov).to_point_cloud(depth, labels, max_range)
+
+# endregion
+# ======================================================================================================================
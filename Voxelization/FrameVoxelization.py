@@ -0,0 +1,172 @@
+"""This module creates the voxel ground truth of one frame from its sensor data in memory: the relabeled semantic lidar
+point clouds and the depth images back-projected with the semantic labels of all sensor poses are moved into the
+vehicle frame, merged and reduced to a voxel grid. It is shared by the offline voxelization (voxelize_separate.py),
+which loads the sensor data from the written files, and the online voxelization of the data generation
+(DataAnalysis/VoxelGenerator.py), which takes it directly from the frame."""
+import logging
+
+import numpy as np
+import open3d as o3d
+
+from Definitions import (
+    VOXEL_RESOLUTION_YC,
+    VOXEL_SIZE_YC,
+    BEV_OFFSET_FORWARD_YC,
+    BEV_RESOLUTION_YC,
+    OFFSET_Z_YC,
+)
+from EgoVehicleSetup import DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE
+from Tools.LabelUtils import get_label_attributes
+from Voxelization.DepthDecoding import decode_carla_depth
+from Voxelization.DepthProjection import depth_to_point_cloud
+from Voxelization.VoxelReduction import reduce_to_voxels
+
+
+# ======================================================================================================================
+# region -- FRAME VOXELIZATION -----------------------------------------------------------------------------------------
+# ======================================================================================================================
+def voxelize_frame(data, camera_params):
+    """
+    Voxelizes the sensor data of one frame.
+
+    data: {sensor type: {(location, rotation): <numpy.ndarray>}} with the depth images (RGB encoded), the semantic
+        images and the semantic lidar point clouds of all sensor poses, as stored by the data generation.
+    camera_params: {(location, rotation): {'image_width': <int>, 'image_height': <int>, 'camera_fov': <float>}} of the
+        depth cameras.
+
+    Returns the voxel grid as an array of shape (<number of voxels>, 4) containing x, y, z and label.
+    """
+    location_rotations = set()
+    for sensor_type in (DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE):
+        location_rotations.update(data.get(sensor_type, dict()))
+
+    point_clouds = list()
+    for location_rotation in location_rotations:
+        location, rotation = location_rotation
+
+        if data.get(DEPTH_CAM_TYPE) is not None and data[DEPTH_CAM_TYPE].get(location_rotation) is not None \
+                and data.get(SEMANTIC_CAM_TYPE) is not None and data[SEMANTIC_CAM_TYPE].get(
+            location_rotation) is not None:
+            depth_image_point_cloud = depth_to_pcd(
+                depth_img_data=data[DEPTH_CAM_TYPE][location_rotation],
+                semantic_img_data=data[SEMANTIC_CAM_TYPE][location_rotation],
+                image_width=camera_params[location_rotation]['image_width'],
+                image_height=camera_params[location_rotation]['image_height'],
+                camera_fov=camera_params[location_rotation]['camera_fov']
+            )
+        else:
+            depth_image_point_cloud = None
+        if data.get(SEMANTIC_LIDAR_TYPE) is not None and data[SEMANTIC_LIDAR_TYPE].get(location_rotation) is not None:
+            semantic_lidar_point_cloud = data[SEMANTIC_LIDAR_TYPE][location_rotation]
+        else:
+            semantic_lidar_point_cloud = None
+
+        negative_rotation = tuple(-v for v in rotation)
+        for point_cloud in [pc for pc in (depth_image_point_cloud, semantic_lidar_point_cloud) if pc is not None]:
+            point_cloud = rotate_point_cloud(point_cloud=point_cloud, rotation=negative_rotation)
+            for i, v in enumerate(location):
+                point_cloud[:, i] -= v
+            point_clouds.append(point_cloud)
+
+    merged_point_cloud = np.concatenate(point_clouds, axis=0)
+
+    voxel_data = voxelize_one(merged_point_cloud)
+    logging.debug(f"Voxelized {len(merged_point_cloud)} points into {len(voxel_data)} voxels")
+    return voxel_data
+
+
+def rotate_point_cloud(point_cloud, rotation):
+    """
+    point_cloud: <numpy.ndarray> of shape (<number of points>, 4), containg x, y, z and color, respectively.
+    rotation: (<float>, <float>, <float>) containing x, y, and z rotations, respectively, in degrees.
+
+    This function receives a numpy point cloud of shape (<number of points>, 4), and returns, a numpy point cloud
+    of the same shape, with rotated coordinates.
+    """
+
+    # Create a point cloud object and set its points
+    o3d_pcd = o3d.geometry.PointCloud()
+    o3d_pcd.points = o3d.utility.Vector3dVector(point_cloud[:, :-1])
+
+    # Rotate the point cloud to fit with lidar point cloud
+    gradians = tuple(np.pi * (deg / 180) for deg in rotation)
+    r_matrix = o3d_pcd.get_rotation_matrix_from_xyz(gradians)
+    o3d_pcd.rotate(r_matrix, center=(0, 0, 0))
+
+    # Combine the point cloud coordinates and colors into a single array
+    point_cloud = np.concatenate([np.asarray(o3d_pcd.points), np.array(point_cloud[:, -1]).reshape(-1, 1)], axis=1)
+
+    return point_cloud
+
+
+def depth_to_pcd(depth_img_data, semantic_img_data, image_width, image_height, camera_fov):
+    """Converts a depth image into a point cloud. Each point is colored based on the semantic image."""
+
+    # Calculate true depth data
+    true_depth_data = decode_carla_depth(depth_img_data)
+
+    # Back-project all pixels within range at once, the ray grid is cached per camera configuration
+    point_cloud = depth_to_point_cloud(true_depth_data, semantic_img_data, image_width, image_height, camera_fov)
+
+    depth_pcloud = rotate_point_cloud(
+        point_cloud=point_cloud,
+        rotation=(-90, 90, 0)
+    )
+
+    return depth_pcloud
+
+
+def voxelize_one(merged_pcd):
+    """
+    This function takes a merged point cloud and voxelizes it.
+    It first calculates the offsets in the x and z directions.
+    Then, it applies a voxel filter to the merged point cloud.
+    Finally, it concatenates the voxel points and semantics into a single array and returns it.
+    """
+
+    # Calculate the offset in the x direction
+    offset_x = BEV_OFFSET_FORWARD_YC * BEV_RESOLUTION_YC
+
+    # Calculate the offset in the z direction
+    offset_z = OFFSET_Z_YC * VOXEL_RESOLUTION_YC
+
+    # Apply a voxel filter to the merged point cloud
+    voxel_points, semantics = voxel_filter(
+        merged_pcd,  # The merged point cloud
+        VOXEL_RESOLUTION_YC,  # The voxel resolution
+        VOXEL_SIZE_YC,  # The voxel size
+        [offset_x, 0, offset_z],  # The offset
+    )
+
+    # Concatenate the voxel points and semantics into a single array
+    data = np.concatenate([voxel_points, semantics], axis=1)
+
+    # Return the voxelized point cloud data
+    return data
+
+
+def voxel_filter(pcloud, voxel_resolution, voxel_size, offset):
+    """
+    This function applies a voxel filter to a point cloud.
+    Every voxel gets the label of the point closest to its center, unless one of its points is a road line.
+    The reduction is done for all voxels at once, see Voxelization.VoxelReduction.
+    """
+    # Define the road index
+    road_idx = get_label_attributes("color", (157, 234, 50), "id")
+
+    # Reduce the labels of all points in a voxel to a single label
+    voxels, semantics = reduce_to_voxels(
+        pcloud[:, :3],
+        pcloud[:, -1],
+        voxel_resolution,
+        voxel_size,
+        offset,
+        reduction="centerpoint",
+        priority_label=road_idx,
+    )
+
+    # Return the voxelized point cloud data
+    return voxels, semantics.astype(np.uint8).reshape(-1, 1)
+
+# endregion
+# ======================================================================================================================
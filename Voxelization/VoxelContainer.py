@@ -0,0 +1,435 @@
+"""This module stores all voxel grids of a scenario in one container file instead of one npy file per frame. Every
+frame is stored as its sorted linear voxel indices, delta encoded, followed by the voxel values (labels or scores), and
+both streams are compressed with zlib. An index of all frames at the end of the file gives random access to every frame
+without reading the others, and the file is read through a memory map.
+
+File layout:
+    header      magic, length of the json metadata, json metadata (grid size, dtypes, compression, ground truth
+                version)
+    records     one record per frame: record header, index stream, value stream
+    index       (frame id, record offset) of the latest record of every frame
+    trailer     offset of the index, number of frames, magic
+
+Records are self-describing, so a container that was not closed properly (no index and trailer) is recovered by
+scanning the records, and a container can be reopened to append more frames. If a frame is written again, the latest
+record wins, close() rewrites the container without the superseded records once they make up more than
+COMPACTION_THRESHOLD of all records."""
+import json
+import os
+import time
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+VOXEL_GRID_CONTAINER_FILE_ENDING = ".avox"
+VOXEL_GRID_CONTAINER_FILE_NAME = "VOXEL_GRID" + VOXEL_GRID_CONTAINER_FILE_ENDING
+"""Name of the container holding all voxel grids of a scenario, stored in the scenario folder."""
+
+FORMAT_VERSION = 1
+COMPRESSIONS = ("zlib", None)
+
+COMPACTION_THRESHOLD = 0.25
+"""Share of the record bytes of superseded frames above which a container is compacted when the writer is closed."""
+
+_HEADER_MAGIC = b"AVOXGRID"
+_RECORD_MAGIC = b"AVFR"
+_TRAILER_MAGIC = b"AVOXEND\x00"
+_HEADER_LENGTH_DTYPE = np.dtype("<u4")
+_RECORD_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("frame_id", "<i8"),
+    ("timestamp", "<f8"),
+    ("count", "<u8"),
+    ("index_nbytes", "<u8"),
+    ("value_nbytes", "<u8"),
+])
+_INDEX_DTYPE = np.dtype([("frame_id", "<i8"), ("offset", "<u8")])
+_TRAILER_DTYPE = np.dtype([("index_offset", "<u8"), ("frame_count", "<u8"), ("magic", "S8")])
+
+
+# ======================================================================================================================
+# region -- ENCODING ---------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def get_index_dtype(grid_size):
+    """
+    Returns the smallest unsigned dtype that can hold every linear voxel index (and thus every delta) of the grid.
+    """
+    return np.dtype("<u4") if int(np.prod(grid_size, dtype=np.uint64)) <= 2 ** 32 else np.dtype("<u8")
+
+
+def voxels_to_linear_indices(voxels, grid_size):
+    """
+    Converts voxel coordinates of shape (<number of voxels>, 3) into linear indices x + y * dx + z * dx * dy, the same
+    order Voxelization.VoxelReduction sorts its voxels by.
+    """
+    voxels = np.asarray(voxels).astype(np.int64)
+    dx, dy, _ = grid_size
+    return voxels[:, 0] + voxels[:, 1] * dx + voxels[:, 2] * (dx * dy)
+
+
+def linear_indices_to_voxels(linear_indices, grid_size):
+    """
+    Inverse of voxels_to_linear_indices, returns uint16 voxel coordinates of shape (<number of voxels>, 3).
+    """
+    dx, dy, _ = grid_size
+    z, rest = np.divmod(linear_indices, dx * dy)
+    y, x = np.divmod(rest, dx)
+    return np.stack([x, y, z], axis=1).astype(np.uint16)
+
+
+def delta_encode(sorted_indices, dtype):
+    """
+    Stores the first index and the differences between consecutive indices. Occupied voxels cluster, so most deltas
+    are small and the stream compresses well.
+    """
+    deltas = np.empty(sorted_indices.shape, dtype=dtype)
+    if sorted_indices.size:
+        deltas[0] = sorted_indices[0]
+        np.subtract(sorted_indices[1:], sorted_indices[:-1], out=deltas[1:], casting="unsafe")
+    return deltas
+
+
+def delta_decode(deltas):
+    return np.cumsum(deltas, dtype=np.int64)
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- CONTAINER FILE ---------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def _read_header(buffer):
+    """
+    Parses the file header. Returns the metadata dict and the offset of the first record.
+    """
+    magic_end = len(_HEADER_MAGIC)
+    length_end = magic_end + _HEADER_LENGTH_DTYPE.itemsize
+    if len(buffer) < length_end or bytes(buffer[:magic_end]) != _HEADER_MAGIC:
+        raise ValueError("Not a voxel grid container")
+    metadata_length = int(np.frombuffer(buffer[magic_end:length_end], dtype=_HEADER_LENGTH_DTYPE)[0])
+    metadata = json.loads(bytes(buffer[length_end:length_end + metadata_length]).decode("utf-8"))
+    if metadata["version"] > FORMAT_VERSION:
+        raise ValueError(f"Voxel grid container version {metadata['version']} is not supported")
+    return metadata, length_end + metadata_length
+
+
+def get_ground_truth_version(metadata):
+    """
+    Returns the ground truth version of a container header, containers written before it was stored are version 1.
+    """
+    return metadata.get("ground_truth_version", 1)
+
+
+def _read_record(buffer, offset):
+    return np.frombuffer(buffer[offset:offset + _RECORD_DTYPE.itemsize], dtype=_RECORD_DTYPE)[0]
+
+
+def _record_nbytes(record):
+    return _RECORD_DTYPE.itemsize + int(record["index_nbytes"]) + int(record["value_nbytes"])
+
+
+def _write_index(file, offsets):
+    """
+    Writes the frame index and the trailer at the current position of file.
+    """
+    frame_ids = sorted(offsets)
+    index = np.zeros(len(frame_ids), dtype=_INDEX_DTYPE)
+    index["frame_id"] = frame_ids
+    index["offset"] = [offsets[frame_id] for frame_id in frame_ids]
+    trailer = np.zeros(1, dtype=_TRAILER_DTYPE)
+    trailer["index_offset"] = file.tell()
+    trailer["frame_count"] = len(frame_ids)
+    trailer["magic"] = _TRAILER_MAGIC
+    file.write(index.tobytes())
+    file.write(trailer.tobytes())
+
+
+def _read_frame_offsets(buffer, data_start):
+    """
+    Returns {frame id: record offset} and the end of the last complete record. The index at the end of the file is
+    used if the container was closed properly, otherwise the records are scanned.
+    """
+    size = len(buffer)
+    if size >= data_start + _TRAILER_DTYPE.itemsize:
+        trailer = np.frombuffer(buffer[size - _TRAILER_DTYPE.itemsize:], dtype=_TRAILER_DTYPE)[0]
+        if trailer["magic"] == _TRAILER_MAGIC:
+            index_offset = int(trailer["index_offset"])
+            index_end = index_offset + int(trailer["frame_count"]) * _INDEX_DTYPE.itemsize
+            index = np.frombuffer(buffer[index_offset:index_end], dtype=_INDEX_DTYPE)
+            return dict(zip(index["frame_id"].tolist(), index["offset"].tolist())), index_offset
+
+    offsets = dict()
+    offset = data_start
+    while offset + _RECORD_DTYPE.itemsize <= size:
+        record = _read_record(buffer, offset)
+        record_end = offset + _record_nbytes(record)
+        if record["magic"] != _RECORD_MAGIC or record_end > size:
+            # Partially written record of an interrupted run
+            break
+        offsets[int(record["frame_id"])] = offset
+        offset = record_end
+    return offsets, offset
+
+
+class VoxelGridWriter:
+    """
+    Writes the voxel grids of a scenario into a container file. If the file already exists, it is opened for appending
+    and must have been created with the same grid size, value dtype, compression and ground truth version (see
+    Definitions.VOXEL_GROUND_TRUTH_VERSION), only its header, frame index and record headers are read. The writer is
+    meant to be used by a single process, use it as a context manager or call close() to write the frame index.
+    """
+
+    def __init__(self, path, grid_size, value_dtype=np.uint8, compression="zlib", voxel_resolution=None,
+                 ground_truth_version=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, choose one of {COMPRESSIONS}")
+        self.path = path
+        self.grid_size = tuple(int(v) for v in grid_size)
+        self.value_dtype = np.dtype(value_dtype).newbyteorder("<")
+        self.index_dtype = get_index_dtype(self.grid_size)
+        self.compression = compression
+        metadata = {
+            "version": FORMAT_VERSION,
+            "grid_size": list(self.grid_size),
+            "voxel_resolution": voxel_resolution,
+            "index_dtype": self.index_dtype.str,
+            "value_dtype": self.value_dtype.str,
+            "compression": compression,
+            "ground_truth_version": ground_truth_version,
+        }
+
+        self._offsets, self._timestamps, self._nbytes = dict(), dict(), dict()
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            # The file is memory mapped, so only the pages of the header, the index and the record headers are read
+            buffer = np.memmap(path, dtype=np.uint8, mode="r")
+            existing, self._data_start = _read_header(buffer)
+            for key in ("grid_size", "value_dtype", "compression"):
+                if existing[key] != metadata[key]:
+                    raise ValueError(f"Cannot append to {path}: {key} is {existing[key]}, expected {metadata[key]}")
+            if get_ground_truth_version(existing) != ground_truth_version:
+                raise ValueError(
+                    f"Cannot append to {path}: ground truth version is {get_ground_truth_version(existing)}, "
+                    f"expected {ground_truth_version}"
+                )
+            self._offsets, data_end = _read_frame_offsets(buffer, self._data_start)
+            for frame_id, offset in self._offsets.items():
+                record = _read_record(buffer, offset)
+                self._timestamps[frame_id] = float(record["timestamp"])
+                self._nbytes[frame_id] = _record_nbytes(record)
+            del buffer
+            # records of frames that were written again before
+            self._superseded_nbytes = data_end - self._data_start - sum(self._nbytes.values())
+
+            # Drop the old index (or a partially written record), it is rewritten on close
+            self._file = open(path, "r+b")
+            self._file.truncate(data_end)
+            self._file.seek(data_end)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            metadata_bytes = json.dumps(metadata).encode("utf-8")
+            self._file = open(path, "w+b")  # read again by _compact
+            self._file.write(_HEADER_MAGIC)
+            self._file.write(np.array(len(metadata_bytes), dtype=_HEADER_LENGTH_DTYPE).tobytes())
+            self._file.write(metadata_bytes)
+            self._data_start = self._file.tell()
+            self._superseded_nbytes = 0
+
+    @property
+    def frame_ids(self):
+        return sorted(self._offsets)
+
+    def frame_timestamp(self, frame_id):
+        """Time at which the frame was written, as returned by time.time()."""
+        return self._timestamps[int(frame_id)]
+
+    def __contains__(self, frame_id):
+        return int(frame_id) in self._offsets
+
+    def write_frame(self, frame_id, voxels, values):
+        """
+        Appends the voxel grid of a frame. voxels are the voxel coordinates of shape (<number of voxels>, 3) and values
+        the label or score of every voxel. The voxels do not need to be sorted.
+        """
+        values = np.asarray(values).reshape(-1)
+        linear_indices = voxels_to_linear_indices(voxels, self.grid_size)
+        if linear_indices.size != values.size:
+            raise ValueError(f"Got {linear_indices.size} voxels but {values.size} values")
+        if linear_indices.size > 1 and (np.diff(linear_indices) < 0).any():
+            order = np.argsort(linear_indices, kind="stable")
+            linear_indices, values = linear_indices[order], values[order]
+
+        index_bytes = delta_encode(linear_indices, self.index_dtype).tobytes()
+        value_bytes = values.astype(self.value_dtype).tobytes()
+        if self.compression == "zlib":
+            index_bytes, value_bytes = zlib.compress(index_bytes), zlib.compress(value_bytes)
+
+        record = np.zeros(1, dtype=_RECORD_DTYPE)
+        record["magic"] = _RECORD_MAGIC
+        record["frame_id"] = int(frame_id)
+        record["timestamp"] = time.time()
+        record["count"] = linear_indices.size
+        record["index_nbytes"] = len(index_bytes)
+        record["value_nbytes"] = len(value_bytes)
+
+        offset = self._file.tell()
+        self._file.write(record.tobytes())
+        self._file.write(index_bytes)
+        self._file.write(value_bytes)
+        self._file.flush()
+        self._superseded_nbytes += self._nbytes.get(int(frame_id), 0)
+        self._offsets[int(frame_id)] = offset
+        self._timestamps[int(frame_id)] = float(record["timestamp"][0])
+        self._nbytes[int(frame_id)] = _record_nbytes(record[0])
+
+    def write_frame_array(self, frame_id, voxel_data):
+        """
+        Appends a voxel grid in the layout of the per-frame npy files, an array of shape (<number of voxels>, 4)
+        containing x, y, z and value.
+        """
+        voxel_data = np.asarray(voxel_data)
+        self.write_frame(frame_id, voxel_data[:, :3], voxel_data[:, 3])
+
+    def close(self):
+        if self._file.closed:
+            return
+        records_nbytes = self._file.tell() - self._data_start
+        if self._superseded_nbytes > COMPACTION_THRESHOLD * records_nbytes:
+            self._compact()
+            return
+        _write_index(self._file, self._offsets)
+        self._file.close()
+
+    def _compact(self):
+        """
+        Replaces the container by a copy with only the latest record of every frame, in ascending frame order.
+        """
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        offsets = dict()
+        with open(temp_path, "wb") as f:
+            self._file.seek(0)
+            f.write(self._file.read(self._data_start))
+            for frame_id in self.frame_ids:
+                self._file.seek(self._offsets[frame_id])
+                offsets[frame_id] = f.tell()
+                f.write(self._file.read(self._nbytes[frame_id]))
+            _write_index(f, offsets)
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._offsets = offsets
+        self._superseded_nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class VoxelGridReader:
+    """
+    Reads voxel grids from a container file. The file is memory mapped, so opening a container only reads its header
+    and frame index, and reading a frame only touches the bytes of that frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        metadata, data_start = _read_header(self._buffer)
+        self.grid_size = tuple(metadata["grid_size"])
+        self.voxel_resolution = metadata["voxel_resolution"]
+        self.index_dtype = np.dtype(metadata["index_dtype"])
+        self.value_dtype = np.dtype(metadata["value_dtype"])
+        self.compression = metadata["compression"]
+        self.ground_truth_version = get_ground_truth_version(metadata)
+        self._offsets, _ = _read_frame_offsets(self._buffer, data_start)
+        self.frame_ids = sorted(self._offsets)
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def __contains__(self, frame_id):
+        return int(frame_id) in self._offsets
+
+    def __iter__(self):
+        """Yields (frame id, voxel grid array) for all frames in ascending frame order."""
+        for frame_id in self.frame_ids:
+            yield frame_id, self.read_frame_array(frame_id)
+
+    def _record(self, frame_id):
+        offset = self._offsets[int(frame_id)]
+        return offset + _RECORD_DTYPE.itemsize, _read_record(self._buffer, offset)
+
+    def frame_timestamp(self, frame_id):
+        """Time at which the frame was written, as returned by time.time()."""
+        return float(self._record(frame_id)[1]["timestamp"])
+
+    def read_frame(self, frame_id):
+        """
+        Returns the voxel coordinates of shape (<number of voxels>, 3) as uint16, sorted by their linear index, and the
+        voxel values of shape (<number of voxels>,) of a frame. Raises a KeyError if the frame is not in the container.
+        """
+        start, record = self._record(frame_id)
+        value_start = start + int(record["index_nbytes"])
+        index_stream = self._buffer[start:value_start]
+        value_stream = self._buffer[value_start:value_start + int(record["value_nbytes"])]
+        if self.compression == "zlib":
+            index_stream, value_stream = zlib.decompress(index_stream), zlib.decompress(value_stream)
+
+        linear_indices = delta_decode(np.frombuffer(index_stream, dtype=self.index_dtype))
+        values = np.frombuffer(value_stream, dtype=self.value_dtype)
+        return linear_indices_to_voxels(linear_indices, self.grid_size), values
+
+    def read_frame_array(self, frame_id):
+        """
+        Returns the voxel grid of a frame in the layout of the per-frame npy files, an array of shape
+        (<number of voxels>, 4) containing x, y, z and value.
+        """
+        voxels, values = self.read_frame(frame_id)
+        return np.concatenate([voxels, values.reshape(-1, 1)], axis=1)
+
+# endregion
+# ======================================================================================================================
+
+
+# ======================================================================================================================
+# region -- LOADING ----------------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def is_voxel_grid_container(path):
+    return isinstance(path, str) and path.endswith(VOXEL_GRID_CONTAINER_FILE_ENDING)
+
+
+@lru_cache(maxsize=32)
+def _open_cached_voxel_grid_container(path, modification_time, size):
+    return VoxelGridReader(path)
+
+
+def open_voxel_grid_container(path):
+    """
+    Returns a reader for the container, readers are cached so a container is only opened once when many of its frames
+    are loaded one after another. A container that was written since it was opened is opened again.
+    """
+    stat = os.stat(path)
+    return _open_cached_voxel_grid_container(path, stat.st_mtime_ns, stat.st_size)
+
+
+def list_voxel_grids(path):
+    """
+    Returns references to all voxel grids of a container, (container path, frame id) in ascending frame order.
+    """
+    return [(path, frame_id) for frame_id in open_voxel_grid_container(path).frame_ids]
+
+
+def load_voxel_grid(voxel_grid):
+    """
+    Loads a voxel grid as an array of shape (<number of voxels>, 4) containing x, y, z and value. voxel_grid is either
+    the path of a per-frame npy file or a (container path, frame id) reference as returned by list_voxel_grids.
+    """
+    if isinstance(voxel_grid, tuple):
+        container_path, frame_id = voxel_grid
+        return open_voxel_grid_container(container_path).read_frame_array(frame_id)
+    return np.load(voxel_grid)
+
+# endregion
+# ======================================================================================================================
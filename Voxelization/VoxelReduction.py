@@ -0,0 +1,87 @@
+"""This module reduces labeled or scored point clouds to voxel grids. All points are grouped by their voxel with one
+sort, and the value of every occupied voxel is computed with grouped numpy reductions instead of a loop over voxels.
+It is shared by the ground truth voxelization and the voxelization of anomaly scores in the benchmark."""
+import numpy as np
+
+REDUCTIONS = ("centerpoint", "mean", "median", "max")
+"""Supported ways to reduce the values of all points within one voxel to a single voxel value."""
+
+
+# ======================================================================================================================
+# region -- VOXEL REDUCTION --------------------------------------------------------------------------------------------
+# ======================================================================================================================
+def reduce_to_voxels(
+        points,
+        values,
+        voxel_resolution,
+        voxel_size,
+        offset,
+        reduction="centerpoint",
+        priority_label=None
+):
+    """
+    Voxelizes a point cloud.
+
+    points: <numpy.ndarray> of shape (<number of points>, 3) containing x, y and z.
+    values: <numpy.ndarray> of shape (<number of points>,) containing a label or score for every point.
+    voxel_size: number of voxels in x, y and z direction. The grid is centered around the origin shifted by offset.
+    reduction: how the value of a voxel is computed from its points, one of REDUCTIONS. "centerpoint" takes the value
+        of the point closest to the voxel origin, ties are resolved by point order.
+    priority_label: if given, every voxel containing at least one point with this value gets this value (used to keep
+        thin road lines visible in the grid).
+
+    Returns the voxel coordinates of shape (<number of voxels>, 3) as uint16, sorted by their linear index, and the
+    voxel values of shape (<number of voxels>,).
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction {reduction}, choose one of {REDUCTIONS}")
+
+    points = np.asarray(points)[:, :3]
+    values = np.asarray(values).reshape(-1)
+
+    # Shift the point cloud into the positive grid range and drop points outside the grid
+    voxel_size = np.asarray(voxel_size)
+    offset = np.asarray(offset, dtype=np.float64) + voxel_resolution * voxel_size / 2
+    points = points + offset
+    in_grid = ((0 <= points) & (points < voxel_size * voxel_resolution)).all(axis=1)
+    points, values = points[in_grid], values[in_grid]
+
+    # Compute the voxel and the linear voxel index for every point
+    hxyz, hmod = np.divmod(points, voxel_resolution)
+    hxyz = hxyz.astype(np.int64)
+    dx, dy, _ = voxel_size
+    h = hxyz[:, 0] + hxyz[:, 1] * dx + hxyz[:, 2] * dx * dy
+
+    # Sort by voxel and, within a voxel, by the distance to the voxel origin. The first point of every group is then
+    # the point closest to the voxel origin.
+    distance = np.sum(hmod ** 2, axis=1)
+    order = np.lexsort((distance, h))
+    h_sorted = h[order]
+    if h_sorted.size == 0:
+        return np.zeros((0, 3), dtype=np.uint16), values[:0]
+    starts = np.flatnonzero(np.concatenate(([True], h_sorted[1:] != h_sorted[:-1])))
+
+    closest = order[starts]
+    voxels = hxyz[closest].astype(np.uint16)
+
+    if reduction == "centerpoint":
+        voxel_values = values[closest]
+    elif reduction == "mean":
+        counts = np.diff(np.append(starts, h_sorted.size))
+        voxel_values = np.add.reduceat(values[order].astype(np.float64), starts) / counts
+    elif reduction == "max":
+        voxel_values = np.maximum.reduceat(values[order], starts)
+    else:
+        # Sort by voxel and value, the median is the middle value (or the mean of the two middle values) of every group
+        counts = np.diff(np.append(starts, h_sorted.size))
+        sorted_values = values[np.lexsort((values, h))].astype(np.float64)
+        voxel_values = (sorted_values[starts + (counts - 1) // 2] + sorted_values[starts + counts // 2]) / 2
+
+    if priority_label is not None:
+        has_priority_label = np.logical_or.reduceat(values[order] == priority_label, starts)
+        voxel_values[has_priority_label] = priority_label
+
+    return voxels, voxel_values
+
+# endregion
+# ======================================================================================================================
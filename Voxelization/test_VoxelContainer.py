@@ -0,0 +1,155 @@
+"""Tests of the voxel grid container: round trip, appending, overwriting frames and recovering unclosed containers."""
+import os
+
+import numpy as np
+import pytest
+
+from Voxelization.VoxelContainer import (
+    VoxelGridReader,
+    VoxelGridWriter,
+    list_voxel_grids,
+    load_voxel_grid,
+    open_voxel_grid_container,
+)
+
+GRID_SIZE = (50, 40, 10)
+
+
+def random_voxel_grid(rng, count=200):
+    """Unique voxels in random order with random labels, as a (<number of voxels>, 4) array."""
+    linear_indices = rng.choice(int(np.prod(GRID_SIZE)), size=count, replace=False)
+    z, rest = np.divmod(linear_indices, GRID_SIZE[0] * GRID_SIZE[1])
+    y, x = np.divmod(rest, GRID_SIZE[0])
+    labels = rng.integers(0, 30, size=count)
+    return np.stack([x, y, z, labels], axis=1).astype(np.uint16)
+
+
+def sort_voxel_grid(voxel_grid):
+    order = np.lexsort((voxel_grid[:, 0], voxel_grid[:, 1], voxel_grid[:, 2]))
+    return voxel_grid[order]
+
+
+@pytest.mark.parametrize("compression", ["zlib", None])
+def test_round_trip(tmp_path, compression):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    voxel_grids = {frame_id: random_voxel_grid(rng) for frame_id in (7, 3, 12)}
+    voxel_grids[5] = np.zeros((0, 4), dtype=np.uint16)
+    with VoxelGridWriter(path, GRID_SIZE, compression=compression, voxel_resolution=0.5) as writer:
+        for frame_id, voxel_grid in voxel_grids.items():
+            writer.write_frame_array(frame_id, voxel_grid)
+
+    reader = VoxelGridReader(path)
+    assert reader.frame_ids == [3, 5, 7, 12]
+    assert reader.grid_size == GRID_SIZE
+    assert reader.voxel_resolution == 0.5
+    for frame_id, voxel_grid in voxel_grids.items():
+        np.testing.assert_array_equal(reader.read_frame_array(frame_id), sort_voxel_grid(voxel_grid))
+    assert list_voxel_grids(path) == [(path, 3), (path, 5), (path, 7), (path, 12)]
+    np.testing.assert_array_equal(load_voxel_grid((path, 7)), sort_voxel_grid(voxel_grids[7]))
+
+
+def test_append(tmp_path):
+    rng = np.random.default_rng(1)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    first, second = random_voxel_grid(rng), random_voxel_grid(rng)
+    with VoxelGridWriter(path, GRID_SIZE) as writer:
+        writer.write_frame_array(1, first)
+    timestamp = VoxelGridReader(path).frame_timestamp(1)
+
+    with VoxelGridWriter(path, GRID_SIZE) as writer:
+        assert 1 in writer
+        assert writer.frame_timestamp(1) == timestamp
+        writer.write_frame_array(2, second)
+
+    reader = VoxelGridReader(path)
+    assert reader.frame_ids == [1, 2]
+    assert reader.frame_timestamp(1) == timestamp
+    np.testing.assert_array_equal(reader.read_frame_array(1), sort_voxel_grid(first))
+    np.testing.assert_array_equal(reader.read_frame_array(2), sort_voxel_grid(second))
+
+    with pytest.raises(ValueError):
+        VoxelGridWriter(path, GRID_SIZE, value_dtype=np.float64)
+
+
+def test_overwrite_does_not_grow_the_container(tmp_path):
+    rng = np.random.default_rng(2)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    voxel_grids = {frame_id: random_voxel_grid(rng) for frame_id in range(4)}
+    with VoxelGridWriter(path, GRID_SIZE) as writer:
+        for frame_id, voxel_grid in voxel_grids.items():
+            writer.write_frame_array(frame_id, voxel_grid)
+    size = os.path.getsize(path)
+
+    for _ in range(10):
+        with VoxelGridWriter(path, GRID_SIZE) as writer:
+            for frame_id in voxel_grids:
+                voxel_grids[frame_id] = random_voxel_grid(rng)
+                writer.write_frame_array(frame_id, voxel_grids[frame_id])
+        # the records are compressed, so equally large frames differ a little in size
+        assert os.path.getsize(path) < 1.5 * size
+
+    reader = VoxelGridReader(path)
+    assert reader.frame_ids == list(voxel_grids)
+    for frame_id, voxel_grid in voxel_grids.items():
+        np.testing.assert_array_equal(reader.read_frame_array(frame_id), sort_voxel_grid(voxel_grid))
+
+
+def test_unclosed_container_is_recovered(tmp_path):
+    rng = np.random.default_rng(3)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    voxel_grid = random_voxel_grid(rng)
+    writer = VoxelGridWriter(path, GRID_SIZE)
+    writer.write_frame_array(4, voxel_grid)
+    writer._file.write(b"AVFR partial record")
+    writer._file.close()
+
+    np.testing.assert_array_equal(VoxelGridReader(path).read_frame_array(4), sort_voxel_grid(voxel_grid))
+    with VoxelGridWriter(path, GRID_SIZE) as writer:
+        writer.write_frame_array(5, voxel_grid)
+    assert VoxelGridReader(path).frame_ids == [4, 5]
+
+
+def test_cached_reader_sees_new_frames(tmp_path):
+    rng = np.random.default_rng(4)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    with VoxelGridWriter(path, GRID_SIZE) as writer:
+        writer.write_frame_array(1, random_voxel_grid(rng))
+    assert open_voxel_grid_container(path).frame_ids == [1]
+
+    with VoxelGridWriter(path, GRID_SIZE) as writer:
+        writer.write_frame_array(2, random_voxel_grid(rng))
+    assert open_voxel_grid_container(path).frame_ids == [1, 2]
+
+
+def test_ground_truth_version(tmp_path):
+    rng = np.random.default_rng(5)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    with VoxelGridWriter(path, GRID_SIZE, ground_truth_version=2) as writer:
+        writer.write_frame_array(1, random_voxel_grid(rng))
+    assert VoxelGridReader(path).ground_truth_version == 2
+
+    # grids of different ground truth versions are never mixed in one container
+    with pytest.raises(ValueError):
+        VoxelGridWriter(path, GRID_SIZE, ground_truth_version=3)
+    with VoxelGridWriter(path, GRID_SIZE, ground_truth_version=2) as writer:
+        writer.write_frame_array(2, random_voxel_grid(rng))
+    assert VoxelGridReader(path).frame_ids == [1, 2]
+
+
+def test_containers_without_ground_truth_version_are_version_1(tmp_path):
+    rng = np.random.default_rng(6)
+    path = str(tmp_path / "VOXEL_GRID.avox")
+    with VoxelGridWriter(path, GRID_SIZE, ground_truth_version=1) as writer:
+        writer.write_frame_array(1, random_voxel_grid(rng))
+    # rewrite the header as containers were written before the version was stored
+    with open(path, "rb") as f:
+        content = f.read()
+    old_content = content.replace(b', "ground_truth_version": 1}', b'}' + b' ' * len(', "ground_truth_version": 1'))
+    assert old_content != content
+    with open(path, "wb") as f:
+        f.write(old_content)
+
+    assert VoxelGridReader(path).ground_truth_version == 1
+    with pytest.raises(ValueError):
+        VoxelGridWriter(path, GRID_SIZE, ground_truth_version=2)
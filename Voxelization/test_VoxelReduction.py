@@ -0,0 +1,100 @@
+"""Tests of the grouped voxel reduction against a loop over the voxels of a point cloud."""
+import numpy as np
+import pytest
+
+from Voxelization.VoxelReduction import REDUCTIONS, reduce_to_voxels
+
+VOXEL_RESOLUTION = 0.5
+VOXEL_SIZE = (8, 6, 4)
+OFFSET = (0.3, -0.2, 1.0)
+
+
+def reduce_to_voxels_loop(points, values, reduction, priority_label=None):
+    """Reference implementation: collects the points of every voxel and reduces them one voxel at a time."""
+    voxel_size = np.asarray(VOXEL_SIZE)
+    shifted = np.asarray(points, dtype=np.float64) + np.asarray(OFFSET) + VOXEL_RESOLUTION * voxel_size / 2
+    voxels = dict()
+    for point, value in zip(shifted, values):
+        if not ((0 <= point) & (point < voxel_size * VOXEL_RESOLUTION)).all():
+            continue
+        voxel, remainder = np.divmod(point, VOXEL_RESOLUTION)
+        voxels.setdefault(tuple(voxel.astype(int)), []).append((np.sum(remainder ** 2), value))
+
+    result = dict()
+    for voxel, voxel_points in voxels.items():
+        voxel_values = np.array([value for _, value in voxel_points])
+        if reduction == "centerpoint":
+            # the first of the closest points, min returns the first minimum
+            value = min(voxel_points, key=lambda point: point[0])[1]
+        elif reduction == "mean":
+            value = voxel_values.astype(np.float64).mean()
+        elif reduction == "median":
+            value = np.median(voxel_values.astype(np.float64))
+        else:
+            value = voxel_values.max()
+        if priority_label is not None and (voxel_values == priority_label).any():
+            value = priority_label
+        result[voxel] = value
+    return result
+
+
+def random_point_cloud(rng, count=3000):
+    points = rng.uniform(-3, 3, size=(count, 3))
+    # duplicate points make ties of the centerpoint reduction
+    points[::7] = points[1::7][:len(points[::7])]
+    return points
+
+
+@pytest.mark.parametrize("reduction", REDUCTIONS)
+def test_matches_loop(reduction):
+    rng = np.random.default_rng(0)
+    points = random_point_cloud(rng)
+    labels = rng.integers(0, 25, size=len(points))
+
+    voxels, voxel_values = reduce_to_voxels(points, labels, VOXEL_RESOLUTION, VOXEL_SIZE, OFFSET, reduction)
+    expected = reduce_to_voxels_loop(points, labels, reduction)
+
+    assert voxels.dtype == np.uint16
+    assert len(voxels) == len(expected)
+    for voxel, value in zip(map(tuple, voxels.tolist()), voxel_values):
+        assert value == pytest.approx(expected[voxel])
+
+
+def test_voxels_are_sorted_by_linear_index():
+    rng = np.random.default_rng(1)
+    points = random_point_cloud(rng)
+    voxels, _ = reduce_to_voxels(points, rng.random(len(points)), VOXEL_RESOLUTION, VOXEL_SIZE, OFFSET, "max")
+
+    dx, dy, _ = VOXEL_SIZE
+    linear_indices = voxels[:, 0].astype(np.int64) + voxels[:, 1] * dx + voxels[:, 2].astype(np.int64) * dx * dy
+    assert (np.diff(linear_indices) > 0).all()
+
+
+def test_priority_label():
+    rng = np.random.default_rng(2)
+    points = random_point_cloud(rng)
+    labels = rng.integers(0, 25, size=len(points))
+
+    voxels, voxel_values = reduce_to_voxels(
+        points, labels, VOXEL_RESOLUTION, VOXEL_SIZE, OFFSET, "centerpoint", priority_label=24
+    )
+    expected = reduce_to_voxels_loop(points, labels, "centerpoint", priority_label=24)
+
+    assert (voxel_values == 24).any()
+    for voxel, value in zip(map(tuple, voxels.tolist()), voxel_values):
+        assert value == expected[voxel]
+
+
+def test_empty_and_out_of_grid_point_clouds():
+    far_away = np.full((10, 3), 100.0)
+    for points in (np.zeros((0, 3)), far_away):
+        voxels, voxel_values = reduce_to_voxels(
+            points, np.ones(len(points)), VOXEL_RESOLUTION, VOXEL_SIZE, OFFSET, "mean"
+        )
+        assert voxels.shape == (0, 3)
+        assert voxel_values.shape == (0,)
+
+
+def test_unknown_reduction():
+    with pytest.raises(ValueError):
+        reduce_to_voxels(np.zeros((1, 3)), np.zeros(1), VOXEL_RESOLUTION, VOXEL_SIZE, OFFSET, "min")
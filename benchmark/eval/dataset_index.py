@@ -0,0 +1,295 @@
+"""""
+Index of an AnoVox dataset. For every scenario and frame it stores the paths of the ground truth files, if the anomaly
+is detectable in the semantic image and point cloud and how many anomalous pixels, points and voxels there are, and the
+anomaly attributes of every scenario. The evaluation scripts used to open every semantic file up front only to find out
+whether the anomaly is visible; the index computes this once per dataset and stores it in the dataset root. Every
+entry remembers the modification time and size of its source files, entries of changed files are computed again.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from DataAnalysis.ActionLog import ACTION_LOG_FILE_NAME, read_anomaly_attributes as read_action_log_attributes
+from Voxelization.VoxelContainer import (
+    VOXEL_GRID_CONTAINER_FILE_ENDING,
+    VOXEL_GRID_CONTAINER_FILE_NAME,
+    list_voxel_grids,
+    load_voxel_grid,
+)
+
+INDEX_FILE_NAME = "anovox_index.json"
+INDEX_VERSION = 1
+ANOMALY_COLOR = [245, 0, 0]
+
+# folder of the ground truth files of every indexed data type in a scenario
+SOURCES = {
+    "image": "SEMANTIC_IMG",
+    "pointcloud": "SEMANTIC_PCD",
+    "voxel_grid": "VOXEL_GRID",
+}
+
+
+def anomaly_pixels(semantic_image):
+    image_array = np.array(Image.open(semantic_image))[:, :, :3]
+    return int((image_array == ANOMALY_COLOR).all(-1).sum())
+
+
+def anomaly_points(semantic_pcd):
+    import open3d as o3d # only needed to index point clouds
+    pcd = o3d.io.read_point_cloud(semantic_pcd)
+    score_colors = (np.asarray(pcd.colors) * 255.0).astype(np.uint16)
+    return int((score_colors == ANOMALY_COLOR).all(-1).sum())
+
+
+def anomaly_voxels(voxel_grid):
+    anomaly_mask, _ = metrics.mask_anomaly_voxels(load_voxel_grid(voxel_grid)[:, -1])
+    return int(np.count_nonzero(anomaly_mask))
+
+
+ANOMALY_COUNTERS = {
+    "image": anomaly_pixels,
+    "pointcloud": anomaly_points,
+    "voxel_grid": anomaly_voxels,
+}
+
+# counting the anomalous voxels loads every voxel grid of the dataset and no evaluation reads the count, voxel grids are
+# only indexed by path unless their count is requested
+COUNTED_DATA_TYPES = ("image", "pointcloud")
+
+
+def frame_number(file_name):
+    return int(os.path.basename(file_name).split('.')[0].split('_')[-1])
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def anomaly_attributes_source(scenario_root):
+    """""the file the anomaly attributes of a scenario are read from: its action log or its first ANOMALY csv file"""
+    action_log_path = os.path.join(scenario_root, ACTION_LOG_FILE_NAME)
+    if os.path.isfile(action_log_path):
+        return action_log_path
+    csv_path = os.path.join(scenario_root, "ANOMALY")
+    csv_files = sorted(os.listdir(csv_path)) if os.path.isdir(csv_path) else []
+    return os.path.join(csv_path, csv_files[0]) if csv_files else None
+
+
+def read_anomaly_attributes(scenario_root):
+    """""
+    anomaly_type_id and size of the anomaly of a scenario. All csv files of a scenario describe the same anomaly, the
+    first one is read so the attributes do not change between runs. CSV File in AnoVox is sideways. Scenarios with an
+    action log are read from the log instead
+    """
+    source = anomaly_attributes_source(scenario_root)
+    if source is None:
+        return {}
+    if os.path.basename(source) == ACTION_LOG_FILE_NAME:
+        return read_action_log_attributes(source)
+    attributes = {}
+    with open(source) as csv_file:
+        reader = csv.reader(csv_file, delimiter=';')
+        for attribute in reader:
+            if attribute[0][:-1] == "anomaly_type_id":
+                attributes["anomaly_type_id"] = attribute[1][1:]
+            elif attribute[0][:-1] == "size":
+                attributes["size"] = attribute[1][1:]
+    return attributes
+
+
+def _count_anomalies(task):
+    scenario, frame, data_type, source = task
+    return scenario, frame, data_type, ANOMALY_COUNTERS[data_type](source)
+
+
+class DatasetIndex:
+    """""
+    index of the dataset in root, stored in <root>/anovox_index.json (or index_path). Paths in the index are relative to
+    the dataset root, so the dataset can be moved without invalidating the index.
+
+    frames: scenario -> frame -> {"<data type>": relative path, "<data type>_stat": [mtime, size],
+                                  "<data type>_anomalies": count, "<data type>_detectable": bool}
+    the anomaly count and detectability are only stored for the counted data types, see update
+    voxel grids in a container are stored as "<container path>:<frame id>"
+    """
+    def __init__(self, root, index_path=None):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path or os.path.join(self.root, INDEX_FILE_NAME)
+        self.scenarios = {} # scenario -> {"attributes": dict, "attributes_stat": list}
+        self.frames = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+        except ValueError:
+            print("Index {} is broken, building it again".format(self.index_path))
+            return
+        if index.get("version") != INDEX_VERSION:
+            return
+        self.scenarios = index["scenarios"]
+        self.frames = {scenario: {int(frame): entry for frame, entry in frames.items()}
+                       for scenario, frames in index["frames"].items()}
+
+    def save(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w') as index_file:
+            json.dump({"version": INDEX_VERSION, "scenarios": self.scenarios, "frames": self.frames}, index_file)
+        os.replace(temp_path, self.index_path) # an interrupted save keeps the previous index
+
+    def _scan_sources(self, scenario, data_type):
+        """""(frame, relative path, absolute source) of all files of data_type in the scenario"""
+        scenario_root = os.path.join(self.root, scenario)
+        if data_type == "voxel_grid":
+            container_path = os.path.join(scenario_root, VOXEL_GRID_CONTAINER_FILE_NAME)
+            if os.path.isfile(container_path):
+                relative_path = os.path.relpath(container_path, self.root)
+                return [(voxel_grid[1], "{}:{}".format(relative_path, voxel_grid[1]), voxel_grid)
+                        for voxel_grid in list_voxel_grids(container_path)]
+        source_dir = os.path.join(scenario_root, SOURCES[data_type])
+        if not os.path.isdir(source_dir):
+            return []
+        return [(frame_number(file_name), os.path.join(scenario, SOURCES[data_type], file_name),
+                 os.path.join(source_dir, file_name)) for file_name in os.listdir(source_dir)]
+
+    def update(self, data_types=("image", "pointcloud", "voxel_grid"), workers=1, counted_types=COUNTED_DATA_TYPES):
+        """""
+        adds new scenarios and frames of data_types to the index and removes deleted ones. The anomalies of the files of
+        counted_types are counted when they are new or changed since they were indexed, the files of other data types
+        are only indexed by path. Returns the number of files that were (re)counted
+        """
+        scenarios = sorted(
+            scenario for scenario in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, scenario)) and scenario != 'Scenario_Configuration_Files'
+        )
+        tasks = []
+        changed = False
+        for scenario in set(self.frames) | set(self.scenarios):
+            if scenario not in scenarios:
+                self.frames.pop(scenario, None)
+                self.scenarios.pop(scenario, None)
+                changed = True
+
+        for scenario in scenarios:
+            # the directory mtime does not change when a file in it is rewritten, the read file itself is compared
+            attributes_source = anomaly_attributes_source(os.path.join(self.root, scenario))
+            attributes_stat = file_stat(attributes_source) if attributes_source else None
+            if scenario not in self.scenarios or self.scenarios[scenario]["attributes_stat"] != attributes_stat:
+                self.scenarios[scenario] = {
+                    "attributes": read_anomaly_attributes(os.path.join(self.root, scenario)),
+                    "attributes_stat": attributes_stat,
+                }
+                changed = True
+
+            frames = self.frames.setdefault(scenario, {})
+            for data_type in data_types:
+                sources = self._scan_sources(scenario, data_type)
+                found = {frame for frame, _, _ in sources}
+                for frame, entry in frames.items():
+                    if frame not in found and data_type in entry:
+                        for key in ("", "_stat", "_anomalies", "_detectable"):
+                            entry.pop(data_type + key, None)
+                        changed = True
+                source_stats = {}
+                for frame, relative_path, source in sources:
+                    stat_path = source[0] if isinstance(source, tuple) else source
+                    if stat_path not in source_stats:
+                        source_stats[stat_path] = file_stat(stat_path)
+                    stat = source_stats[stat_path]
+                    entry = frames.setdefault(frame, {})
+                    counted = data_type in counted_types
+                    if entry.get(data_type + "_stat") == stat and (not counted or data_type + "_anomalies" in entry):
+                        continue
+                    entry[data_type] = relative_path
+                    entry[data_type + "_stat"] = stat
+                    if counted:
+                        tasks.append((scenario, frame, data_type, source))
+                    else:
+                        # a count of the previous file would be stale
+                        entry.pop(data_type + "_anomalies", None)
+                        entry.pop(data_type + "_detectable", None)
+                        changed = True
+            for frame in [frame for frame, entry in frames.items() if not any(key in entry for key in SOURCES)]:
+                del frames[frame]
+                changed = True
+
+        if tasks:
+            print("Indexing {} files of {}".format(len(tasks), self.root))
+            if workers > 1:
+                with multiprocessing.Pool(workers) as pool:
+                    counts = list(pool.imap_unordered(_count_anomalies, tasks, chunksize=16))
+            else:
+                counts = map(_count_anomalies, tasks)
+            for scenario, frame, data_type, count in counts:
+                entry = self.frames[scenario][frame]
+                entry[data_type + "_anomalies"] = count
+                entry[data_type + "_detectable"] = count > 0
+        if tasks or changed:
+            self.save()
+        return len(tasks)
+
+    def path(self, relative_path):
+        """""absolute path of an indexed file, or (container path, frame id) reference of a voxel grid in a container"""
+        if VOXEL_GRID_CONTAINER_FILE_ENDING + ':' in relative_path:
+            container_path, frame_id = relative_path.rsplit(':', 1)
+            return os.path.join(self.root, container_path), int(frame_id)
+        return os.path.join(self.root, relative_path)
+
+    def entries(self, data_type):
+        """""(scenario, frame, entry) of all frames that have data_type, sorted by frame"""
+        entries = [(scenario, frame, entry) for scenario, frames in self.frames.items()
+                   for frame, entry in frames.items() if data_type in entry]
+        return sorted(entries, key=lambda item: item[1])
+
+    def attributes(self):
+        return {scenario: data["attributes"] for scenario, data in self.scenarios.items()}
+
+
+def load_dataset_index(root, data_types, workers=1, index_path=None, counted_types=COUNTED_DATA_TYPES):
+    """""index of the dataset in root, brought up to date for data_types, the anomalies of counted_types are counted"""
+    index = DatasetIndex(root, index_path)
+    index.update(data_types, workers, counted_types)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the index of an AnoVox dataset')
+    parser.add_argument('--anovox_datapath', type=str,
+                        help=""""path to anovox root""")
+    parser.add_argument('--data_types', nargs='+', default=list(SOURCES), choices=list(SOURCES),
+                        help=""""data types whose anomalies are counted""")
+    parser.add_argument('--index_path', type=str, default=None,
+                        help=""""where the index is stored, default <anovox root>/{}""".format(INDEX_FILE_NAME))
+    parser.add_argument('--rebuild', action='store_true',
+                        help=""""discard the stored index and build it from scratch""")
+    parser.add_argument('--workers', type=int, default=1,
+                        help=""""number of processes that count anomalies in parallel""")
+    parser.add_argument('--count_voxels', action='store_true',
+                        help=""""also count the anomalous voxels of every voxel grid, this loads all voxel grids""")
+    args = parser.parse_args()
+
+    index_path = args.index_path or os.path.join(args.anovox_datapath, INDEX_FILE_NAME)
+    if args.rebuild and os.path.exists(index_path):
+        os.remove(index_path)
+    counted_types = COUNTED_DATA_TYPES + (("voxel_grid",) if args.count_voxels else ())
+    index = load_dataset_index(args.anovox_datapath, args.data_types, args.workers, index_path, counted_types)
+    for data_type in args.data_types:
+        entries = index.entries(data_type)
+        if data_type not in counted_types:
+            print("{}: {} frames".format(data_type, len(entries)))
+            continue
+        detectable = sum(entry[data_type + "_detectable"] for _, _, entry in entries)
+        print("{}: {} frames, anomaly detectable in {}".format(data_type, len(entries), detectable))
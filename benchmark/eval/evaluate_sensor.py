@@ -1,4 +1,5 @@
 import metrics
+from dataset_index import ACTION_LOG_FILE_NAME, load_dataset_index, read_action_log_attributes
 import csv
 import numpy as np
 import yaml
@@ -8,6 +9,8 @@ from tqdm import tqdm
 from time import sleep
 from PIL import Image
 import argparse
+import functools
+import multiprocessing
 import os
 import shutil
 from pathlib import Path
@@ -23,6 +26,9 @@ class Evaluator:
         pass
 
 def get_anomaly_attributes(scenario_root): # find name of object and size. CSV File in AnoVox is sideways TODO: output attributes from args
+    action_log_path = os.path.join(scenario_root, ACTION_LOG_FILE_NAME)
+    if os.path.isfile(action_log_path):
+        return read_action_log_attributes(action_log_path)
     csv_path = os.path.join(scenario_root, "ANOMALY")
     anomaly_csv = random.choice(os.listdir(csv_path))
     attributes = {}
@@ -102,55 +108,24 @@ def collect_voxel_data(pred_dir, gts_dir, data_type):
     return pred_grids, gt_grids, scenario_dict
 
 
-def collect_sensor_data(pred_dir, gts_dir, data_type):
+def collect_sensor_data(pred_dir, gts_dir, data_type, workers=1):
     def sorter(file_path):
-        if isinstance(file_path, tuple):
-            file_path = file_path[0]
         identifier = (os.path.basename(file_path).split('.')[0]).split('_')[-1]
         return int(identifier)
 
-    gt_files = []
-
-    datatype_ids = {
-        'image': 'SEMANTIC_IMG',
-        'pointcloud': 'SEMANTIC_PCD'
-    }
-
-    scenario_dict = defaultdict(dict)
-    for scenario in os.listdir(gts_dir):
-        if scenario == 'Scenario_Configuration_Files':
-            continue
-        data_dir = os.path.join(gts_dir, scenario, datatype_ids[data_type])
-        for sensor_data in os.listdir(data_dir):
-            file_path = os.path.join(data_dir, sensor_data)
-            if data_type == 'image':
-                anomaly_found = anomaly_detectable_for_camera(file_path)
-            elif data_type == 'pointcloud':
-                anomaly_found = anomaly_detectable_for_lidar(file_path)
-
-            gt_files.append((file_path, anomaly_found))
-
-        # csv_path = os.path.join(gts_root, scenario, 'ANOMALY')
-        attributes = get_anomaly_attributes(os.path.join(gts_dir, scenario))
-        scenario_dict[scenario] = attributes
-
-        # img_dir = os.path.join(gts_root, scenario, 'SEMANTIC_IMG')
-        # for semantic_img in img_dir:
-        #     images.append(os.path.join(img_dir, semantic_img))
-
+    # detectability, ground truth paths and anomaly attributes are read from the dataset index, only files that are new
+    # or changed since the last run are opened
+    index = load_dataset_index(gts_dir, [data_type], workers)
+    gt_files = [
+        (index.path(entry[data_type]), entry[data_type + "_detectable"])
+        for _, _, entry in index.entries(data_type)
+    ]
+    scenario_dict = defaultdict(dict, index.attributes())
 
-
-    gt_files.sort(key=sorter)
     pred_root = pred_dir
     pred_files = [os.path.join(pred_root, pred_file) for pred_file in os.listdir(pred_root)]
     pred_files.sort(key=sorter)
 
-    # images.sort(key=sorter)
-    # def find_anomalies(images): # mark all frames in which anomaly can be seen through camera
-    #     has_anomaly = []
-    #     for image in images:
-    #         img_array = np.array(Image.open(image))
-    #         anomaly_included = np.isin(img_array, [245,0,0])
     return pred_files, gt_files, scenario_dict
 
 
@@ -221,6 +196,55 @@ def create_size_detection_dict(anomaly_size_dict):
     return yaml_dict
 
 
+def evaluate_frame(frame, args):
+    """scores and labels of one frame (prediction file, ground truth file, anomaly in view)"""
+    pred_file, gt_file, anomaly_detectable = frame
+
+    if args.datatype == 'image':
+        preds_i = np.load(pred_file).squeeze()
+        preds_i = preds_i.reshape(-1,)
+        labels = np.array(Image.open(gt_file))
+        gts_i = np.zeros((labels.shape), dtype=np.uint8)[:,:,:1]
+        gts_i = np.squeeze(gts_i)
+        anomaly_mask = (labels[:, :,None] == args.anomaly_color_code).all(-1).any(-1)
+        gts_i[anomaly_mask] = 1
+        gts_i = gts_i.reshape(-1,)
+
+    elif args.datatype == 'pointcloud':
+
+        preds_i = np.load(pred_file)
+        pcd_labels = o3d.io.read_point_cloud(gt_file).colors
+        pcd_labels = (np.asarray(pcd_labels) * 255.0).astype(np.uint8) # convert open3d color scale [0-1] to [0-255]
+        gts_i = np.zeros((pcd_labels.shape), dtype=np.uint8)[:,0]
+        anomaly_mask = (pcd_labels == args.anomaly_color_code).all(axis=1)
+        gts_i[anomaly_mask] = 1
+
+    return preds_i, gts_i, anomaly_detectable
+
+
+def evaluate_frames(frames, scenario_dict, args):
+    """accumulates the scores of all frames into one streaming evaluator"""
+    evaluator = metrics.StreamingEvaluator(bins=args.histogram_bins, score_range=args.score_range)
+    for frame in frames:
+        preds_i, gts_i, detectable = evaluate_frame(frame, args)
+        scenario = os.path.normpath(frame[1]).split(os.sep)[-3]
+        evaluator.update(preds_i, gts_i, detectable=detectable, anomaly_size=scenario_dict[scenario]["size"])
+    return evaluator
+
+
+def evaluate_frames_parallel(frames, scenario_dict, args):
+    """evaluates chunks of frames in a process pool and merges the partial histograms of the chunks"""
+    chunk_size = max(1, min(args.chunk_size, int(np.ceil(len(frames) / args.workers))))
+    chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+    evaluate_chunk = functools.partial(evaluate_frames, scenario_dict=dict(scenario_dict), args=args)
+
+    evaluator = metrics.StreamingEvaluator(bins=args.histogram_bins, score_range=args.score_range)
+    with multiprocessing.Pool(args.workers) as pool:
+        for partial_evaluator in tqdm(pool.imap_unordered(evaluate_chunk, chunks), total=len(chunks)):
+            evaluator.merge(partial_evaluator) # histogram counts add up, the order of the chunks does not matter
+    return evaluator
+
+
 def main(args):
     voxelpred_dir, anovox_dir, datatype =  args.predictions, args.anovox_datapath, args.datatype
 
@@ -228,138 +252,32 @@ def main(args):
     # faster evaluation with already intersected grids from anovox
 
 
-    pred_grids, gt_grids, scenario_dict = collect_sensor_data(voxelpred_dir, anovox_dir, args.datatype)
+    pred_grids, gt_grids, scenario_dict = collect_sensor_data(voxelpred_dir, anovox_dir, args.datatype, args.workers)
 
 
     gt_grids, anomaly_in_view = [x[0] for x in gt_grids], [y[1] for y in gt_grids]
     assert len(pred_grids) == len(gt_grids), "amount of predictions and ground truth files not matching"
 
     # results_dict = initialize_results_dict(scenario_dict.keys())
-    scenario_data = initialize_results_dict(scenario_dict)
-    # total_preds = []
-    # total_labels = []
-    for i, pred_grid in enumerate(tqdm(pred_grids)):
-        # debug
-        # if i < 50:
-        #     continue
-        # if i > 5:
-        #     break
-        # debug end
-        # pred_grid = pred_grids[i]
-        anomaly_detectable = anomaly_in_view[i]
-        gt_grid = gt_grids[i]
-
-        if args.datatype == 'image':
-            preds_i = np.load(pred_grid).squeeze()
-            preds_i = preds_i.reshape(-1,)
-            labels = np.array(Image.open(gt_grid))
-            gts_i = np.zeros((labels.shape), dtype=np.uint8)[:,:,:1]
-            gts_i = np.squeeze(gts_i)
-            anomaly_mask = (labels[:, :,None] == args.anomaly_color_code).all(-1).any(-1)
-            gts_i[anomaly_mask] = 1
-            gts_i = gts_i.reshape(-1,)
-
-        elif args.datatype == 'pointcloud':
-
-            preds_i = np.load(pred_grid)
-            pcd_labels = o3d.io.read_point_cloud(gt_grid).colors
-            pcd_labels = (np.asarray(pcd_labels) * 255.0).astype(np.uint8) # convert open3d color scale [0-1] to [0-255]
-            gts_i = np.zeros((pcd_labels.shape), dtype=np.uint8)[:,0]
-            anomaly_mask = (pcd_labels == args.anomaly_color_code).all(axis=1)
-            gts_i[anomaly_mask] = 1
-
-        # intersection
-        # if args.intersect_grids:
-
-        # preds_i, gts_i, anomaly_in_voxel_grid = metrics.intersect_grids(pred_grid, gt_grid, front_only=(args.datatype=='image'), return_anomaly_detectable=True)
-
-        # else:
-        #     print(pred_grid)
-        #     intersected_gt_grid = os.path.join(args.gt_grids_dir, intersected_gt_grids[i])
-        #     preds_i, gts_i = np.load(pred_grid), np.load(intersected_gt_grid)
-        #     preds_i = preds_i[:,-1:]
-        #     assert preds_i.size == gts_i.size, "intersected ground truth voxel grid does not match size of prediction voxel grid"
-
-        # preds_i = np.load("pred_bin{}.npy".format(str(i)))
-        # gts_i = np.load("gt_bin{}.npy".format(str(i)))
-
-
-        # intersected grid already here
-
-        scenario_path = os.path.normpath(gt_grid)
-        scenario_path = scenario_path.split(os.sep)
-        scenario = scenario_path[-3]
-        # anomaly_attributes = scenario_dict[scenario]
-        # scenario_dataframe = scenario_data[scenario]
-        # scenario_dataframe.preds_total.append(preds_i)
-        # scenario_dataframe.gts_total.append(gts_i)
-        # scenario_dataframe.anormal_frame.append(anomaly_detectable)
-        # print(scenario_data[scenario])
-        scenario_data[scenario].preds_total.append(preds_i)
-        scenario_data[scenario].gts_total.append(gts_i)
-        scenario_data[scenario].anormal_frame.append(anomaly_detectable) # anomaly must be viewable in data type and labeled as anomaly in voxel grid
-
-        # yaml_dict[scenario] = compute_scenario_yaml_dict(scenario_data[scenario])
-
-        # scenario_dataframe.preds_anomaly.append(preds)
-        # scenario_dataframe.gts_anomaly.append(gts)
-        # scores = np.concatenate([[preds],[gts]], axis= 1)
-        # total_scores = np.concatenate(total_scores, scores, axis=1)
-        # results_dict[scenario]["results"] = np.concatenate(results_dict[scenario]["results"], scores, axis=1)
-
-        # if anomaly_included: # append to results_anomaly array if
-        #     results_dict[scenario]["results_anomaly"] = np.concatenate(results_dict[scenario]["results_anomaly"], scores, axis=1)
-
-
-        # scenario_dict = results_dict[scenario]
-
-        # results_dict[scenario] = {"results": results, "anomaly_attributes": anomaly_attributes}
-        # if anomaly_included:
-        #     results_dict[scenario]["results_anomaly"]
+    # scores are accumulated frame by frame into fixed size histograms, memory does not grow with the dataset
+    frames = list(zip(pred_grids, gt_grids, anomaly_in_view))
+    if args.workers > 1:
+        evaluator = evaluate_frames_parallel(frames, scenario_dict, args)
+    else:
+        evaluator = evaluate_frames(tqdm(frames), scenario_dict, args)
+
 # dict_results, anomaly_attributes, dict_results_anomaly = destructure_dict(scenario_dict, "results", "anomaly_attributes", "results_anomaly")
     # yaml_dict = initialize_yaml_dict()
-    anomaly_size_dict = initialize_anomaly_size_dict()
-    total_dict = defaultdict(list)
-
-
-    for scenario in scenario_data.keys():
-        scenario_i = scenario_data[scenario]
-        anomaly_size = scenario_i.anomaly_attributes["size"]
-        detectable_frames = scenario_i.anormal_frame
-        for i, anormal_frame in enumerate(detectable_frames):
-            if anormal_frame:
-                preds_array = np.array(scenario_i.preds_total[i])# .squeeze()
-                gts_array = np.array(scenario_i.gts_total[i])# .squeeze()
-                anomaly_size_dict[anomaly_size]["preds"].extend(preds_array)
-                anomaly_size_dict[anomaly_size]["gts"].extend(gts_array)
-                total_dict["detectable_preds"].extend(preds_array)
-                total_dict["detectable_gts"].extend(gts_array)
-
-        # preds_total = np.array(scenario_i.preds_total)
-        # gts_total = np.array(scenario_i.gts_total)
-        preds_total = [pred for val_arr in scenario_i.preds_total for pred in val_arr]
-        gts_total = [label for gt_arr in scenario_i.gts_total for label in gt_arr]
-
-        total_dict["total_preds"].extend(preds_total)
-        total_dict["total_gts"].extend(gts_total)
-
     if args.store_final_values:
         value_folder = args.output_file + "_values"
         if os.path.exists(value_folder):
             shutil.rmtree(value_folder)
-        os.mkdir(value_folder)
-        for key in total_dict.keys():
-            value_list = total_dict[key]
-            np.save(os.path.join(value_folder, key), value_list)
+        evaluator.save(value_folder)
 
 
-    print("anomaly voxels in all voxel grids:", np.count_nonzero(total_dict["total_gts"]))
-    print("all voxels in total:", len(total_dict["total_gts"]))
-    yaml_dict = dict(
-        Normality_Included = metrics.compute_metrics(total_dict["total_preds"], total_dict["total_gts"]),
-        Anomalies_Only = metrics.compute_metrics(total_dict["detectable_preds"], total_dict["detectable_gts"]),
-        Detection_Results_by_Anomaly_Size = create_size_detection_dict(anomaly_size_dict)
-    )
+    print("anomaly voxels in all voxel grids:", int(evaluator.total.anomalous.sum()))
+    print("all voxels in total:", len(evaluator.total))
+    yaml_dict = evaluator.results()
 
     results_dir = "results"
     if not os.path.exists(results_dir):
@@ -386,7 +304,17 @@ if __name__ == "__main__":
     parser.add_argument('--anovox_datapath', type=str, #default='<...>/Anomaly_Datasets/AnoVox',
                         help=""""path to anovox root""")
     parser.add_argument('--store_final_values', action='store_true',
-        help=""""store the final arrays with prediction and ground truth values to be evaluated. For testing purposes""")
+        help=""""store the final score histograms of anomalous and normal voxels that are evaluated. For testing purposes""")
+    parser.add_argument('--histogram_bins', type=int, default=metrics.HISTOGRAM_BINS,
+        help=""""number of score histogram bins, metrics are exact up to the bin width (score range / histogram_bins)
+        if all scores are in the score range""")
+    parser.add_argument('--score_range', type=float, nargs=2, default=metrics.HISTOGRAM_RANGE, metavar=('LOW', 'HIGH'),
+        help=""""range of the anomaly scores of the predictions, e.g. of unnormalized logits or energies. Scores outside
+        of it are counted in the first or last histogram bin and reported with a warning""")
+    parser.add_argument('--workers', type=int, default=1,
+        help=""""number of processes that index the dataset and load and score frames in parallel""")
+    parser.add_argument('--chunk_size', type=int, default=64,
+        help=""""maximum number of frames a worker scores before its partial histograms are merged""")
 
     parser.add_argument('--output_file', type=str, default='results')
 
@@ -1,7 +1,13 @@
 import numpy as np
-from sklearn.metrics import roc_curve, auc, average_precision_score, f1_score, confusion_matrix, precision_score, recall_score, precision_recall_curve
 # import open3d as o3d
+from collections import namedtuple
 import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Voxelization.VoxelContainer import load_voxel_grid
 
 gt_path = "<...>/Anomaly_Datasets/AnoVox/Scenario_911ef0ea-bec9-4f78-aa3b-a3b83ef07319/VOXEL_GRID/VOXEL_GRID_413.npy"
 pred_path = "<...>/RbA/voxelpreds/voxelarray_score_0000000011.npy"
@@ -50,72 +56,96 @@ COLOR_PALETTE = (
 )
 
 
-# DOUBLECHECKING
+# VOXEL GRID JOIN
+
+UNMATCHED_VOXELS = ("drop", "keep_gt", "keep_pred", "keep_all")
+
+
+def voxel_keys(voxels, grid_size):
+    """""
+    linear int64 key x + y * dx + z * dx * dy of every voxel coordinate, voxel coordinates may be stored as floats
+    """
+    voxels = np.rint(voxels).astype(np.int64)
+    dx, dy = np.int64(grid_size[0]), np.int64(grid_size[1])
+    return voxels[:, 0] + voxels[:, 1] * dx + voxels[:, 2] * (dx * dy)
+
 
-def mask_intersect_new(preds, gts):
+def voxelgrid_join(preds, gts, unmatched="drop", fill_score=0.0, fill_label=0):
+    """""
+    joins the voxels of a prediction grid and a ground truth grid (both <number of voxels> x 4 arrays of coordinates and
+    value) on their coordinates. The coordinates are encoded as linear keys and the prediction keys are looked up in the
+    sorted ground truth keys, O((N+M) log M) instead of comparing all voxel pairs.
+
+    returns the aligned prediction scores, ground truth labels and voxel coordinates. matched voxels are in the order of
+    the predictions. unmatched controls voxels that are only in one of the grids:
+        drop:       only voxels in both grids (intersection)
+        keep_gt:    ground truth voxels without prediction are added with score fill_score
+        keep_pred:  predicted voxels without ground truth are added with label fill_label
+        keep_all:   both
+    """
+    if unmatched not in UNMATCHED_VOXELS:
+        raise ValueError("unmatched must be one of {}, not {}".format(UNMATCHED_VOXELS, unmatched))
+    pred_voxels, pred_scores = preds[:, :3], preds[:, -1]
+    gt_voxels, gt_labels = gts[:, :3], gts[:, -1]
+
+    grid_size = np.rint(np.max([pred_voxels.max(0, initial=0), gt_voxels.max(0, initial=0)], axis=0)) + 1
+    pred_keys, gt_keys = voxel_keys(pred_voxels, grid_size), voxel_keys(gt_voxels, grid_size)
+
+    # first occurrence of every ground truth voxel, like the pairwise comparison did
+    gt_keys_sorted, gt_first = np.unique(gt_keys, return_index=True)
+    if len(gt_keys_sorted):
+        positions = np.minimum(np.searchsorted(gt_keys_sorted, pred_keys), len(gt_keys_sorted) - 1)
+        pred_matched = gt_keys_sorted[positions] == pred_keys
+        gt_index = gt_first[positions]
+    else:
+        pred_matched = np.zeros(len(pred_keys), dtype=bool)
+        gt_index = np.zeros(len(pred_keys), dtype=np.int64)
+
+    if unmatched in ("keep_pred", "keep_all"):
+        scores = pred_scores
+        labels = np.full(len(pred_keys), fill_label, dtype=gt_labels.dtype)
+        labels[pred_matched] = gt_labels[gt_index[pred_matched]]
+        voxels = pred_voxels
+    else:
+        scores = pred_scores[pred_matched]
+        labels = gt_labels[gt_index[pred_matched]]
+        voxels = pred_voxels[pred_matched]
+
+    if unmatched in ("keep_gt", "keep_all"):
+        gt_unmatched = ~np.isin(gt_keys, pred_keys)
+        scores = np.concatenate([scores, np.full(np.count_nonzero(gt_unmatched), fill_score, dtype=scores.dtype)])
+        labels = np.concatenate([labels, gt_labels[gt_unmatched]])
+        voxels = np.concatenate([voxels, gt_voxels[gt_unmatched]])
+
+    return scores, labels, voxels
+
+
+def mask_intersect_new(preds, gts, unmatched="drop"):
     """""
     double check method whether voxels are fed into the evaluation script in the same order
     edit: Results did not change when testing on individual voxel grids but slightly did when testing on the entire benchmark. This approach definitely keeps the correct order of voxels
     """
-    # preds_, gts_ = voxelgrid_intersect(preds, gts)
-    preds_scores, gts_scores = voxelgrid_intersect_new(preds, gts)
-    preds_scores, gts_scores = np.array(preds_scores), np.array(gts_scores)
-
-    # preds_scores, gts_scores = preds_[:,-1:], gts_[:,-1:]
-    # preds_scores, gts_scores = np.squeeze(preds_scores), np.squeeze(gts_scores)
+    preds_scores, gts_scores = voxelgrid_intersect_new(preds, gts, unmatched)
 
     ood_mask, ind_mask = mask_anomaly_voxels(gts_scores)
     val_label = np.zeros((len(gts_scores),))
     val_label[ood_mask] = 1
     val_out = np.array(preds_scores)
-    # ood_out = preds_scores[ood_mask]
-    # ind_out = preds_scores[ind_mask]
-
-    # ood_label = np.ones(len(ood_out))
-    # ind_label = np.zeros(len(ind_out))
-
-    # val_out = np.concatenate((ind_out, ood_out))
-    # val_label = np.concatenate((ind_label, ood_label))
 
     return val_out, val_label
 
-def voxelgrid_intersect_new(preds,gts):
-    gt_labels = gts[:,-1:].astype(np.float64) # to match pred voxels and values
-    gt_voxels = gts[:,:3].astype(np.float64)
-
-    pred_scores = preds[:,-1:]
-    pred_voxels = preds[:,:3] #.astype(np.uint16)
-
-    # size, dim = gt_voxels.shape
-
-    intersect_indices = np.where((gt_voxels==pred_voxels[:,None]).all(-1))[1]
-
-    intersect_grid = gt_voxels[intersect_indices]
-    intersect_labels = []# np.c_[intersect_grid, np.zeros((intersect_grid.shape[0],1))]
-    intersect_preds = []# np.copy(intersect_labels)
-
-    for i, coordinate in enumerate(intersect_grid):
-        pred_voxel_index = np.where((np.isclose(pred_voxels, coordinate)).all(axis=1))[0]
-        if pred_voxel_index.size != 0: # if this voxel is also in the predictions grid
-            anomaly_score = pred_scores[pred_voxel_index][0]
-            # intersect_preds[i][3] = anomaly_score # set the voxel value to the prediction score
-            intersect_preds.extend(anomaly_score)
-
-        gts_voxel_index = np.where((np.isclose(gt_voxels, coordinate)).all(axis=1))[0]
-        if gts_voxel_index.size != 0:
-            gt_id = gt_labels[gts_voxel_index][0]
-            # intersect_labels[i][3] = gt_id
-            intersect_labels.extend(gt_id)
+def voxelgrid_intersect_new(preds, gts, unmatched="drop"):
+    preds = np.asarray(preds)
+    gts = np.asarray(gts).astype(np.float64) # to match pred voxels and values
+    intersect_preds, intersect_labels, _ = voxelgrid_join(preds, gts, unmatched)
     return intersect_preds, intersect_labels
 
-# DOUBLECHECKING END
-
 
-def mask_intersect(preds, gts):
-    preds_, gts_ = voxelgrid_intersect(preds, gts)
+def mask_intersect(preds, gts, unmatched="drop"):
+    preds_, gts_ = voxelgrid_intersect(preds, gts, unmatched)
 
     preds_scores, gts_scores = preds_[:,-1:], gts_[:,-1:]
-    preds_scores, gts_scores = np.squeeze(preds_scores), np.squeeze(gts_scores)
+    preds_scores, gts_scores = np.squeeze(preds_scores, axis=1), np.squeeze(gts_scores, axis=1)
 
     ood_mask, ind_mask = mask_anomaly_voxels(gts_scores)
     print("AMOUNT OF ANOMALOUS VOXELS:", np.count_nonzero(ood_mask))
@@ -134,54 +164,151 @@ def mask_intersect(preds, gts):
     return val_out, val_label
 
 
-def calculate_auroc(preds, gts):
+# THRESHOLD SWEEP
+
+FPR95_THRESHOLDS = np.arange(1, -0.01, -0.01)
+SMIYC_THRESHOLDS = np.arange(start=0.25, stop=0.75, step=0.05)
+
+ThresholdSweep = namedtuple("ThresholdSweep", ["thresholds", "tps", "fps"])
+"""""
+cumulative counts of a score ranking: thresholds in descending order, tps[i] and fps[i] are the number of anomalous and
+normal voxels with score >= thresholds[i]. All metrics are read off from the sweep, the scores are sorted only once.
+"""
+
+
+def threshold_sweep(preds, gts):
+    """""
+    sorts the scores once and counts the true and false positives at every distinct score
+    """
+    preds = np.asarray(preds, dtype=np.float64).ravel()
+    gts = np.asarray(gts).ravel() != 0
+    order = np.argsort(-preds, kind="stable")
+    sorted_preds, sorted_gts = preds[order], gts[order]
+
+    # last position of every distinct score
+    distinct = np.r_[np.flatnonzero(np.diff(sorted_preds)), len(sorted_preds) - 1] if len(preds) else np.array([], int)
+    tps = np.cumsum(sorted_gts, dtype=np.int64)[distinct]
+    fps = (distinct + 1) - tps
+    return ThresholdSweep(sorted_preds[distinct], tps, fps)
+
+
+def sweep_counts(sweep, thresholds, inclusive=False):
+    """""
+    tp, fp, fn, tn when every score > threshold (>= if inclusive) is predicted as anomaly, for all thresholds at once
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+    positives, negatives = sweep_totals(sweep)
+    # number of distinct scores above the threshold, sweep.thresholds is descending
+    above = np.searchsorted(-sweep.thresholds, -thresholds, side="right" if inclusive else "left")
+    tp = np.where(above > 0, sweep.tps[np.maximum(above - 1, 0)], 0) if len(sweep.tps) else np.zeros(len(thresholds))
+    fp = np.where(above > 0, sweep.fps[np.maximum(above - 1, 0)], 0) if len(sweep.fps) else np.zeros(len(thresholds))
+    return tp, fp, positives - tp, negatives - fp
+
+
+def sweep_totals(sweep):
+    """""number of anomalous and normal voxels"""
+    if not len(sweep.tps):
+        return 0, 0
+    return int(sweep.tps[-1]), int(sweep.fps[-1])
+
+
+def sweep_roc(sweep):
+    """""fpr and tpr of every distinct threshold, starting at (0, 0) like sklearn roc_curve"""
+    positives, negatives = sweep_totals(sweep)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = np.r_[0, sweep.tps] / positives
+        fpr = np.r_[0, sweep.fps] / negatives
+    return fpr, tpr
+
+
+def sweep_auroc(sweep):
+    if not all(sweep_totals(sweep)):
+        return float("nan")
+    fpr, tpr = sweep_roc(sweep)
+    return float(np.trapezoid(tpr, fpr)) if hasattr(np, "trapezoid") else float(np.trapz(tpr, fpr))
+
 
-    fpr, tpr, threshold = roc_curve(gts, preds)
-    roc_auc = auc(fpr, tpr)
-    fpr_best = 0
-    # print('Started FPR search.')
-    for i, j, k in zip(tpr, fpr, threshold):
-        if i > 0.95:
-            fpr_best = j
-            break
-    # print(k)
-    return roc_auc, fpr_best, k
+def sweep_precision_recall(sweep):
+    """""precision and recall of every distinct threshold (descending thresholds)"""
+    positives, _ = sweep_totals(sweep)
+    predicted = sweep.tps + sweep.fps
+    precision = np.divide(sweep.tps, predicted, out=np.zeros(len(predicted)), where=predicted != 0)
+    recall = sweep.tps / positives if positives else np.ones(len(predicted))
+    return precision, recall
+
+
+def sweep_average_precision(sweep):
+    """""average precision, sum over (R_n - R_n-1) * P_n like sklearn average_precision_score"""
+    positives, _ = sweep_totals(sweep)
+    if not positives:
+        return float("nan")
+    precision, recall = sweep_precision_recall(sweep)
+    return float(np.sum(np.diff(recall, prepend=0) * precision))
+
+
+def sweep_fpr_at_tpr(sweep, tpr=0.95, thresholds=FPR95_THRESHOLDS):
+    """""fpr at the highest of the thresholds (score > threshold) where the tpr reaches tpr, None if it never does"""
+    tp, fp, fn, tn = sweep_counts(sweep, thresholds)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        reached = np.flatnonzero(tp / (tp + fn) >= tpr)
+    if not len(reached):
+        return None
+    i = reached[0]
+    return fp[i] / (fp[i] + tn[i])
+
+
+def sweep_prc_threshold(sweep):
+    """""threshold that minimizes the distance between precision and recall, the lowest one if there are several"""
+    if not len(sweep.thresholds):
+        return float("nan")
+    precision, recall = sweep_precision_recall(sweep)
+    distance = np.abs(precision - recall)[::-1]  # ascending thresholds
+    return sweep.thresholds[::-1][np.argmin(distance)]
+
+
+def sweep_specificity(sweep, thresholds):
+    """""tn / (tn + fp) for score > threshold, 1 if there are no normal voxels"""
+    _, fp, _, tn = sweep_counts(sweep, thresholds)
+    return np.divide(tn, tn + fp, out=np.ones(len(tn)), where=(tn + fp) != 0)
+
+
+def sweep_precision(sweep, thresholds):
+    """""ppv tp / (tp + fp) for score > threshold, 0 if nothing is predicted as anomaly"""
+    tp, fp, _, _ = sweep_counts(sweep, thresholds)
+    return np.divide(tp, tp + fp, out=np.zeros(len(tp)), where=(tp + fp) != 0)
+
+
+def sweep_f1(sweep, thresholds):
+    """""f1 score 2tp / (2tp + fp + fn) for score > threshold, 0 if undefined like sklearn f1_score"""
+    tp, fp, fn, _ = sweep_counts(sweep, thresholds)
+    return np.divide(2 * tp, 2 * tp + fp + fn, out=np.zeros(len(tp)), where=(2 * tp + fp + fn) != 0)
+
+
+def calculate_auroc(preds, gts):
+    sweep = threshold_sweep(preds, gts)
+    roc_auc = sweep_auroc(sweep)
+    # first roc point with tpr > 0.95, without collinear points and starting at threshold inf like sklearn roc_curve
+    fps, tps = np.r_[0, sweep.fps], np.r_[0, sweep.tps]
+    corners = np.flatnonzero(np.r_[True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True])
+    fpr, tpr = (roc[corners] for roc in sweep_roc(sweep))
+    roc_thresholds = np.r_[np.inf, sweep.thresholds][corners]
+    above = np.flatnonzero(tpr > 0.95)
+    i = above[0] if len(above) else len(tpr) - 1
+    fpr_best = fpr[i] if len(above) else 0
+    return roc_auc, fpr_best, roc_thresholds[i]
 
 
 def calculate_fpr95(preds,gts):
-    FPR95 = None
-    for threshold in np.arange(1, -0.01, -0.01):  # Start with high threshold and go down
-        preds_bin = np.where(preds > threshold, 1, 0)
-        cm_values = confusion_matrix(gts, preds_bin).ravel()
-        tn, fp, fn, tp = cm_values
-        print(tn,fp,fn,tp)
-        TPR = tp / (tp + fn)
-        if TPR >= 0.95:
-            FPR = fp / (fp + tn)
-            FPR95 = FPR
-            break
-    return FPR95 
+    return sweep_fpr_at_tpr(threshold_sweep(preds, gts), 0.95)
 
 
 def calculate_specificity(preds, gts,  normality, thresholds: list=[0.5]):
-    specificity_scores = []
-    for i, threshold in enumerate(thresholds):
-        preds_bin = np.where(preds > threshold, 1, 0)
-        cm_values = confusion_matrix(gts, preds_bin).ravel()
-        if normality and len(cm_values) == 1: # if no anomalies to be detected and preds are all zero
-            specificity_scores.append(1)
-        else:
-            tn, fp, fn, tp = cm_values
-            specificity = tn / (tn+fp)
-            specificity_scores.append(specificity)
-    return np.mean(specificity_scores)
+    return np.mean(sweep_specificity(threshold_sweep(preds, gts), thresholds))
 
 
 def calculate_threshold_from_prc(preds, gts):
-    precision, recall, thresholds = precision_recall_curve(gts, preds)
     # minimize distance between precision and recall scores
-    optimal_threshold = sorted(list(zip(np.abs(precision - recall), thresholds)), key=lambda i: i[0], reverse=False)[0][1]
-    return optimal_threshold
+    return sweep_prc_threshold(threshold_sweep(preds, gts))
 
 
 def mask_anomaly_voxels(gts, anomaly_id=33): # original label is in sample is 29, label in intersected gt grids is 33.
@@ -196,80 +323,52 @@ def mask_anomaly_voxels(gts, anomaly_id=33): # original label is in sample is 29
 
 
 
-def voxelgrid_intersect(preds, gts): # only grid of prediction is relevant for evaluation
-    gt_labels = gts[:,-1:].astype(np.float64) # to match pred voxels and values
-    gt_voxels = gts[:,:3].astype(np.float64)
-
-    pred_scores = preds[:,-1:]
-    pred_voxels = preds[:,:3] #.astype(np.uint16)
-
-    size, dim = gt_voxels.shape
-
-    intersect_indices = np.where((gt_voxels==pred_voxels[:,None]).all(-1))[1]
-
-    intersect_grid = gt_voxels[intersect_indices]
-    intersect_labels = np.c_[intersect_grid, np.zeros((intersect_grid.shape[0],1))]
-    intersect_preds = np.copy(intersect_labels)
-
-    for i, coordinate in enumerate(intersect_grid):
-        pred_voxel_index = np.where((np.isclose(pred_voxels, coordinate)).all(axis=1))[0]
-        if pred_voxel_index.size != 0: # if this voxel is also in the predictions grid
-            anomaly_score = pred_scores[pred_voxel_index][0]
-            intersect_preds[i][3] = anomaly_score # set the voxel value to the prediction score
-
-        gts_voxel_index = np.where((np.isclose(gt_voxels, coordinate)).all(axis=1))[0]
-        if gts_voxel_index.size != 0:
-            gt_id = gt_labels[gts_voxel_index][0]
-            intersect_labels[i][3] = gt_id
+def voxelgrid_intersect(preds, gts, unmatched="drop"): # only grid of prediction is relevant for evaluation
+    preds = np.asarray(preds)
+    gts = np.asarray(gts).astype(np.float64) # to match pred voxels and values
+    scores, labels, voxels = voxelgrid_join(preds, gts, unmatched)
+    voxels = voxels.astype(np.float64)
+    intersect_preds = np.c_[voxels, scores]
+    intersect_labels = np.c_[voxels, labels]
     return intersect_preds, intersect_labels
 
 
 def anomaly_included(gts, anomaly_label=1):
     return np.isin(gts, anomaly_label).any()
 
-def intersect_grids(pred_path, gt_path, front_only:bool=False, return_anomaly_detectable:bool=True):# , iteration):
-    gt = np.load(gt_path)
-    pred = np.load(pred_path)
+def intersect_grids(pred_path, gt_path, front_only:bool=False, return_anomaly_detectable:bool=True, unmatched="drop"):# , iteration):
+    # paths of npy files or (container path, frame id) references
+    gt = load_voxel_grid(gt_path)
+    pred = load_voxel_grid(pred_path)
     if front_only:
         # x < 500 is behind ego vehicle
         front_voxels = np.where(gt[:,0] > 500)
         gt = gt[front_voxels]
-    pred_bin, gt_bin = mask_intersect(pred, gt)
+    pred_bin, gt_bin = mask_intersect(pred, gt, unmatched)
     return (pred_bin, gt_bin, anomaly_included(gt_bin)) if return_anomaly_detectable else (pred_bin, gt_bin)
 
 
 
 def compute_metrics(preds, gts, ignore=[]):
-    ap = average_precision_score(gts, preds)
-    auroc, fpr, _ = calculate_auroc(preds, gts)
-    fpr = calculate_fpr95(preds,gts)
-    smiyc_thresholds = np.arange(start=0.25, stop=0.75, step=0.05)
-    prc_threshold = calculate_threshold_from_prc(preds, gts)
-
-    def catch_division_by_zero(n,d):
-        return n / d if d else 0
-    specificity = calculate_specificity(preds, gts, normality=max(gts), thresholds=np.array([prc_threshold]))
-    precision_scores = []
-    f1_scores = []
-    # for i, threshold in enumerate(smiyc_thresholds):
-    for i, threshold in enumerate(smiyc_thresholds):
-        preds_bin = np.where(preds > threshold, 1, 0)
-        tn, fp, fn, tp = confusion_matrix(gts, preds_bin).ravel()
-        # tn, fp, fn, tp = confusion_matrix(gts, preds_bin).ravel()
-        # specificity_i = tn / (tn+fp)
-        # specificity_scores.append(specificity_i)
-        precision_i = catch_division_by_zero(tp, (tp + fp))
-        precision_scores.append(precision_i)
-        f1_i = f1_score(gts, preds_bin)
-        f1_scores.append(f1_i)
-    # specificity = np.mean(specificity_scores)
-    precision_score = np.mean(precision_scores)
-    f1 = np.mean(f1_scores)
-    # specificity = calculate_specificity(preds, gts, [prc_threshold])
+    return compute_metrics_from_sweep(threshold_sweep(preds, gts))
+
+
+def compute_metrics_from_sweep(sweep):
+    """""
+    all metrics of the benchmark from one threshold sweep: auroc, aupr, fpr at 95% tpr, specificity at the threshold
+    where precision and recall meet, and ppv and f1 averaged over the SMIYC thresholds
+    """
+    auroc = sweep_auroc(sweep)
+    ap = sweep_average_precision(sweep)
+    fpr = sweep_fpr_at_tpr(sweep, 0.95)
+    prc_threshold = sweep_prc_threshold(sweep)
+    specificity = np.mean(sweep_specificity(sweep, [prc_threshold]))
+    precision_score = np.mean(sweep_precision(sweep, SMIYC_THRESHOLDS))
+    f1 = np.mean(sweep_f1(sweep, SMIYC_THRESHOLDS))
     result = {
         'auroc': float(auroc),
         'aupr': float(ap),
-        'fpr95': float(fpr),
+        'fpr95': float(fpr) if fpr is not None else float('nan'),
         'specificity': float(specificity),
         'f1_score': float(f1),
         'ppv': float(precision_score),
@@ -277,6 +376,130 @@ def compute_metrics(preds, gts, ignore=[]):
     return result
 
 
+# STREAMING EVALUATION
+
+HISTOGRAM_BINS = 100000
+HISTOGRAM_RANGE = (0.0, 1.0)
+
+
+class ScoreHistogram:
+    """""
+    fixed-size histograms of the scores of anomalous and normal voxels. Memory does not depend on the number of voxels,
+    metrics are exact up to the bin width of scores in score_range (scores in one bin count as equal). Scores outside of
+    score_range are counted in the first or last bin and NaN scores are left out, both are counted and reported by
+    compute_metrics because they make the metrics wrong
+    """
+    def __init__(self, bins=HISTOGRAM_BINS, score_range=HISTOGRAM_RANGE):
+        low, high = score_range
+        if not (np.isfinite(low) and np.isfinite(high) and low < high):
+            raise ValueError("invalid score range {}".format(score_range))
+        self.bins = bins
+        self.score_range = (float(low), float(high))
+        self.anomalous = np.zeros(bins, dtype=np.int64)
+        self.normal = np.zeros(bins, dtype=np.int64)
+        self.out_of_range = 0
+        self.nan = 0
+
+    def update(self, preds, gts):
+        preds = np.asarray(preds, dtype=np.float64).ravel()
+        gts = np.asarray(gts).ravel() != 0
+        nan = np.isnan(preds)
+        if nan.any():
+            self.nan += int(nan.sum())
+            preds, gts = preds[~nan], gts[~nan]
+        low, high = self.score_range
+        self.out_of_range += int(np.count_nonzero((preds < low) | (preds > high)))
+        bin_ids = np.clip((preds - low) * (self.bins / (high - low)), 0, self.bins - 1).astype(np.int64)
+        self.anomalous += np.bincount(bin_ids[gts], minlength=self.bins)
+        self.normal += np.bincount(bin_ids[~gts], minlength=self.bins)
+
+    def merge(self, other):
+        assert self.bins == other.bins and self.score_range == other.score_range, "histograms do not match"
+        self.anomalous += other.anomalous
+        self.normal += other.normal
+        self.out_of_range += other.out_of_range
+        self.nan += other.nan
+        return self
+
+    def warn_invalid_scores(self):
+        """""logs a warning if scores were outside of score_range or NaN"""
+        if self.out_of_range:
+            logging.warning("{} of {} scores are outside of the score range {} and were counted in the first or "
+                            "last histogram bin, the metrics are wrong. Set the score range of the predictions "
+                            "(--score_range)".format(self.out_of_range, len(self) + self.nan, self.score_range))
+        if self.nan:
+            logging.warning("{} of {} scores are NaN and were left out".format(self.nan, len(self) + self.nan))
+
+    def __len__(self):
+        return int(self.anomalous.sum() + self.normal.sum())
+
+    def sweep(self):
+        """""threshold sweep over the lower bin edges of all non empty bins"""
+        low, high = self.score_range
+        edges = low + np.arange(self.bins) * ((high - low) / self.bins)
+        filled = np.flatnonzero(self.anomalous + self.normal)[::-1]
+        tps = np.cumsum(self.anomalous[::-1])[::-1]
+        fps = np.cumsum(self.normal[::-1])[::-1]
+        return ThresholdSweep(edges[filled], tps[filled], fps[filled])
+
+    def compute_metrics(self, warn=True):
+        if warn:
+            self.warn_invalid_scores()
+        return compute_metrics_from_sweep(self.sweep())
+
+
+class StreamingEvaluator:
+    """""
+    accumulates the scores frame by frame into one histogram per bucket: all voxels, voxels of frames where the anomaly
+    is detectable and detectable voxels per anomaly size. Replaces collecting all scores in lists
+    """
+    def __init__(self, bins=HISTOGRAM_BINS, score_range=HISTOGRAM_RANGE):
+        self.total = ScoreHistogram(bins, score_range)
+        self.detectable = ScoreHistogram(bins, score_range)
+        self.bins = bins
+        self.score_range = self.total.score_range
+        self.by_anomaly_size = {} # plain dict instead of defaultdict, evaluators are sent between processes
+
+    def size_histogram(self, anomaly_size):
+        if anomaly_size not in self.by_anomaly_size:
+            self.by_anomaly_size[anomaly_size] = ScoreHistogram(self.bins, self.score_range)
+        return self.by_anomaly_size[anomaly_size]
+
+    def update(self, preds, gts, detectable, anomaly_size=None):
+        self.total.update(preds, gts)
+        if detectable:
+            self.detectable.update(preds, gts)
+            self.size_histogram(anomaly_size).update(preds, gts)
+
+    def merge(self, other):
+        """""adds the histograms of another evaluator, e.g. of a worker process"""
+        self.total.merge(other.total)
+        self.detectable.merge(other.detectable)
+        for anomaly_size, histogram in other.by_anomaly_size.items():
+            self.size_histogram(anomaly_size).merge(histogram)
+        return self
+
+    def results(self):
+        # the other buckets are subsets of the total bucket, its warning covers them
+        return dict(
+            Normality_Included = self.total.compute_metrics(),
+            Anomalies_Only = self.detectable.compute_metrics(warn=False),
+            Detection_Results_by_Anomaly_Size = {
+                anomaly_size: histogram.compute_metrics(warn=False)
+                for anomaly_size, histogram in self.by_anomaly_size.items()
+            }
+        )
+
+    def save(self, folder):
+        """""stores the histograms of all buckets, for testing purposes"""
+        os.makedirs(folder, exist_ok=True)
+        buckets = {"total": self.total, "detectable": self.detectable}
+        buckets.update({"size_{}".format(size): histogram for size, histogram in self.by_anomaly_size.items()})
+        for name, histogram in buckets.items():
+            np.savez(os.path.join(folder, name), anomalous=histogram.anomalous, normal=histogram.normal,
+                     score_range=histogram.score_range)
+
+
 if __name__ == "__main__":
     """""use this if you want to evaluate for a single voxel grid"""
     # first voxel grid in AnoVox sample: <...>/Anovox_Sample/AnoVox/Scenario_bfc1d392-fb70-4d51-a915-2b238690eb5d/VOXEL_GRID/VOXEL_GRID_5496.npy
@@ -288,6 +511,9 @@ if __name__ == "__main__":
     parser.add_argument('--groundtruth_file', type=str, # default='<...>/Anomaly_Datasets/AnoVox',
                         help=""""ground truth file""")
 
+    parser.add_argument('--unmatched', type=str, default='drop', choices=UNMATCHED_VOXELS,
+                        help=""""how voxels that are only in one of the grids are evaluated, see voxelgrid_join""")
+
     # parser.add_argument('--output', type=str, default='imagevoxels',
     #                     help="""file where anomaly scores are stored""")
 
@@ -300,7 +526,7 @@ if __name__ == "__main__":
     gt = np.load(args.groundtruth_file)
     pred = np.load(args.score_prediction)
 
-    pred_bin, gt_bin = mask_intersect_new(pred, gt)
+    pred_bin, gt_bin = mask_intersect_new(pred, gt, args.unmatched)
     # gts = gt[:,-1]
     # outlier_mask, inlier_mask = mask_anomaly_voxels(gts)
     # pred_bin = pred[:,-1]
@@ -0,0 +1,175 @@
+"""""
+tests of the threshold sweep metrics against counting every threshold separately, and of the score histograms against
+the exact metrics
+"""
+import numpy as np
+import pytest
+
+import metrics
+
+
+def random_scores(rng, count=2000, ties=False):
+    gts = (rng.random(count) < 0.1).astype(np.float64)
+    preds = np.clip(rng.random(count) * 0.6 + gts * rng.random(count) * 0.5, 0, 1)
+    if ties:
+        preds = np.round(preds, 2)
+    return preds, gts
+
+
+def counts_loop(preds, gts, threshold, inclusive=False):
+    predicted = preds >= threshold if inclusive else preds > threshold
+    anomalous = gts != 0
+    return (np.sum(predicted & anomalous), np.sum(predicted & ~anomalous),
+            np.sum(~predicted & anomalous), np.sum(~predicted & ~anomalous))
+
+
+def auroc_pairs(preds, gts):
+    """""probability that an anomalous voxel scores higher than a normal one, ties count half"""
+    anomalous, normal = preds[gts != 0], preds[gts == 0]
+    greater = (anomalous[:, None] > normal[None, :]).sum()
+    equal = (anomalous[:, None] == normal[None, :]).sum()
+    return (greater + 0.5 * equal) / (len(anomalous) * len(normal))
+
+
+def average_precision_loop(preds, gts):
+    """""sum over (R_n - R_n-1) * P_n over the distinct scores in descending order"""
+    positives = np.sum(gts != 0)
+    ap, previous_recall = 0.0, 0.0
+    for threshold in np.unique(preds)[::-1]:
+        tp, fp, _, _ = counts_loop(preds, gts, threshold, inclusive=True)
+        recall = tp / positives
+        ap += (recall - previous_recall) * tp / (tp + fp)
+        previous_recall = recall
+    return ap
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_sweep_counts_match_loop(ties):
+    preds, gts = random_scores(np.random.default_rng(0), ties=ties)
+    sweep = metrics.threshold_sweep(preds, gts)
+    thresholds = np.r_[metrics.SMIYC_THRESHOLDS, np.unique(preds)[::97], -1.0, 2.0]
+    for inclusive in (False, True):
+        tp, fp, fn, tn = metrics.sweep_counts(sweep, thresholds, inclusive)
+        for i, threshold in enumerate(thresholds):
+            assert (tp[i], fp[i], fn[i], tn[i]) == counts_loop(preds, gts, threshold, inclusive)
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_metrics_match_loop(ties):
+    preds, gts = random_scores(np.random.default_rng(1), ties=ties)
+    sweep = metrics.threshold_sweep(preds, gts)
+    result = metrics.compute_metrics(preds, gts)
+
+    assert result["auroc"] == pytest.approx(auroc_pairs(preds, gts))
+    assert result["aupr"] == pytest.approx(average_precision_loop(preds, gts))
+
+    fpr95 = None
+    for threshold in metrics.FPR95_THRESHOLDS:
+        tp, fp, fn, tn = counts_loop(preds, gts, threshold)
+        if tp / (tp + fn) >= 0.95:
+            fpr95 = fp / (fp + tn)
+            break
+    assert result["fpr95"] == pytest.approx(fpr95)
+
+    ppv, f1 = [], []
+    for threshold in metrics.SMIYC_THRESHOLDS:
+        tp, fp, fn, _ = counts_loop(preds, gts, threshold)
+        ppv.append(tp / (tp + fp) if tp + fp else 0.0)
+        f1.append(2 * tp / (2 * tp + fp + fn) if 2 * tp + fp + fn else 0.0)
+    assert result["ppv"] == pytest.approx(np.mean(ppv))
+    assert result["f1_score"] == pytest.approx(np.mean(f1))
+
+    _, fp, _, tn = counts_loop(preds, gts, metrics.sweep_prc_threshold(sweep))
+    assert result["specificity"] == pytest.approx(tn / (tn + fp))
+
+
+def test_sklearn_reference():
+    sklearn_metrics = pytest.importorskip("sklearn.metrics")
+    preds, gts = random_scores(np.random.default_rng(2), ties=True)
+    result = metrics.compute_metrics(preds, gts)
+    assert result["auroc"] == pytest.approx(sklearn_metrics.roc_auc_score(gts, preds))
+    assert result["aupr"] == pytest.approx(sklearn_metrics.average_precision_score(gts, preds))
+
+
+def test_empty_and_single_class():
+    assert np.isnan(metrics.compute_metrics(np.array([]), np.array([]))["auroc"])
+    result = metrics.compute_metrics(np.array([0.2, 0.7]), np.array([0, 0]))
+    assert np.isnan(result["auroc"])
+    assert np.isnan(result["aupr"])
+
+
+def test_histogram_matches_exact_metrics_on_bin_edges():
+    # scores on the bin edges are binned without loss, so the histogram metrics are exact
+    rng = np.random.default_rng(3)
+    bins = 64
+    gts = (rng.random(5000) < 0.1).astype(np.float64)
+    preds = rng.integers(0, bins, size=5000) / bins
+    preds = np.where(gts != 0, np.maximum(preds, rng.integers(0, bins, size=5000) / bins), preds)
+
+    histogram = metrics.ScoreHistogram(bins=bins)
+    histogram.update(preds, gts)
+    assert len(histogram) == len(preds)
+    result, expected = histogram.compute_metrics(), metrics.compute_metrics(preds, gts)
+    for key in expected:
+        assert result[key] == pytest.approx(expected[key]), key
+
+
+def test_histogram_approximates_exact_metrics():
+    preds, gts = random_scores(np.random.default_rng(4), count=20000)
+    histogram = metrics.ScoreHistogram()
+    histogram.update(preds, gts)
+    result, expected = histogram.compute_metrics(), metrics.compute_metrics(preds, gts)
+    for key in expected:
+        assert result[key] == pytest.approx(expected[key], abs=2e-3), key
+
+
+def test_streaming_evaluator_chunks_and_merge():
+    preds, gts = random_scores(np.random.default_rng(5), count=6000)
+    single = metrics.StreamingEvaluator(bins=1000)
+    single.update(preds, gts, detectable=True, anomaly_size="small")
+
+    first, second = metrics.StreamingEvaluator(bins=1000), metrics.StreamingEvaluator(bins=1000)
+    for i, chunk in enumerate(np.array_split(np.arange(len(preds)), 7)):
+        (first if i % 2 else second).update(preds[chunk], gts[chunk], detectable=True, anomaly_size="small")
+    merged = first.merge(second)
+    assert merged.results() == single.results()
+
+    undetectable = metrics.StreamingEvaluator(bins=1000)
+    undetectable.update(preds, gts, detectable=False, anomaly_size="small")
+    assert len(undetectable.total) == len(preds)
+    assert len(undetectable.detectable) == 0
+    assert undetectable.by_anomaly_size == {}
+
+
+def test_histogram_score_range(caplog):
+    # unnormalized scores, e.g. energies, need their own score range
+    preds, gts = random_scores(np.random.default_rng(6), count=20000)
+    logits = 20 * preds - 8
+    expected = metrics.compute_metrics(logits, gts)
+
+    histogram = metrics.ScoreHistogram(score_range=(-8, 12))
+    histogram.update(logits, gts)
+    with caplog.at_level("WARNING"):
+        result = histogram.compute_metrics()
+    assert not caplog.records
+    for key in expected:
+        assert result[key] == pytest.approx(expected[key], abs=2e-3, nan_ok=True), key
+
+    with pytest.raises(ValueError):
+        metrics.ScoreHistogram(score_range=(1, 1))
+
+
+def test_histogram_warns_about_invalid_scores(caplog):
+    preds = np.array([0.2, 0.9, 1.5, -3.0, np.inf, np.nan, np.nan])
+    gts = np.array([0, 1, 1, 0, 1, 1, 0])
+    evaluator = metrics.StreamingEvaluator(bins=10)
+    evaluator.update(preds, gts, detectable=True, anomaly_size="small")
+    assert (evaluator.total.out_of_range, evaluator.total.nan) == (3, 2)
+    assert len(evaluator.total) == 5
+
+    with caplog.at_level("WARNING"):
+        evaluator.merge(evaluator.__class__(bins=10)).results()
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 2
+    assert messages[0].startswith("3 of 7 scores are outside of the score range")
+    assert messages[1] == "2 of 7 scores are NaN and were left out"
@@ -2,6 +2,10 @@ import os
 import open3d as o3d
 import numpy as np
 import argparse
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Voxelization.VoxelReduction import reduce_to_voxels
 
 
 class PointCloudVoxelizer:
@@ -73,65 +77,10 @@ class PointCloudVoxelizer:
 
 
     def voxel_filter(self, pcloud, voxel_resolution, grid_size, offset):
-        # pcd = np.asarray(pcloud.points)
-        # sem = (np.asarray(pcloud.colors) * 255.0).astype(np.uint8)
         pcd = pcloud[:, :3]
         sem = pcloud[:, -1]
-        # new_sem = np.arange(len(sem))
-        # for i, value in enumerate(sem): #
-        #     color_index = np.where((COLOR_PALETTE == value).all(axis = 1))
-        #     # print(value)
-        #     # for color in COLOR_PALETTE:
-        #     #     if (value == color).all():
-        #     #         new_sem[i] = np.where((COLOR_PALETTE == value))[0][0]
-        #     # print(color_index)
-        #     new_sem[i] = color_index[0][0]
-        # sem = new_sem
-        # unique, counts = np.unique(sem, return_counts = True)
-        # print(dict(zip(unique, counts)))
-        grid_size = np.asarray(grid_size)
-        offset = np.asarray(offset)
-        offset += voxel_resolution * grid_size / 2
-        pcd_b = pcd + offset
-        idx = ((0 <= pcd_b) & (pcd_b < grid_size * voxel_resolution)).all(axis=1)
-        pcd_b, sem_b = pcd_b[idx], sem[idx] # limit point cloud to voxel grid size
-
-        Dx, Dy, Dz = grid_size
-        # compute index for every point in a voxel
-        hxyz, hmod = np.divmod(pcd_b, voxel_resolution)
-        h = hxyz[:, 0] + hxyz[:, 1] * Dx + hxyz[:, 2] * Dx * Dy
-
-        # h_n = np.nonzero(np.bincount(h.astype(np.int32)))
-        h_idx = np.argsort(h)
-        h, hxyz, sem_b, pcd_b, hmod = h[h_idx], hxyz[h_idx], sem_b[h_idx], pcd_b[h_idx], hmod[h_idx]
-        h_n, indices = np.unique(h, return_index=True)
-        n_f = h_n.shape[0]
-        n_all = h.shape[0]
-        voxels = np.zeros((n_f, 3), dtype=np.uint16)
-        semantics = np.zeros((n_f,1), dtype=np.float64)
-        # points_f = np.zeros((n_f, 3))
-        # road_idx = np.where((COLOR_PALETTE == (157, 234, 50)).all(axis = 1))[0][0] # roadline 24u
-        # road_idx = np.where(LABEL_CLASS == 'roadlines')[0][0]
-        # voxels = []
-        # semantics = []
-        # points_f = []
-        for i in range(n_f):
-            # idx_ = (h == h_n[i])
-            idx_ = np.arange(indices[i], indices[i+1]) if i < n_f - 1 else np.arange(indices[i], n_all)
-            # dis = np.sum(hmod[idx_] ** 2, axis=1)
-
-            avg_score = np.mean(sem_b[idx_])
-
-            # semantic = sem_b[idx_][np.argmin(dis)]  # if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-            # semantic = np.bincount(sem_b.squeeze()[idx_]).argmax() if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-            voxels[i] = hxyz[idx_][0]
-            semantics[i] = avg_score
-            # points_f[i][2] += center[2] / 2
-            # voxels.append(hxyz[idx_][0])
-            # semantics.append(semantic)
-            # points_f.append(pcd_b[idx_].mean(axis=0) - center)
-        # debug_set, counts = np.unique(semantics, return_counts=True)
-        return voxels, semantics
+        voxels, semantics = reduce_to_voxels(pcd, sem, voxel_resolution, grid_size, offset, reduction='mean')
+        return voxels, semantics.reshape(-1, 1)
 
     def anomalous_instance_in_point_cloud(self, gt_pcd):
         labels = gt_pcd[:,:3] # bullshit
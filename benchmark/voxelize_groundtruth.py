@@ -4,7 +4,12 @@ from PIL import Image
 import os
 from tqdm import tqdm
 import argparse
-from numba import jit
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Voxelization.DepthDecoding import decode_carla_depth
+from Voxelization.VoxelContainer import VOXEL_GRID_CONTAINER_FILE_NAME, VoxelGridWriter
+from Voxelization.VoxelReduction import reduce_to_voxels
 
 
 bev_offset_forward = 0 # in px
@@ -76,23 +81,6 @@ def collect_anovox_files(dataset_path, datatype):
 
 
 
-@jit(nopython=True)  # Compile the function with Numba
-def calculate_carla_depth(depth_img, new_depth, height, width):
-    # depth_img = Image.open(depth_img)
-    depth_img_arr = new_depth
-    # height, width, _  = depth_img_arr.shape
-    # Get the dimensions of the image
-    # depth_img_arr = np.zeros((depth_img.height, depth_img.width,))
-    # Loop through each pixel in the depth_img
-    for row in range(height):
-        for col in range(width):
-            pixel = depth_img[row, col]
-            depth_img_arr[row, col] = 1000 * (pixel[0] + pixel[1] * 256 + pixel[2] * 256 * 256) / (
-                256 * 256 * 256 - 1
-            )
-    return depth_img_arr
-
-
 def img2pcd(score_img, depth_img, mask, camera_fov, depth_preds:bool=False):
     eval_image = np.array(Image.open(score_img))
     if depth_preds:
@@ -104,8 +92,7 @@ def img2pcd(score_img, depth_img, mask, camera_fov, depth_preds:bool=False):
     else:
         depth_img = Image.open(depth_img)
 
-        depth_img_array = calculate_carla_depth(np.array(depth_img), np.zeros((depth_img.height, depth_img.width,)),
-                                            depth_img.height, depth_img.width)
+        depth_img_array = decode_carla_depth(np.array(depth_img))
 
         pcloud = transform_to_pcd(eval_image, depth_img_array, camera_fov, mask)
 
@@ -173,7 +160,8 @@ def transform_to_pcd(scores, depths, camera_fov, mask=None):
     return depth_pcloud
 
 
-def voxelize_one(merged_pcd, save_name, voxel_resolution, grid_size):
+def voxelize_one(merged_pcd, save_name, voxel_resolution, grid_size, container=None, frame_id=None):
+    """stores the voxel grid as npy file save_name or, if a container writer is given, as frame frame_id of the container"""
     offset_x = bev_offset_forward * bev_resolution
     offset_z = offset_z_ * voxel_resolution
     voxel_points, semantics = voxel_filter(merged_pcd, voxel_resolution, grid_size, [offset_x, 0, offset_z])
@@ -181,65 +169,32 @@ def voxelize_one(merged_pcd, save_name, voxel_resolution, grid_size):
     # voxels = np.zeros(shape=cfg.voxel_size, dtype=np.uint8)
     # voxels[voxel_points[:, 0], voxel_points[:, 1], voxel_points[:, 2]] = semantics
     # csr_voxels = sp.csr_matrix(voxels.reshape(voxels.shape[0], -1))
-    np.save(f'{save_name}', data)
+    if container is None:
+        np.save(f'{save_name}', data)
+    else:
+        container.write_frame_array(frame_id, data)
     # np.save(f'{save_path}/voxel_coo/voxel_coo_{name}.npy', csr_voxels)
 
 
+def colors_to_labels(colors):
+    """maps every rgb color to the index of its first occurrence in COLOR_PALETTE"""
+    palette_codes = (COLOR_PALETTE[:, 0] << 16) | (COLOR_PALETTE[:, 1] << 8) | COLOR_PALETTE[:, 2]
+    codes, first_index = np.unique(palette_codes, return_index=True)
+    colors = colors.astype(np.int64)
+    color_codes = (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+    position = np.minimum(np.searchsorted(codes, color_codes), codes.size - 1)
+    if not (codes[position] == color_codes).all():
+        raise ValueError('point cloud contains colors that are not in COLOR_PALETTE')
+    return first_index[position]
+
+
 def voxel_filter(pcloud, voxel_resolution, voxel_size, offset):
     pcd = np.asarray(pcloud.points)
-    sem = (np.asarray(pcloud.colors) * 255.0).astype(np.uint8)
-    new_sem = np.arange(len(sem))
-    for i, value in enumerate(sem): #
-        color_index = np.where((COLOR_PALETTE == value).all(axis = 1))
-        # print(value)
-        # for color in COLOR_PALETTE:
-        #     if (value == color).all():
-        #         new_sem[i] = np.where((COLOR_PALETTE == value))[0][0]
-        # print(color_index)
-        new_sem[i] = color_index[0][0]
-    sem = new_sem
-    # unique, counts = np.unique(sem, return_counts = True)
-    # print(dict(zip(unique, counts)))
-    voxel_size = np.asarray(voxel_size)
-    offset = np.asarray(offset)
-    offset += voxel_resolution * voxel_size / 2
-    pcd_b = pcd + offset
-    idx = ((0 <= pcd_b) & (pcd_b < voxel_size * voxel_resolution)).all(axis=1)
-    pcd_b, sem_b = pcd_b[idx], sem[idx]
-
-    Dx, Dy, Dz = voxel_size
-    # compute index for every point in a voxel
-    hxyz, hmod = np.divmod(pcd_b, voxel_resolution)
-    h = hxyz[:, 0] + hxyz[:, 1] * Dx + hxyz[:, 2] * Dx * Dy
-
-    # h_n = np.nonzero(np.bincount(h.astype(np.int32)))
-    h_idx = np.argsort(h)
-    h, hxyz, sem_b, pcd_b, hmod = h[h_idx], hxyz[h_idx], sem_b[h_idx], pcd_b[h_idx], hmod[h_idx]
-    h_n, indices = np.unique(h, return_index=True)
-    n_f = h_n.shape[0]
-    n_all = h.shape[0]
-    voxels = np.zeros((n_f, 3), dtype=np.uint16)
-    semantics = np.zeros((n_f, 1), dtype=np.uint8)
-    # points_f = np.zeros((n_f, 3))
+    sem = colors_to_labels((np.asarray(pcloud.colors) * 255.0).astype(np.uint8))
     road_idx = np.where((COLOR_PALETTE == (157, 234, 50)).all(axis = 1))[0][0] # roadline 24u
-    # road_idx = np.where(LABEL_CLASS == 'roadlines')[0][0]
-    # voxels = []
-    # semantics = []
-    # points_f = []
-    for i in range(n_f):
-        # idx_ = (h == h_n[i])
-        idx_ = np.arange(indices[i], indices[i+1]) if i < n_f - 1 else np.arange(indices[i], n_all)
-        dis = np.sum(hmod[idx_] ** 2, axis=1)
-        semantic = sem_b[idx_][np.argmin(dis)] if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-        # semantic = np.bincount(sem_b.squeeze()[idx_]).argmax() if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-        voxels[i] = hxyz[idx_][0]
-        semantics[i] = semantic
-        # points_f[i] = pcd_b[idx_].mean(axis=0) - center
-        # points_f[i][2] += center[2] / 2
-        # voxels.append(hxyz[idx_][0])
-        # semantics.append(semantic)
-        # points_f.append(pcd_b[idx_].mean(axis=0) - center)
-    return voxels, semantics
+    voxels, semantics = reduce_to_voxels(pcd, sem, voxel_resolution, voxel_size, offset,
+                                         reduction='centerpoint', priority_label=road_idx)
+    return voxels, semantics.astype(np.uint8).reshape(-1, 1)
 
 def main(args):
     resolution, dataset = args.voxel_resolution, args.dataset_path
@@ -247,6 +202,10 @@ def main(args):
     output_dir = args.output_dir
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
+    container = None
+    if args.container:
+        container_path = os.path.join(output_dir, VOXEL_GRID_CONTAINER_FILE_NAME)
+        container = VoxelGridWriter(container_path, args.grid_size, np.uint8, voxel_resolution=resolution)
     if args.datatype == 'image':
         semantic_images = collect_anovox_files(dataset, 'SEMANTIC_IMG')
         depth_images = collect_anovox_files(dataset, 'DEPTH_IMG')
@@ -258,7 +217,7 @@ def main(args):
                 pcd = img2pcd(sem_img, depth_img, mask=args.mask, camera_fov=args.camera_fov)
             else:
                 pcd = img2pcd(sem_img, depth_img, None, camera_fov=args.camera_fov)
-            voxelize_one(pcd, file_path, resolution, args.grid_size)
+            voxelize_one(pcd, file_path, resolution, args.grid_size, container, frame_id=i)
     elif args.datatype == 'pointcloud':
         semantic_pointclouds = collect_anovox_files(dataset, 'SEMANTIC_PCD')
         for i, sem_pcd in enumerate(tqdm(semantic_pointclouds)):
@@ -271,9 +230,11 @@ def main(args):
             # pcd.rotate(
             #     r_matrix, center=(0, 0, 0)
             # )  # rotate depth point cloud to fit lidar point cloud
-            voxelize_one(sem_pcd, file_path, resolution, args.grid_size)
+            voxelize_one(sem_pcd, file_path, resolution, args.grid_size, container, frame_id=i)
     else:
         raise NameError('data type does not exist')
+    if container is not None:
+        container.close()
 
 
 
@@ -299,6 +260,9 @@ if __name__ == "__main__":
     parser.add_argument('--mask', type=str, # default='roi.png',
                         help="""path of image to mask region of interest""")
 
+    parser.add_argument('--container', action='store_true',
+                        help="""store all voxel grids in a single voxel grid container in output_dir instead of one npy file per frame. The frame id is the index of the frame""")
+
     # subparser?
     parser.add_argument('--datatype', type=str, choices=['image', 'pointcloud'])
 
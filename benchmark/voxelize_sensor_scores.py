@@ -2,12 +2,16 @@ import numpy as np
 import open3d as o3d
 import sys
 import argparse
-from numba import jit
 import os
 from PIL import Image
 from tqdm import tqdm
 from scipy import stats
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Voxelization.DepthDecoding import decode_carla_depth
+from Voxelization.VoxelContainer import VOXEL_GRID_CONTAINER_FILE_NAME, VoxelGridWriter
+from Voxelization.VoxelReduction import reduce_to_voxels
+
 
 
 bev_offset_forward = 0 # in px
@@ -86,23 +90,6 @@ def collect_anovox_files(dataset_path, datatype):
 
 
 
-@jit(nopython=True)  # Compile the function with Numba
-def calculate_carla_depth(depth_img, new_depth, height, width):
-    # depth_img = Image.open(depth_img)
-    depth_img_arr = new_depth
-    # height, width, _  = depth_img_arr.shape
-    # Get the dimensions of the image
-    # depth_img_arr = np.zeros((depth_img.height, depth_img.width,))
-    # Loop through each pixel in the depth_img
-    for row in range(height):
-        for col in range(width):
-            pixel = depth_img[row, col]
-            depth_img_arr[row, col] = 1000 * (pixel[0] + pixel[1] * 256 + pixel[2] * 256 * 256) / (
-                256 * 256 * 256 - 1
-            )
-    return depth_img_arr
-
-
 def transform_to_pcd(scores, depths, camera_fov, mask=None):
     height, width = depths.shape
 
@@ -221,8 +208,7 @@ def img2pcd(score_img, depth_img, mask, camera_fov, depth_preds:bool=False):
     else:
         depth_img = Image.open(depth_img)
 
-        depth_img_array = calculate_carla_depth(np.array(depth_img), np.zeros((depth_img.height, depth_img.width,)),
-                                            depth_img.height, depth_img.width)
+        depth_img_array = decode_carla_depth(np.array(depth_img))
 
         pcloud = transform_to_pcd(eval_image, depth_img_array, camera_fov, mask)
 
@@ -234,12 +220,16 @@ def img2pcd(score_img, depth_img, mask, camera_fov, depth_preds:bool=False):
 
 
 
-def voxelize_one(pcloud, save_name, voxel_resolution, voxel_grid_size, score_func='centerpoint'):
+def voxelize_one(pcloud, save_name, voxel_resolution, voxel_grid_size, score_func='centerpoint', container=None, frame_id=None):
+    """stores the voxel grid as npy file save_name or, if a container writer is given, as frame frame_id of the container"""
     offset_x = bev_offset_forward * bev_resolution
     offset_z = 0
     voxel_points, semantics = voxel_filter(pcloud, voxel_resolution, voxel_grid_size, [offset_x, 0, offset_z], score_func)
     data = np.concatenate([voxel_points, semantics], axis=1) # [:, None]
-    np.save(f'{save_name}', data)
+    if container is None:
+        np.save(f'{save_name}', data)
+    else:
+        container.write_frame_array(frame_id, data)
     return data
     # np.save(f'{save_path}/voxel_coo/voxel_coo_{name}.npy', csr_voxels)
 
@@ -247,55 +237,8 @@ def voxelize_one(pcloud, save_name, voxel_resolution, voxel_grid_size, score_fun
 def voxel_filter(pcloud, voxel_resolution, grid_size, offset, score_func):
     pcd = pcloud[:, :3]
     sem = pcloud[:, -1]
-    grid_size = np.asarray(grid_size)
-    offset = np.asarray(offset)
-    offset += voxel_resolution * grid_size / 2
-    pcd_b = pcd + offset
-    idx = ((0 <= pcd_b) & (pcd_b < grid_size * voxel_resolution)).all(axis=1)
-    pcd_b, sem_b = pcd_b[idx], sem[idx] # limit point cloud to voxel grid size
-
-    Dx, Dy, Dz = grid_size
-    # compute index for every point in a voxel
-    hxyz, hmod = np.divmod(pcd_b, voxel_resolution)
-    h = hxyz[:, 0] + hxyz[:, 1] * Dx + hxyz[:, 2] * Dx * Dy
-
-    # h_n = np.nonzero(np.bincount(h.astype(np.int32)))
-    h_idx = np.argsort(h)
-    h, hxyz, sem_b, pcd_b, hmod = h[h_idx], hxyz[h_idx], sem_b[h_idx], pcd_b[h_idx], hmod[h_idx]
-    h_n, indices = np.unique(h, return_index=True)
-    n_f = h_n.shape[0]
-    n_all = h.shape[0]
-    voxels = np.zeros((n_f, 3), dtype=np.uint16)
-    semantics = np.zeros((n_f,1), dtype=np.float64)
-    # points_f = np.zeros((n_f, 3))
-    # road_idx = np.where((COLOR_PALETTE == (157, 234, 50)).all(axis = 1))[0][0] # roadline 24u
-    # road_idx = np.where(LABEL_CLASS == 'roadlines')[0][0]
-    # voxels = []
-    # semantics = []
-    # points_f = []
-    for i in range(n_f):
-        # idx_ = (h == h_n[i])
-        idx_ = np.arange(indices[i], indices[i+1]) if i < n_f - 1 else np.arange(indices[i], n_all)
-        if score_func=='centerpoint':
-            dis = np.sum(hmod[idx_] ** 2, axis=1)
-            # voxel_score = sem_b[idx_][np.argmin(dis)]  # if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-            # voxel_score = np.bincount(sem_b.squeeze()[idx_]).argmax()
-            voxel_score = sem_b[idx_][np.argmin(dis)] # if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-        elif score_func=='mean':
-            voxel_score = np.mean(sem_b[idx_])
-        elif score_func=='median':
-            voxel_score = np.median(sem_b[idx_])
-
-        # semantic = sem_b[idx_][np.argmin(dis)]  # if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-        # semantic = np.bincount(sem_b.squeeze()[idx_]).argmax() if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-        voxels[i] = hxyz[idx_][0]
-        semantics[i] = voxel_score
-        # points_f[i][2] += center[2] / 2
-        # voxels.append(hxyz[idx_][0])
-        # semantics.append(semantic)
-        # points_f.append(pcd_b[idx_].mean(axis=0) - center)
-    # debug_set, counts = np.unique(semantics, return_counts=True)
-    return voxels, semantics
+    voxels, semantics = reduce_to_voxels(pcd, sem, voxel_resolution, grid_size, offset, reduction=score_func)
+    return voxels, semantics.astype(np.float64).reshape(-1, 1)
 
 def merge_preds_to_points(preds, points):
     preds = np.load(preds).reshape(-1,1)
@@ -314,6 +257,11 @@ def main(args):
     if os.path.exists(args.output_dir) == False:
         os.mkdir(args.output_dir)
 
+    container = None
+    if args.container:
+        container_path = os.path.join(args.output_dir, VOXEL_GRID_CONTAINER_FILE_NAME)
+        container = VoxelGridWriter(container_path, args.voxel_grid_size, np.float64, voxel_resolution=args.voxel_resolution)
+
     if args.datatype == 'image':
         fov = args.camera_fov
         if args.mask:
@@ -336,7 +284,8 @@ def main(args):
             image_point_cloud, file_name = img2pcd(score, depth_img, mask, fov)
             file_path = os.path.join(args.output_dir, file_name)
 
-            grid = voxelize_one(image_point_cloud, file_path, args.voxel_resolution, args.voxel_grid_size)
+            grid = voxelize_one(image_point_cloud, file_path, args.voxel_resolution, args.voxel_grid_size,
+                                container=container, frame_id=i)
 
     elif args.datatype == 'pointcloud':
         points_data = collect_anovox_files(dataset_path=args.dataset_path, datatype='PCD')
@@ -348,11 +297,15 @@ def main(args):
             pointcloud = merge_preds_to_points(score_file, anovox_pcd)
             file_name = "pcd_voxel_scores_{}.npy".format(str(i).rjust(6,'0'))
             file_path = os.path.join(args.output_dir, file_name)
-            voxelize_one(pointcloud, file_path, args.voxel_resolution, args.voxel_grid_size, args.score_function)
+            voxelize_one(pointcloud, file_path, args.voxel_resolution, args.voxel_grid_size, args.score_function,
+                         container=container, frame_id=i)
 
     else:
         raise NameError('No data type selected. Choose between --images and --pointclouds')
 
+    if container is not None:
+        container.close()
+
     # output_path = '<...>/RbA/voxelpreds'
 
 
@@ -387,12 +340,15 @@ if __name__ == "__main__":
                         help="""path of image to mask region of interest""")
 
     # subparser?
-    parser.add_argument('--score_function', type=str, choices=["mean", "median", "centerpoint"], default="centerpoint",
-                        help=""""determines, how the anomaly score for a single voxel is calculated. Choose between mean, median of all points in voxel, or anomaly score of the point closest to voxel center""")
+    parser.add_argument('--score_function', type=str, choices=["mean", "median", "max", "centerpoint"], default="centerpoint",
+                        help=""""determines, how the anomaly score for a single voxel is calculated. Choose between mean, median, max of all points in voxel, or anomaly score of the point closest to voxel center""")
 
     parser.add_argument('--datatype', type=str, choices=["image", "pointcloud"],
                         help=""""type of data that voxel grids were created from""")
 
+    parser.add_argument('--container', action='store_true',
+                        help="""store all voxel grids in a single voxel grid container in output_dir instead of one npy file per frame. The frame id is the index of the score file""")
+
 
 
     args = parser.parse_args()
@@ -18,12 +18,15 @@ from Definitions import (
 from FileStructureManager import (
     initialize_variables,
 )
-from Models.World import World
 from Scenarios import (
-    ScenarioMain,
-    ScenarioDefinitionGenerator,
+    ScenarioDispatcher,
+    ScenarioWorker,
+    RunManifest,
 )
 
+# the modules that import carla are imported in the functions that need them: the worker processes of
+# ScenarioDispatcher import this script again, and the workers of --fake_servers must run without carla
+
 # initialize colorama
 init(autoreset=True)
 
@@ -35,6 +38,8 @@ def create_scenario_config(nbr_of_scenarios, maps):
     """
     Initializes variables and generates scenario configuration files.
     """
+    from Scenarios import ScenarioDefinitionGenerator
+
     initialize_variables()
     try:
         file_paths = ScenarioDefinitionGenerator.generate_all_scenario_config_files(
@@ -48,12 +53,15 @@ def create_scenario_config(nbr_of_scenarios, maps):
         return False
 
 
-def run_scenarios(file_paths):
+def run_scenarios(file_paths, manifest=None):
     """
     Runs simulations based on the generated scenario configurations.
     """
+    from Models.World import World
+    from Scenarios import ScenarioMain
+
     try:
-        ScenarioMain.run_all_scenarios_from_configs(file_paths)
+        ScenarioMain.run_all_scenarios_from_configs(file_paths, manifest)
         return True
     except Exception as e:
         logging.error(f"{Fore.RED}Error while running scenarios: {e}{Style.RESET_ALL}")
@@ -61,6 +69,26 @@ def run_scenarios(file_paths):
         return False
 
 
+def dispatch_scenarios(file_paths, servers, fake_servers=False, manifest=None):
+    """
+    Runs the scenarios on several carla servers at the same time, see ScenarioDispatcher.
+    """
+    endpoints = [ScenarioDispatcher.parse_server_endpoint(server) for server in servers]
+    runner_factory = ScenarioWorker.FakeScenarioRunner if fake_servers else ScenarioWorker.CarlaScenarioRunner
+    try:
+        summary = ScenarioDispatcher.dispatch_scenarios(
+            file_paths,
+            endpoints,
+            runner_factory=runner_factory,
+            manifest=manifest,
+        )
+        return not summary["failed"]
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        logging.error(f"{Fore.RED}Error while dispatching scenarios: {e}{Style.RESET_ALL}")
+        return False
+
+
 # endregion
 # ======================================================================================================================
 
@@ -75,9 +103,21 @@ def main():
     parser = argparse.ArgumentParser(description='Run scenarios.')
     parser.add_argument('--file_paths', nargs='*', default=None, help='Optional file paths for scenarios.')
     parser.add_argument('--run', action='store_true', help='Run the scenarios after creating the configuration.')
+    parser.add_argument('--servers', nargs='*', default=None,
+                        help='Carla servers as host:port[:tm_port], the scenarios are run on all of them in parallel.')
+    parser.add_argument('--fake_servers', action='store_true',
+                        help='Run the scenarios of --servers on fake servers that only write dummy data (testing).')
+    parser.add_argument('--resume', nargs='?', const='', default=None, metavar='OUTPUT_PATH',
+                        help='With --run, resume an interrupted run (default the latest run): completed scenarios '
+                             'are skipped, partial scenarios are removed and run again.')
     args = parser.parse_args()
 
-    if args.file_paths is None:
+    manifest = None
+    if args.resume is not None:
+        manifest, file_paths = RunManifest.prepare_resume(args.resume)
+        if args.file_paths is not None:
+            file_paths = args.file_paths
+    elif args.file_paths is None:
         file_paths = create_scenario_config(nbr_of_scenarios=NBR_OF_SCENARIOS, maps=USED_MAPS, )
     else:
         file_paths = args.file_paths
@@ -85,8 +125,15 @@ def main():
     if len(file_paths) == len(USED_MAPS):
         logging.info(f"{Fore.GREEN}Scenario configuration succeeded.{Style.RESET_ALL}")
         if args.run:
+            if manifest is not None:
+                # the partial scenarios of the resumed run are only removed now that they are run again
+                manifest.clean_partial_scenarios()
             logging.info("Running scenarios...")
-            if run_scenarios(file_paths):
+            if args.servers:
+                success = dispatch_scenarios(file_paths, args.servers, args.fake_servers, manifest)
+            else:
+                success = run_scenarios(file_paths, manifest)
+            if success:
                 logging.info(f"{Fore.GREEN}Simulation ran successfully. Exiting.{Style.RESET_ALL}")
             else:
                 logging.error(f"{Fore.RED}Simulation failed. Exiting.{Style.RESET_ALL}")
@@ -17,6 +17,7 @@ PACKAGES = [
     "Models.World",
     "Scenarios",
     "DataAnalysis",
+    "Voxelization",
 ]
 
 setup(
@@ -7,27 +7,27 @@ import json
 import logging
 import os
 import sys
+import time
+import queue
+from collections import defaultdict
 from multiprocessing import Pool
 
 import matplotlib.pyplot as plt
 import numpy as np
-import open3d as o3d
 from PIL import Image
 from colorama import Fore, Style
 
 from Definitions import (
+    VOXEL_GROUND_TRUTH_VERSION,
     VOXEL_RESOLUTION_YC,
     VOXEL_SIZE_YC,
-    BEV_OFFSET_FORWARD_YC,
-    BEV_RESOLUTION_YC,
-    OFFSET_Z_YC,
     SENSOR_SETUP_FILE_NAME,
 )
 from EgoVehicleSetup import DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE
-from Tools.LabelUtils import get_label_attributes
+from Voxelization.FrameVoxelization import voxelize_frame
+from Voxelization.VoxelContainer import VOXEL_GRID_CONTAINER_FILE_NAME, VoxelGridReader, VoxelGridWriter
 
-COUNTER_TEST = 0
-LENGHT_FILES = 0
+VOXELIZATION_MANIFEST_FILE_NAME = "voxelization_manifest.jsonl"
 
 # ======================================================================================================================
 # region -- LOGGING ----------------------------------------------------------------------------------------------------
@@ -64,30 +64,6 @@ def visualize_point_clound(point_cloud):
     return
 
 
-def rotate_point_cloud(point_cloud, rotation):
-    """
-    point_cloud: <numpy.ndarray> of shape (<number of points>, 4), containg x, y, z and color, respectively.
-    rotation: (<float>, <float>, <float>) containing x, y, and z rotations, respectively, in degrees.
-
-    This function receives a numpy point cloud of shape (<number of points>, 4), and returns, a numpy point cloud
-    of the same shape, with rotated coordinates.
-    """
-
-    # Create a point cloud object and set its points
-    o3d_pcd = o3d.geometry.PointCloud()
-    o3d_pcd.points = o3d.utility.Vector3dVector(point_cloud[:, :-1])
-
-    # Rotate the point cloud to fit with lidar point cloud
-    gradians = tuple(np.pi * (deg / 180) for deg in rotation)
-    r_matrix = o3d_pcd.get_rotation_matrix_from_xyz(gradians)
-    o3d_pcd.rotate(r_matrix, center=(0, 0, 0))
-
-    # Combine the point cloud coordinates and colors into a single array
-    point_cloud = np.concatenate([np.asarray(o3d_pcd.points), np.array(point_cloud[:, -1]).reshape(-1, 1)], axis=1)
-
-    return point_cloud
-
-
 # endregion
 # ======================================================================================================================
 
@@ -186,105 +162,214 @@ def _get_files_from_one_scenario(scenario_root, scenario_sensor_setup_json_path)
     return file_paths
 
 
-def get_file_paths(root_folder):
-    file_paths = list()
-
+def iter_file_paths(root_folder):
+    """
+    Lazily yields the frame dicts of all scenarios found below root_folder, one scenario after another.
+    """
     for dirpath, dirnames, filenames in os.walk(root_folder):
         cur = dirpath.split('/')[-1]
         if cur[:len('Scenario_')] == 'Scenario_' and [f for f in filenames if f == SENSOR_SETUP_FILE_NAME]:
-            files_from_scenario = _get_files_from_one_scenario(
+            yield from _get_files_from_one_scenario(
                 scenario_root=dirpath,
                 scenario_sensor_setup_json_path=os.path.join(dirpath,
                                                              [f for f in filenames if f == SENSOR_SETUP_FILE_NAME][0])
             )
-            file_paths += files_from_scenario
 
-    global LENGHT_FILES
-    LENGHT_FILES = len(file_paths)
 
-    return file_paths
+def get_voxel_grid_container_path(scenario_root):
+    """
+    Returns the path of the container holding the voxel grids of all frames of a scenario.
+    """
+    return os.path.join(scenario_root, VOXEL_GRID_CONTAINER_FILE_NAME)
+
 
+def get_voxelized_frames(scenario_root):
+    """
+    Returns {frame id: time the voxel grid was written} of all frames in the voxel grid container of a scenario. A
+    container of another ground truth version (see Definitions.VOXEL_GROUND_TRUTH_VERSION) is removed, so all its frames
+    are voxelized again instead of mixing grids of both versions.
+    """
+    container_path = get_voxel_grid_container_path(scenario_root)
+    if not os.path.isfile(container_path):
+        return dict()
+    reader = VoxelGridReader(container_path)
+    if reader.ground_truth_version != VOXEL_GROUND_TRUTH_VERSION:
+        logging.info(
+            f"{container_path} has ground truth version {reader.ground_truth_version}, "
+            f"voxelizing all {len(reader)} frames again with version {VOXEL_GROUND_TRUTH_VERSION}"
+        )
+        del reader
+        os.remove(container_path)
+        return dict()
+    return {frame_id: reader.frame_timestamp(frame_id) for frame_id in reader.frame_ids}
 
-def process_file(args):
-    # Unpack the arguments
-    i, files = args
 
-    update_progress()
+def is_frame_voxelized(files, voxelized_frames):
+    """
+    Checks if the voxel grid of a frame already exists and is newer than all the sensor files it is created from.
+    voxelized_frames are the frames of the scenario container, see get_voxelized_frames.
+    """
+    written = voxelized_frames.get(int(files['frame_number']))
+    if written is None:
+        return False
+
+    for sensor_type in (DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE):
+        for location_rotation in files[sensor_type]:
+            if os.path.getmtime(files[sensor_type][location_rotation]['path']) > written:
+                return False
+    return True
+
 
+def write_manifest_entry(scenario_root, entry):
+    """
+    Appends an entry to the voxelization manifest of a scenario. The manifest is a json lines file, so it stays valid
+    if the voxelization is interrupted.
+    """
+    with open(os.path.join(scenario_root, VOXELIZATION_MANIFEST_FILE_NAME), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def process_file(files):
     # Load data from files
-    point_clouds = list()
     data = dict()
-    location_rotations = set()
     for sensor_type in (DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE, SEMANTIC_LIDAR_TYPE):
         data[sensor_type] = dict()
         for location_rotation in files[sensor_type]:
-            location_rotations.add(location_rotation)
             if sensor_type in (DEPTH_CAM_TYPE, SEMANTIC_CAM_TYPE):
                 data[sensor_type][location_rotation] = np.array(
                     Image.open(files[sensor_type][location_rotation]['path']))
             else:
                 data[sensor_type][location_rotation] = np.load(files[sensor_type][location_rotation]['path'])
 
-    # Handle data loaded from files
-    point_clouds = list()
-    for location_rotation in location_rotations:
-        location, rotation = location_rotation
-
-        if data.get(DEPTH_CAM_TYPE) is not None and data[DEPTH_CAM_TYPE].get(location_rotation) is not None \
-                and data.get(SEMANTIC_CAM_TYPE) is not None and data[SEMANTIC_CAM_TYPE].get(
-            location_rotation) is not None:
-            depth_image_point_cloud = depth_to_pcd(
-                depth_img_data=data[DEPTH_CAM_TYPE][location_rotation],
-                semantic_img_data=data[SEMANTIC_CAM_TYPE][location_rotation],
-                image_width=files[DEPTH_CAM_TYPE][location_rotation]['image_width'],
-                image_height=files[DEPTH_CAM_TYPE][location_rotation]['image_height'],
-                camera_fov=files[DEPTH_CAM_TYPE][location_rotation]['camera_fov']
+    # Voxelize the loaded data, the voxel grid is written to the scenario container by the parent process
+    camera_params = {
+        location_rotation: files[DEPTH_CAM_TYPE][location_rotation] for location_rotation in files[DEPTH_CAM_TYPE]
+    }
+    voxel_data = voxelize_frame(data, camera_params)
+    logging.debug(f"Processed file {files['frame_number']}: created voxel world")
+
+    return voxel_data
+
+
+def _voxelize_frame(files):
+    """
+    Worker function of process_files_parallel. Returns the manifest entry and the voxel grid of the frame. Errors are
+    reported back to the parent process instead of raised, so one broken frame does not stop the whole run.
+    """
+    entry = {'frame_number': files['frame_number'], 'scenario_root': files['scenario_root']}
+    voxel_data = None
+    start_time = time.time()
+    try:
+        voxel_data = process_file(files)
+        entry['file'] = VOXEL_GRID_CONTAINER_FILE_NAME
+        entry['status'] = 'completed'
+    except Exception as e:
+        logging.error(f"Could not voxelize frame {files['frame_number']} of {files['scenario_root']}", exc_info=True)
+        entry['status'] = 'failed'
+        entry['error'] = str(e)
+    entry['seconds'] = round(time.time() - start_time, 3)
+    return entry, voxel_data
+
+
+def process_files_parallel(file_paths, num_processes=10, max_pending=None):
+    """
+    Voxelizes all frames in file_paths, which may be a lazy iterable like iter_file_paths. Frames with an up-to-date
+    voxel grid are skipped, so an interrupted run can simply be restarted. The voxel grids of a scenario are written to
+    its container by the parent process only, and every voxelized frame is recorded in the manifest of its scenario.
+    Progress and throughput are reported from the parent process.
+
+    The frames are discovered lazily by the main thread, which hands at most max_pending frames (default two per
+    process) to the workers at a time and does all bookkeeping. The result callbacks of the pool only queue the results.
+    """
+    max_pending = max_pending or 2 * num_processes
+    progress = {'discovered': 0, 'skipped': 0, 'completed': 0, 'failed': 0}
+
+    # Frames handed to the workers and results received per scenario, a container is closed once all its frames are in
+    dispatched, received = defaultdict(int), defaultdict(int)
+    dispatch_finished = set()
+    writers = dict()
+
+    def pending_frames():
+        scenario_root, voxelized_frames = None, dict()
+        for files in file_paths:
+            if files['scenario_root'] != scenario_root:
+                if scenario_root is not None:
+                    dispatch_finished.add(scenario_root)
+                scenario_root = files['scenario_root']
+                voxelized_frames = get_voxelized_frames(scenario_root)
+
+            progress['discovered'] += 1
+            if is_frame_voxelized(files, voxelized_frames):
+                progress['skipped'] += 1
+                continue
+            dispatched[scenario_root] += 1
+            yield files
+        dispatch_finished.add(scenario_root)
+
+    def get_writer(scenario_root):
+        if scenario_root not in writers:
+            writers[scenario_root] = VoxelGridWriter(
+                get_voxel_grid_container_path(scenario_root),
+                VOXEL_SIZE_YC,
+                value_dtype=np.uint8,
+                voxel_resolution=VOXEL_RESOLUTION_YC,
+                ground_truth_version=VOXEL_GROUND_TRUTH_VERSION,
             )
-        else:
-            depth_image_point_cloud = None
-        if data.get(SEMANTIC_LIDAR_TYPE) is not None and data[SEMANTIC_LIDAR_TYPE].get(location_rotation) is not None:
-            semantic_lidar_point_cloud = data[SEMANTIC_LIDAR_TYPE][location_rotation]
-        else:
-            semantic_lidar_point_cloud = None
-
-        negative_rotation = tuple(-v for v in rotation)
-        for point_cloud in [pc for pc in (depth_image_point_cloud, semantic_lidar_point_cloud) if pc is not None]:
-            point_cloud = rotate_point_cloud(point_cloud=point_cloud, rotation=negative_rotation)
-            for i, v in enumerate(location):
-                point_cloud[:, i] -= v
-        point_clouds.append(point_cloud)
-
-    merged_point_cloud = np.concatenate(point_clouds, axis=0)
-    # visualize_point_clound(merged_point_cloud)
-    file_number = files["frame_number"]
-    file_name = f"VOXEL_GRID_{file_number}"
-
-    # Create a separate Voxel Grid folder for each subfolder
-    voxel_grid_folder = os.path.join(files["scenario_root"], "VOXEL_GRID")
-    os.makedirs(voxel_grid_folder, exist_ok=True)
-
-    # Voxelize the merged point cloud
-    voxel_data = voxelize_one(merged_point_cloud)
-    logging.debug(f"Processed file {i}/{200}: created voxel world")
-
-    # Save voxel grid data
-    output_voxel_grid_path = os.path.join(voxel_grid_folder, file_name)
-    np.save(output_voxel_grid_path, voxel_data)
-
-
-def process_files_parallel(file_paths, num_processes=10):
-    # Create a multiprocessing Pool with the specified number of processes
-    pool = Pool(processes=num_processes)
+        return writers[scenario_root]
+
+    def failed_frame(files, error):
+        # an error of the pool itself, e.g. a frame that could not be sent to a worker
+        entry = {'frame_number': files['frame_number'], 'scenario_root': files['scenario_root']}
+        return {**entry, 'status': 'failed', 'error': str(error), 'seconds': 0.0}, None
 
-    # Prepare arguments for the process_file function
-    # Each argument is a tuple (index, files) for parallel processing
+    start_time = time.time()
+    results = queue.Queue()  # results in the order they are finished
+    frames = pending_frames()
+    in_flight = 0
 
-    args_list = []
-    for i, files in enumerate(file_paths):
-        args_list.append((i, files))
+    # Create a multiprocessing Pool with the specified number of processes
+    pool = Pool(processes=num_processes)
 
-    # Execute the process_file function in parallel using the Pool
-    pool.map(process_file, args_list)
+    try:
+        while True:
+            # discovery advances only as far as the workers need new frames
+            while frames is not None and in_flight < max_pending:
+                files = next(frames, None)
+                if files is None:
+                    frames = None
+                    break
+                pool.apply_async(
+                    _voxelize_frame,
+                    (files,),
+                    callback=results.put,
+                    error_callback=lambda error, files=files: results.put(failed_frame(files, error)),
+                )
+                in_flight += 1
+            if not in_flight:
+                break
+
+            entry, voxel_data = results.get()
+            in_flight -= 1
+            scenario_root = entry.pop('scenario_root')
+            if voxel_data is not None:
+                get_writer(scenario_root).write_frame_array(int(entry['frame_number']), voxel_data)
+            received[scenario_root] += 1
+            progress[entry['status']] += 1
+            write_manifest_entry(scenario_root, entry)
+
+            for root in [r for r in writers if r in dispatch_finished and received[r] == dispatched[r]]:
+                writers.pop(root).close()
+
+            processed = progress['completed'] + progress['failed']
+            print_progress_bar(
+                processed + progress['skipped'],
+                progress['discovered'],
+                processed / max(time.time() - start_time, 1e-9)
+            )
+    finally:
+        # Write the frame index of all containers that are still open, also if the run is interrupted
+        for writer in writers.values():
+            writer.close()
 
     # Close the pool to prevent any more tasks from being submitted
     pool.close()
@@ -292,6 +377,12 @@ def process_files_parallel(file_paths, num_processes=10):
     # Wait for all worker processes to finish
     pool.join()
 
+    logging.info(
+        f"Voxelized {progress['completed']} frames in {time.time() - start_time:.1f}s, "
+        f"skipped {progress['skipped']} up-to-date frames, {progress['failed']} frames failed"
+    )
+    return progress
+
 
 # endregion
 # ======================================================================================================================
@@ -300,16 +391,9 @@ def process_files_parallel(file_paths, num_processes=10):
 # ======================================================================================================================
 # region -- PROGRESS BAR -----------------------------------------------------------------------------------------------
 # ======================================================================================================================
-def update_progress():
-    global COUNTER_TEST
-    global LENGHT_FILES
-    COUNTER_TEST += 20
-    print_progress_bar(COUNTER_TEST, LENGHT_FILES)
-
-
-def print_progress_bar(index, total):
+def print_progress_bar(index, total, frames_per_second=None):
     n_bar = 30  # Modern progress display with 30 blocks
-    progress = index / total
+    progress = index / total if total else 0
     num_blocks = int(n_bar * progress)
     num_spaces = n_bar - num_blocks
     progress_percent = int(progress * 100)
@@ -331,7 +415,8 @@ def print_progress_bar(index, total):
     progress_bar = f"generating data: [{color}{'█' * num_blocks}{' ' * num_spaces}{Style.RESET_ALL}] {progress_percent}%"
 
     # Improved formatting for brackets and scenario progress
-    sys.stdout.write("\r" + progress_bar.ljust(60) + f"({index}/{total})")
+    throughput = f" {frames_per_second:.2f} frames/s" if frames_per_second is not None else ""
+    sys.stdout.write("\r" + progress_bar.ljust(60) + f"({index}/{total}){throughput}")
     sys.stdout.flush()
 
 
@@ -344,77 +429,6 @@ def print_progress_bar(index, total):
 # ======================================================================================================================
 
 
-def depth_to_pcd(depth_img_data, semantic_img_data, image_width, image_height, camera_fov):
-    """Converts a depth image into a point cloud. Each point is colored based on the semantic image."""
-
-    # Initialize lists to store point coordinates and colors
-    point_list = []
-    color_list = []
-
-    # Calculate focal length based on fov
-    focal = image_width / (2.0 * np.tan(camera_fov * np.pi / 360.0))
-
-    # Define center of the image
-    cx = image_width / 2.0  # from camera projection matrix
-    cy = image_height / 2.0
-
-    # Calculate true depth data
-    true_depth_data = calculate_depth(depth_img_data, image_width, image_height)
-
-    # Iterate over each pixel in the image
-    for i in range(image_height):
-        for j in range(image_width):
-            # Get depth value at current pixel
-            z = true_depth_data[i, j]
-
-            # Perform depth projection
-            x, y = (j - cx) * z / focal, (i - cy) * z / focal
-            coordinate = [x, y, z]
-
-            # If the coordinate is too far away, skip it
-            if np.linalg.norm(coordinate) > 100:
-                continue
-
-            # Otherwise, add the coordinate and its corresponding color to the lists
-            point_list.append(coordinate)
-            point_label = semantic_img_data[i][j]
-            color_list.append(point_label)
-
-    depth_pcloud = rotate_point_cloud(
-        point_cloud=np.concatenate([np.asarray(point_list), np.array(color_list).reshape(-1, 1)], axis=1),
-        rotation=(-90, 90, 0)
-    )
-
-    return depth_pcloud
-
-
-# @numba.jit(nopython=True)  # Compile the function with Numba
-def calculate_depth(depth_img, image_width, image_height):
-    # Get the dimensions of the image
-    true_depth_img = np.zeros(
-        (
-            image_height,
-            image_width,
-        )
-    )
-    rows, cols, channels = depth_img.shape
-    # Loop through each pixel in the depth_img
-    for row in range(rows):
-        for col in range(cols):
-            # Get the RGB values of the current pixel
-            pixel = depth_img[row, col]
-
-            # Calculate the true depth value based on the RGB values
-            # The formula used here is specific to the way depth is encoded in the RGB values
-            true_depth_value = 1000 * (pixel[0] + pixel[1] * 256 + pixel[2] * 256 * 256) / (256 * 256 * 256 - 1)
-
-            # Assign the true depth value to the corresponding position in the true depth image
-            true_depth_img[row, col] = true_depth_value
-
-    # Return the true depth image
-    return true_depth_img
-
-
 def merge_gt_pointclouds(lidar_pcd, depth_pcd):
     """
     This function merges lidar point cloud and depth point cloud.
@@ -445,100 +459,6 @@ def merge_gt_pointclouds(lidar_pcd, depth_pcd):
     return new_pcd
 
 
-def voxelize_one(merged_pcd):
-    """
-    This function takes a merged point cloud and voxelizes it.
-    It first calculates the offsets in the x and z directions.
-    Then, it applies a voxel filter to the merged point cloud.
-    Finally, it concatenates the voxel points and semantics into a single array and returns it.
-    """
-
-    # Calculate the offset in the x direction
-    offset_x = BEV_OFFSET_FORWARD_YC * BEV_RESOLUTION_YC
-
-    # Calculate the offset in the z direction
-    offset_z = OFFSET_Z_YC * VOXEL_RESOLUTION_YC
-
-    # Apply a voxel filter to the merged point cloud
-    voxel_points, semantics = voxel_filter(
-        merged_pcd,  # The merged point cloud
-        VOXEL_RESOLUTION_YC,  # The voxel resolution
-        VOXEL_SIZE_YC,  # The voxel size
-        [offset_x, 0, offset_z],  # The offset
-    )
-
-    # Concatenate the voxel points and semantics into a single array
-    data = np.concatenate([voxel_points, semantics], axis=1)
-
-    # Return the voxelized point cloud data
-    return data
-
-
-def voxel_filter(pcloud, voxel_resolution, voxel_size, offset):
-    """
-    This function applies a voxel filter to a point cloud.
-    It first calculates the offsets in the x, y, and z directions.
-    Then, it applies a voxel filter to the point cloud.
-    Finally, it concatenates the voxel points and semantics into a single array and returns it.
-
-    """
-    # Split the point cloud into coordinates and semantics
-    pcd, sem = pcloud[:, :3], pcloud[:, -1:]
-
-    # Convert voxel size and offset to numpy arrays
-    voxel_size, offset = np.asarray(voxel_size), np.asarray(offset)
-
-    # Adjust the offset based on voxel resolution and size
-    offset += voxel_resolution * voxel_size / 2
-
-    # Adjust the point cloud based on the offset
-    pcd_b = pcd + offset
-
-    # Create a mask for points within the voxel grid
-    idx = ((0 <= pcd_b) & (pcd_b < voxel_size * voxel_resolution)).all(axis=1)
-
-    # Apply the mask to the point cloud and semantics
-    pcd_b, sem_b = pcd_b[idx], sem[idx]
-
-    # Compute index for every point in a voxel
-    Dx, Dy, Dz = voxel_size
-    hxyz, hmod = np.divmod(pcd_b, voxel_resolution)
-    h = hxyz[:, 0] + hxyz[:, 1] * Dx + hxyz[:, 2] * Dx * Dy
-
-    # Sort the indices based on h
-    h_idx = np.argsort(h)
-    h, hxyz, sem_b, pcd_b, hmod = h[h_idx], hxyz[h_idx], sem_b[h_idx], pcd_b[h_idx], hmod[h_idx]
-
-    # Get unique values of h and their indices
-    h_n, indices = np.unique(h, return_index=True)
-
-    # Initialize arrays for voxels and semantics
-    n_f = h_n.shape[0]
-    voxels = np.zeros((n_f, 3), dtype=np.uint16)
-    semantics = np.zeros((n_f, 1), dtype=np.uint8)
-
-    # Define the road index
-    road_idx = road_idx = get_label_attributes("color", (157, 234, 50), "id")
-
-    # Loop over each unique value of h
-    for i in range(n_f):
-        # Get the indices for the current value of h
-        idx_ = np.arange(indices[i], indices[i + 1]) if i < n_f - 1 else np.arange(indices[i], h.shape[0])
-
-        # Calculate the distance for each point in the voxel
-        dis = np.sum(hmod[idx_] ** 2, axis=1)
-
-        # Determine the semantic label for the voxel
-        semantic = sem_b[idx_][np.argmin(dis)] if not np.isin(sem_b[idx_], road_idx).any() else road_idx
-
-        # Assign the voxel coordinates and semantic label
-        voxels[i] = hxyz[idx_][0]
-        semantics[i] = semantic
-
-    # Return the voxelized point cloud data
-    return voxels, semantics
-
-
 # endregion
 # ======================================================================================================================
 
@@ -549,19 +469,15 @@ def voxel_filter(pcloud, voxel_resolution, voxel_size, offset):
 
 
 def main():
-    if len(sys.argv) != 2:
-        logging.info("Usage: python3 main.py <input_folder>")
+    if len(sys.argv) < 2:
+        logging.info("Usage: python3 voxelize_separate.py <input_folder> [<input_folder> ...]")
         sys.exit(1)
 
-    input_folder = sys.argv[1]
-    for input_folder in input_folder:
-        logging.info(f"{Fore.YELLOW}Starting getting file_paths ...{Style.RESET_ALL}")
-        file_paths = get_file_paths(input_folder)
-        print('file_paths', len(file_paths))
-
-        logging.info(f"{Fore.GREEN}Finished getting file_paths{Style.RESET_ALL}")
+    for input_folder in sys.argv[1:]:
+        logging.info(f"{Fore.YELLOW}Starting generating data for {input_folder} ...{Style.RESET_ALL}")
 
-        logging.info(f"{Fore.YELLOW}Starting generating data ...{Style.RESET_ALL}")
+        # Frames are discovered lazily while the workers are already voxelizing
+        file_paths = iter_file_paths(input_folder)
 
         # Process files in parallel with a specified number of processes
         process_files_parallel(file_paths, num_processes=20)